@@ -8,6 +8,8 @@ import sys
 from cliff.app import App
 from cliff.commandmanager import CommandManager
 
+from ckan_api_client.profiling import Profiler
+
 
 class CkanClientApp(App):
     log = logging.getLogger(__name__)
@@ -19,6 +21,30 @@ class CkanClientApp(App):
             command_manager=CommandManager('ckan_api_client.cli'),
         )
 
+    def build_option_parser(self, description, version, *args, **kwargs):
+        parser = super(CkanClientApp, self).build_option_parser(
+            description, version, *args, **kwargs)
+        parser.add_argument(
+            '--profile', nargs='?', metavar='FILE',
+            const='ckanclient.prof', default=None,
+            help='Profile the command, writing statistics to FILE '
+            '(default: ckanclient.prof) and printing a summary of the '
+            'time spent in HTTP, JSON and object model')
+        return parser
+
+    def run_subcommand(self, argv):
+        if not self.options.profile:
+            return super(CkanClientApp, self).run_subcommand(argv)
+
+        profiler = Profiler()
+        try:
+            return profiler.runcall(
+                super(CkanClientApp, self).run_subcommand, argv)
+        finally:
+            profiler.dump_stats(self.options.profile)
+            self.stderr.write('Profile written to {0}\n{1}\n'.format(
+                self.options.profile, profiler.format_summary()))
+
 
 def main(argv=sys.argv[1:]):
     myapp = CkanClientApp()
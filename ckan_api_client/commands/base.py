@@ -51,7 +51,7 @@ class CkanCommandBase(Command):
             if row.url == base_url:
                 return row.api_key
 
-    def _get_client(self, parsed_args, klass=CkanHighlevelClient):
+    def _get_client(self, parsed_args, klass=CkanHighlevelClient, **kwargs):
         base_url = parsed_args.url
         if base_url is None:
             base_url = self._get_base_url()
@@ -62,4 +62,4 @@ class CkanCommandBase(Command):
         if api_key is None:
             api_key = self._get_api_key()
 
-        return klass(base_url=base_url, api_key=api_key)
+        return klass(base_url=base_url, api_key=api_key, **kwargs)
@@ -2,7 +2,9 @@
 Commands to query CKan data
 """
 
+import gzip
 import json
+import logging
 import sys
 
 from cliff.lister import Lister
@@ -71,6 +73,62 @@ class GetDataset(CkanCommandBase):
         self.app.stdout.write(json.dumps(dataset.serialize()))
 
 
+class ExportDatasets(CkanCommandBase):
+    """
+    Export all the datasets as JSON Lines (one JSON object per line).
+
+    Datasets are written as soon as they are received, so the whole
+    catalog is never held in memory. Output is compressed with gzip
+    if requested, or if the file name ends in ``.gz``.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(ExportDatasets, self).get_parser(prog_name)
+        parser.add_argument('--output', '-o',
+                            help='File to write to (default: stdout)')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress output with gzip')
+        parser.add_argument('--page-size', type=int, default=100,
+                            help='Number of datasets to request at once')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of pages to request in parallel')
+        return parser
+
+    def _open_output(self, filename, compress):
+        if filename is None or filename == '-':
+            if compress:
+                # Closing the GzipFile doesn't close stdout
+                return gzip.GzipFile(fileobj=self.app.stdout, mode='wb')
+            return self.app.stdout
+        if compress or filename.endswith('.gz'):
+            return gzip.open(filename, 'wb')
+        return open(filename, 'wb')
+
+    def take_action(self, parsed_args):
+        client = self._get_client(parsed_args)
+        datasets = client.iter_datasets_bulk(
+            page_size=parsed_args.page_size,
+            concurrency=parsed_args.concurrency)
+
+        output = self._open_output(parsed_args.output, parsed_args.gzip)
+        count = 0
+        try:
+            for dataset in datasets:
+                output.write(json.dumps(dataset.serialize(), sort_keys=True))
+                output.write('\n')
+                count += 1
+                if count % parsed_args.page_size == 0:
+                    output.flush()
+            output.flush()
+        finally:
+            if output is not self.app.stdout:
+                output.close()
+
+        self.log.info('Exported {0} datasets'.format(count))
+
+
 class ImportDataset(CkanCommandBase):
     """Import a dataset from JSON file"""
 
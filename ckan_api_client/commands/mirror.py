@@ -0,0 +1,64 @@
+"""
+Command to mirror a Ckan catalog to local storage
+"""
+
+import logging
+
+from ckan_api_client.low_level import CkanLowlevelClient
+from ckan_api_client.mirror import CatalogMirror, guess_format, open_store
+from .base import CkanCommandBase
+
+
+class Mirror(CkanCommandBase):
+    """
+    Mirror datasets, groups and organizations to a directory,
+    a SQLite database or a tar archive.
+
+    The output can be imported with ``import_directory`` or
+    ``import_sqlite``. Use ``--incremental`` to only fetch the
+    datasets modified since the previous run (not supported
+    by archives).
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(Mirror, self).get_parser(prog_name)
+        parser.add_argument('destination',
+                            help='Directory, SQLite database (.sqlite, '
+                            '.db) or archive (.tar.gz, .tar.bz2, ..)')
+        parser.add_argument('--format',
+                            choices=('directory', 'sqlite', 'archive'),
+                            help='Output format (default: guessed from '
+                            'the destination extension)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only fetch datasets modified since '
+                            'the previous run')
+        parser.add_argument('--page-size', type=int, default=100,
+                            help='Number of datasets to request at once')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Number of requests to run in parallel')
+        parser.add_argument('--no-bulk', dest='bulk', action='store_false',
+                            help='Fetch datasets one by one (slower)')
+        return parser
+
+    def take_action(self, parsed_args):
+        format = (parsed_args.format
+                  or guess_format(parsed_args.destination))
+        if parsed_args.incremental and format == 'archive':
+            raise ValueError('Archives cannot be updated incrementally: '
+                             '--incremental requires a directory or '
+                             'a SQLite database')
+
+        client = self._get_client(parsed_args, CkanLowlevelClient,
+                                  pool_size=parsed_args.concurrency)
+        store = open_store(parsed_args.destination, format)
+
+        mirror = CatalogMirror(
+            client, store, page_size=parsed_args.page_size,
+            concurrency=parsed_args.concurrency, bulk=parsed_args.bulk)
+        counts = mirror.run(incremental=parsed_args.incremental)
+
+        for obj_type in ('dataset', 'group', 'organization'):
+            self.log.info('{0}: {1[written]} written, {1[deleted]} deleted'
+                          .format(obj_type, counts[obj_type]))
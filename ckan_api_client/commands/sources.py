@@ -0,0 +1,60 @@
+"""
+Commands to convert harvest sources between formats
+"""
+
+import logging
+
+from cliff.command import Command
+
+from ckan_api_client.sources import (
+    SourceArchive, extract_archive, open_source, write_archive)
+
+
+class ArchiveCreate(Command):
+    """
+    Convert a source directory, SQLite database (``.sqlite``, ``.db``)
+    or archive to a source archive.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(ArchiveCreate, self).get_parser(prog_name)
+        parser.add_argument('source', help='Source to be converted')
+        parser.add_argument('archive', help='Archive to be written')
+        parser.add_argument('--append', action='store_true',
+                            help='Add objects to an existing archive, '
+                            'replacing the ones with the same key')
+        return parser
+
+    def take_action(self, parsed_args):
+        source = open_source(parsed_args.source)
+        try:
+            counts = write_archive(source, parsed_args.archive,
+                                   append=parsed_args.append)
+        finally:
+            source.close()
+        self.log.info('Archived {0[dataset]} datasets, {0[group]} groups, '
+                      '{0[organization]} organizations'.format(counts))
+
+
+class ArchiveExtract(Command):
+    """
+    Convert a source archive to a directory, or to a SQLite
+    database (if the destination ends in ``.sqlite`` or ``.db``).
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(ArchiveExtract, self).get_parser(prog_name)
+        parser.add_argument('archive', help='Archive to be read')
+        parser.add_argument('destination',
+                            help='Directory or SQLite database')
+        return parser
+
+    def take_action(self, parsed_args):
+        with SourceArchive(parsed_args.archive) as archive:
+            counts = extract_archive(archive, parsed_args.destination)
+        self.log.info('Extracted {0[dataset]} datasets, {0[group]} groups, '
+                      '{0[organization]} organizations'.format(counts))
@@ -2,11 +2,13 @@
 Commands to query CKan data
 """
 
-import json
 import logging
 import os
 import sqlite3
 
+from ckan_api_client.sources import (
+    DirectorySource, SourceArchive, SourceManifest, iter_sqlite_table)
+from ckan_api_client.orchestrator import MultiSourceSync, load_manifest
 from ckan_api_client.syncing import SynchronizationClient
 from .base import CkanCommandBase
 
@@ -23,6 +25,18 @@ class ImportDirectory(CkanCommandBase):
         |   '-- <json files>
         '-- organization
             '-- <json files>
+
+    Files are read by a pool of ``--concurrency`` threads. With
+    ``--stream``, datasets are synchronized as they are read (see
+    :py:meth:`SynchronizationClient.sync_stream()
+    <ckan_api_client.syncing.SynchronizationClient.sync_stream>`),
+    instead of loading them all upfront.
+
+    ``--manifest`` (which implies ``--stream``) keeps track of the
+    modification time and size of the dataset files at the last
+    successful import, so that the unchanged ones are skipped.
+    As changes made on the Ckan side are not detected, the manifest
+    should be removed to force a full import.
     """
 
     log = logging.getLogger(__name__)
@@ -31,23 +45,23 @@ class ImportDirectory(CkanCommandBase):
         parser = super(ImportDirectory, self).get_parser(prog_name)
         parser.add_argument('source_name', nargs=1)
         parser.add_argument('source_dir', nargs=1)
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of files read in parallel')
+        parser.add_argument('--stream', action='store_true',
+                            help='Synchronize datasets as they are read, '
+                            'instead of loading them all')
+        parser.add_argument('--manifest',
+                            help='File recording the state of the source '
+                            'files, to skip the unchanged ones')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of datasets processed at once '
+                            'when streaming (default: 100)')
         return parser
 
-    def _load_data(self, source_dir):
-        data = {}
-        for obj_type in ('dataset', 'group', 'organization'):
-            data[obj_type] = {}
-            base_dir = os.path.join(source_dir, obj_type)
-            for basename in os.listdir(base_dir):
-                if basename.startswith('.') or basename.endswith('~'):
-                    # Skip hidden / backup files
-                    continue
-                filename = os.path.join(base_dir, basename)
-                with open(filename, 'rb') as f:
-                    obj = json.load(f)
-                key = obj['id'] if obj_type == 'dataset' else obj['name']
-                data[obj_type][key] = obj
-        return data
+    def _load_data(self, source_dir, concurrency=4):
+        source = DirectorySource(source_dir, concurrency=concurrency)
+        return dict((obj_type, source.load_all(obj_type))
+                    for obj_type in ('dataset', 'group', 'organization'))
 
     def take_action(self, parsed_args):
         client = self._get_client(parsed_args, SynchronizationClient)
@@ -59,14 +73,59 @@ class ImportDirectory(CkanCommandBase):
             source_dir = os.getcwd()
         source_dir = os.path.abspath(source_dir)
 
+        if parsed_args.stream or parsed_args.manifest:
+            return self._sync_stream(client, source_name, source_dir,
+                                     parsed_args)
+
         # Load data into a big dictionary
         self.log.info("Loading data")
-        data = self._load_data(source_dir)
+        data = self._load_data(source_dir, parsed_args.concurrency)
 
         # Run syncing and hope for the best!
         self.log.info("Synchronizing data")
         client.sync(source_name, data)
 
+    def _sync_stream(self, client, source_name, source_dir, parsed_args):
+        source = DirectorySource(source_dir,
+                                 concurrency=parsed_args.concurrency)
+        files = source.list_files('dataset')
+
+        manifest, source_ids, names = None, None, files
+        if parsed_args.manifest:
+            manifest = SourceManifest(parsed_args.manifest)
+            manifest.retain('dataset', files)
+            names = [name for name, stat in files.iteritems()
+                     if not manifest.is_unchanged('dataset', name, stat)]
+            self.log.info("{0} dataset files changed, out of {1}"
+                          .format(len(names), len(files)))
+
+            # Keys of the changed files are added as they are read;
+            # sync_stream() only uses source_ids after that.
+            source_ids = set(
+                manifest.get_key('dataset', name)
+                for name in set(files) - set(names))
+
+        def _iter_datasets():
+            for name, key, dataset in source.iter_objects('dataset', names):
+                if manifest is not None:
+                    manifest.update('dataset', name, files[name], key)
+                    source_ids.add(key)
+                yield key, dataset
+
+        self.log.info("Synchronizing data (streaming)")
+        report = client.sync_stream(
+            source_name, _iter_datasets(),
+            groups=source.load_all('group'),
+            organizations=source.load_all('organization'),
+            chunk_size=parsed_args.batch_size, source_ids=source_ids)
+
+        if manifest is not None:
+            if report.failures:
+                self.log.warning("Some operations failed: not updating "
+                                 "the manifest")
+            else:
+                manifest.save()
+
 
 class ImportSQLite(CkanCommandBase):
     """
@@ -78,6 +137,18 @@ class ImportSQLite(CkanCommandBase):
 
     - ``id`` can be INT or VARCHAR
     - ``json_data`` is TEXT containing a JSON-serialized object
+
+    With ``--stream``, datasets are read from the database in batches
+    and synchronized as they are parsed (see
+    :py:meth:`SynchronizationClient.sync_stream()
+    <ckan_api_client.syncing.SynchronizationClient.sync_stream>`),
+    instead of loading the whole table upfront.
+
+    If the dataset table has a column telling when each row was
+    last modified, ``--modified-column`` and ``--modified-since``
+    can be used to only read the rows changed since a previous run
+    (the column should be indexed). Datasets whose id is no longer
+    in the table are still deleted. This implies ``--stream``.
     """
 
     log = logging.getLogger(__name__)
@@ -89,17 +160,29 @@ class ImportSQLite(CkanCommandBase):
         parser.add_argument('--dataset-table', default='dataset')
         parser.add_argument('--group-table', default='group')
         parser.add_argument('--organization-table', default='organization')
+        parser.add_argument('--stream', action='store_true',
+                            help='Read and synchronize datasets in '
+                            'batches, instead of loading them all')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows read at once when '
+                            'streaming (default: 500)')
+        parser.add_argument('--modified-column',
+                            help='Column of the dataset table holding '
+                            'the last modification time of rows')
+        parser.add_argument('--modified-since',
+                            help='Only import datasets whose modified '
+                            'column is greater than or equal to this')
         return parser
 
-    def _load_from_table(self, db, table):
-        query = 'SELECT * FROM "{0}";'.format(table)
+    def _iter_ids(self, db, table):
+        # Only reads the primary key index
         cur = db.cursor()
-        cur.execute(query)
-        data = {}
-        for row in cur.fetchall():
-            obj = json.loads(row['json_data'])
-            data[str(row['id'])] = obj
-        return data
+        cur.execute('SELECT id FROM "{0}"'.format(table))
+        for row in cur:
+            yield str(row['id'])
+
+    def _load_from_table(self, db, table):
+        return dict(iter_sqlite_table(db, table))
 
     def take_action(self, parsed_args):
         client = self._get_client(parsed_args, SynchronizationClient)
@@ -107,6 +190,15 @@ class ImportSQLite(CkanCommandBase):
         sqlite_db = sqlite3.connect(parsed_args.sqlite_file[0])
         sqlite_db.row_factory = sqlite3.Row
 
+        if parsed_args.modified_since is not None:
+            if parsed_args.modified_column is None:
+                raise ValueError('--modified-since requires '
+                                 '--modified-column')
+            parsed_args.stream = True
+
+        if parsed_args.stream:
+            return self._sync_stream(client, sqlite_db, parsed_args)
+
         self.log.info("Loading data from SQLite db")
         data = {
             'dataset': self._load_from_table(
@@ -119,3 +211,105 @@ class ImportSQLite(CkanCommandBase):
 
         self.log.info("Synchronizing data")
         client.sync(parsed_args.source_name[0], data)
+
+    def _sync_stream(self, client, sqlite_db, parsed_args):
+        source_ids = None
+        where, params = None, ()
+        if parsed_args.modified_since is not None:
+            where = '"{0}" >= ?'.format(parsed_args.modified_column)
+            params = (parsed_args.modified_since,)
+            source_ids = set(
+                self._iter_ids(sqlite_db, parsed_args.dataset_table))
+
+        datasets = iter_sqlite_table(
+            sqlite_db, parsed_args.dataset_table,
+            batch_size=parsed_args.batch_size, where=where, params=params)
+
+        # Groups and organizations are few: load them upfront
+        self.log.info("Synchronizing data (streaming)")
+        client.sync_stream(
+            parsed_args.source_name[0], datasets,
+            groups=self._load_from_table(
+                sqlite_db, parsed_args.group_table),
+            organizations=self._load_from_table(
+                sqlite_db, parsed_args.organization_table),
+            chunk_size=parsed_args.batch_size,
+            source_ids=source_ids)
+
+
+class ImportArchive(CkanCommandBase):
+    """
+    Import data from a source archive (see ``archive_create``),
+    synchronizing datasets as they are read.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(ImportArchive, self).get_parser(prog_name)
+        parser.add_argument('source_name', nargs=1)
+        parser.add_argument('archive', nargs=1)
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of datasets processed at once '
+                            '(default: 100)')
+        return parser
+
+    def take_action(self, parsed_args):
+        client = self._get_client(parsed_args, SynchronizationClient)
+
+        self.log.info("Synchronizing data from archive")
+        with SourceArchive(parsed_args.archive[0]) as archive:
+            client.sync_source(parsed_args.source_name[0], archive,
+                               chunk_size=parsed_args.batch_size)
+
+
+class SyncSources(CkanCommandBase):
+    """
+    Synchronize all the sources listed in a manifest, concurrently,
+    crawling the Ckan catalog only once (see
+    :py:mod:`ckan_api_client.orchestrator`).
+
+    Exits with a non-zero status if any source failed.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(SyncSources, self).get_parser(prog_name)
+        parser.add_argument('manifest', help='JSON manifest of sources')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of sources synchronized at once')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Number of datasets synchronized at '
+                            'once, for each source')
+        parser.add_argument('--rate-limit', type=float,
+                            help='Maximum number of requests per second, '
+                            'for all the sources together')
+        parser.add_argument('--no-fail-fast', dest='fail_fast',
+                            action='store_false',
+                            help='Go on synchronizing a source after '
+                            'an operation failed')
+        return parser
+
+    def take_action(self, parsed_args):
+        sources = load_manifest(parsed_args.manifest)
+        syncer = self._get_client(
+            parsed_args, MultiSourceSync, workers=parsed_args.workers,
+            concurrency=parsed_args.concurrency,
+            rate_limit=parsed_args.rate_limit,
+            fail_fast=parsed_args.fail_fast)
+
+        results = syncer.run(sources)
+
+        failed = False
+        for name, _ in sources:
+            result = results[name]
+            if isinstance(result, Exception):
+                self.log.error('{0}: failed: {1}'.format(name, result))
+                failed = True
+                continue
+            if not result.ok:
+                failed = True
+            self.log.info('{0}: {1!r}, {2} failures'.format(
+                name, result.counts, len(result.failures)))
+        return 1 if failed else 0
@@ -1,10 +1,15 @@
 import logging
 import random
 import string
+import threading
 
 from .objects import CkanDataset, CkanOrganization, CkanGroup
+from . import tracing
+from .tracing import traced
 from .low_level import CkanLowlevelClient
 from .exceptions import OperationFailure, HTTPError
+from .utils import iter_parallel, IdentityMap
+from .verification import VerificationPolicy, BackgroundVerifier
 
 
 logger = logging.getLogger(__name__)
@@ -28,11 +33,63 @@ class CkanHighlevelClient(object):
         Whether to fail on "inconsistencies" (mismatching updated objects).
         This is especially useful during development, in order to catch
         many problems with the client itself (or new bugs in Ckan..).
+
+    :param verification:
+        Policy used to verify objects returned by create / update
+        operations against the ones that were sent.
+        Either a :py:class:`VerificationPolicy
+        <.verification.VerificationPolicy>` or one of the mode names:
+        ``'full'`` (the default), ``'sampled'``, ``'fingerprint'``
+        or ``'off'``. Can be overridden on each call, by passing
+        the ``verify`` argument.
+
+    :param identity_map:
+        If ``True``, keep a cache of organizations and groups,
+        indexed by id and name, so that repeated lookups don't
+        hit the API again. Any write on an object (create, update,
+        delete -- whether successful or not) evicts it from the map;
+        successful creates / updates store the returned object.
+
+        .. warning::
+            Objects returned from the map are shared between callers:
+            changes made to them are seen by further lookups, until
+            they are written back.
+
+    :param request_hooks:
+        List of :py:class:`RequestHook <.hooks.RequestHook>` to be
+        called around each HTTP request (see :py:mod:`.hooks`).
+
+    :param max_retries:
+        Number of times idempotent requests are retried on
+        connection errors or 502 / 503 / 504 responses.
+
+    :param pool_size:
+        Maximum number of HTTP connections kept open for reuse.
+        Should be at least the concurrency of bulk operations.
+
+    :param session:
+        :py:class:`requests.Session` to be used by the low-level
+        client, to share its connection pool.
     """
 
-    def __init__(self, base_url, api_key=None, fail_on_inconsistency=False):
-        self._client = CkanLowlevelClient(base_url, api_key)
+    def __init__(self, base_url, api_key=None, fail_on_inconsistency=False,
+                 verification=None, identity_map=False, request_hooks=None,
+                 max_retries=0, pool_size=10, session=None):
+        self._client = CkanLowlevelClient(
+            base_url, api_key, hooks=request_hooks, max_retries=max_retries,
+            pool_size=pool_size, session=session)
         self._fail_on_inconsistency = fail_on_inconsistency
+        self._verification = VerificationPolicy.get(verification)
+        self._verification_modes = {}
+        self._verification_lock = threading.Lock()
+        self._background_verifier = BackgroundVerifier(
+            self._mismatching_object)
+        self._identity_maps = None
+        if identity_map:
+            self._identity_maps = {
+                'organization': IdentityMap(),
+                'group': IdentityMap(),
+            }
 
     # ------------------------------------------------------------
     # Datasets management
@@ -42,11 +99,87 @@ class CkanHighlevelClient(object):
         """:return: a list of dataset ids"""
         return self._client.list_datasets()
 
+    def list_dataset_names(self):
+        """:return: a list of the names of all the active datasets"""
+        return self._client.list_dataset_names()
+
+    def iter_modified_dataset_ids(self, since=None, page_size=100):
+        """
+        Iterate ids of the datasets modified since a given time,
+        oldest first.
+
+        :param since: ``metadata_modified`` value (ISO 8601, UTC)
+        :return: generator of ``(id, metadata_modified)`` tuples
+        """
+        return self._client.iter_modified_dataset_ids(
+            since=since, page_size=page_size)
+
+    def iter_modified_datasets(self, since=None, page_size=100,
+                               include_private=False):
+        """
+        Iterate over the active datasets modified since a given time
+        (or all of them), oldest first, fetching them in pages of
+        ``page_size`` through ``package_search``.
+
+        Pages are requested one at a time, by ``metadata_modified``
+        range: datasets changed during the iteration may be yielded
+        twice, but are never missed.
+
+        :param since: ``metadata_modified`` value (ISO 8601, UTC)
+        :param include_private: whether to include private datasets
+        :return: generator of :py:class:`CkanDataset
+            <.objects.ckan_dataset.CkanDataset>` objects
+        """
+        datasets = self._client.iter_modified_datasets(
+            since=since, page_size=page_size,
+            include_private=include_private)
+        for data in datasets:
+            yield CkanDataset(data)
+
     def iter_datasets(self):
         """Generator, iterating over all the datasets in ckan"""
         for id in self.list_datasets():
             yield self.get_dataset(id)
 
+    def iter_datasets_bulk(self, page_size=100, concurrency=4,
+                           include_private=False):
+        """
+        Iterate over all the active datasets (public ones only, unless
+        ``include_private`` is ``True``), fetching them in pages of
+        ``page_size`` through ``package_search``, with up to
+        ``concurrency`` pages requested in parallel.
+
+        This takes far fewer requests than :py:meth:`iter_datasets`,
+        but datasets are yielded in no particular order, and
+        datasets changed during the iteration may be missed or
+        yielded twice.
+
+        :raises: the first error occurred fetching a page
+        :return: generator of :py:class:`CkanDataset
+            <.objects.ckan_dataset.CkanDataset>` objects
+        """
+        datasets = self._client.iter_datasets_bulk(
+            page_size=page_size, concurrency=concurrency,
+            include_private=include_private)
+        for data in datasets:
+            yield CkanDataset(data)
+
+    def iter_dataset_fields(self, fields, page_size=1000, concurrency=4):
+        """
+        Iterate over a few (search index) fields of all the datasets,
+        including private ones, through ``package_search``. This is
+        much cheaper than retrieving whole datasets.
+
+        :param fields: list of field names, such as
+            ``['id', 'extras_somekey']``
+        :return: generator of dicts, holding the fields that
+            are set on each dataset
+        """
+        return self._client.iter_datasets_bulk(
+            page_size=page_size, concurrency=concurrency, fl=fields,
+            include_private=True)
+
+    @traced('hl.get_dataset')
     def get_dataset(self, id, allow_deleted=False):
         """
         Get a specific dataset, by id
@@ -80,6 +213,7 @@ class CkanHighlevelClient(object):
 
         return CkanDataset(data)
 
+    @traced('hl.get_dataset_by_name', arg_name='name')
     def get_dataset_by_name(self, name, allow_deleted=False):
         """
         Get a specific dataset, by name
@@ -105,7 +239,7 @@ class CkanHighlevelClient(object):
 
         return CkanDataset(data)
 
-    def save_dataset(self, dataset):
+    def save_dataset(self, dataset, verify=None):
         """
         If the dataset already has an id, call :py:meth:`update_dataset`,
         otherwise, call :py:meth:`create_dataset`.
@@ -118,13 +252,37 @@ class CkanHighlevelClient(object):
             raise TypeError("Dataset must be a CkanDataset")
 
         if dataset.id is not None:
-            return self.update_dataset(dataset)
-        return self.create_dataset(dataset)
+            return self.update_dataset(dataset, verify=verify)
+        return self.create_dataset(dataset, verify=verify)
 
-    def create_dataset(self, dataset):
+    def save_datasets(self, datasets, concurrency=4, verify=None):
+        """
+        Save (create or update) many datasets, running up to
+        ``concurrency`` requests in parallel.
+
+        The input iterable is consumed lazily, as the results
+        are consumed.
+
+        :param datasets:
+            iterable of :py:class:`CkanDataset
+            <.objects.ckan_dataset.CkanDataset>` objects
+        :return:
+            generator yielding a :py:class:`BatchResult
+            <.utils.BatchResult>` for each dataset, as soon as
+            the operation completes.
+        """
+        return iter_parallel(
+            lambda dataset: self.save_dataset(dataset, verify=verify),
+            datasets, concurrency=concurrency)
+
+    @traced('hl.create_dataset')
+    def create_dataset(self, dataset, verify=None):
         """
         Create a dataset
 
+        :param verify:
+            verification policy (or mode name) to be used instead
+            of the client-wide one, for this call only.
         :rtype: :py:class:`CkanDataset <.objects.ckan_dataset.CkanDataset>`
         """
 
@@ -133,19 +291,24 @@ class CkanHighlevelClient(object):
         if dataset.id is not None:
             raise ValueError("Cannot specify an id when creating an object")
 
-        data = self._client.post_dataset(dataset.serialize())
+        with tracing.span('serialize'):
+            serialized = dataset.serialize()
+        data = self._client.post_dataset(serialized)
         created = CkanDataset(data)
 
-        if not created.is_equivalent(dataset):
-            self._mismatching_object("Created dataset doesn't match",
-                                     dataset, created)
+        self._verify_written("Created dataset doesn't match",
+                             dataset, created, serialized, data, verify)
 
         return created
 
-    def update_dataset(self, dataset):
+    @traced('hl.update_dataset')
+    def update_dataset(self, dataset, verify=None):
         """
         Update a dataset
 
+        :param verify:
+            verification policy (or mode name) to be used instead
+            of the client-wide one, for this call only.
         :rtype: :py:class:`CkanDataset <.objects.ckan_dataset.CkanDataset>`
         """
 
@@ -159,7 +322,8 @@ class CkanHighlevelClient(object):
         # we are updating things correctly.
 
         original_dataset = self.get_dataset(dataset.id)
-        updates_dict = dataset.serialize()
+        with tracing.span('serialize'):
+            updates_dict = dataset.serialize()
 
         # ------------------------------------------------------------
         # Process the Extras field
@@ -181,12 +345,12 @@ class CkanHighlevelClient(object):
         updated = CkanDataset(data)
 
         # Make sure the returned dataset matches the desired state
-        if not updated.is_equivalent(dataset):
-            self._mismatching_object("Updated dataset doesn't match",
-                                     dataset, updated)
+        self._verify_written("Updated dataset doesn't match",
+                             dataset, updated, updates_dict, data, verify)
 
         return updated
 
+    @traced('hl.delete_dataset')
     def delete_dataset(self, id):
         """Delete a dataset, by id"""
         self._client.delete_dataset(id)
@@ -217,6 +381,7 @@ class CkanHighlevelClient(object):
         for name in self.list_organization_names():
             yield self.get_organization_by_name(name)
 
+    @traced('hl.get_organization')
     def get_organization(self, id, allow_deleted=False):
         """
         Get organization, by id.
@@ -233,19 +398,26 @@ class CkanHighlevelClient(object):
             <.objects.ckan_organization.CkanOrganization>`
         """
 
-        data = self._client.get_organization(id)
+        organization = self._get_cached('organization', id=id)
 
-        if data['id'] != id:
-            raise HTTPError(404, '(logical) organization id mismatch')
+        if organization is None:
+            data = self._client.get_organization(id)
 
-        if not (allow_deleted or data['state'] == 'active'):
-            raise HTTPError(404, '(logical) organization state is deleted')
+            if data['id'] != id:
+                raise HTTPError(404, '(logical) organization id mismatch')
 
-        if 'extras' in data:
-            data['extras'] = _destupidize_dict(data['extras'])
+            if 'extras' in data:
+                data['extras'] = _destupidize_dict(data['extras'])
+
+            organization = CkanOrganization(data)
+            self._set_cached('organization', organization)
+
+        if not (allow_deleted or organization.state == 'active'):
+            raise HTTPError(404, '(logical) organization state is deleted')
 
-        return CkanOrganization(data)
+        return organization
 
+    @traced('hl.get_organization_by_name', arg_name='name')
     def get_organization_by_name(self, name, allow_deleted=False):
         """
         Get organization by name.
@@ -262,28 +434,44 @@ class CkanHighlevelClient(object):
             <.objects.ckan_organization.CkanOrganization>`
         """
 
-        data = self._client.get_organization(name)
+        organization = self._get_cached('organization', name=name)
 
-        if data['name'] != name:
-            raise HTTPError(404, '(logical) organization name mismatch')
+        if organization is None:
+            data = self._client.get_organization(name)
 
-        if not (allow_deleted or data['state'] == 'active'):
-                raise HTTPError(404, '(logical) organization state is deleted')
+            if data['name'] != name:
+                raise HTTPError(404, '(logical) organization name mismatch')
 
-        if 'extras' in data:
-            data['extras'] = _destupidize_dict(data['extras'])
+            if 'extras' in data:
+                data['extras'] = _destupidize_dict(data['extras'])
 
-        return CkanOrganization(data)
+            organization = CkanOrganization(data)
+            self._set_cached('organization', organization)
 
-    def save_organization(self, organization):
+        if not (allow_deleted or organization.state == 'active'):
+            raise HTTPError(404, '(logical) organization state is deleted')
+
+        return organization
+
+    def save_organization(self, organization, verify=None):
         if not isinstance(organization, CkanOrganization):
             raise TypeError("Organization must be a CkanOrganization")
 
         if organization.id is not None:
-            return self.update_organization(organization)
-        return self.create_organization(organization)
+            return self.update_organization(organization, verify=verify)
+        return self.create_organization(organization, verify=verify)
+
+    def save_organizations(self, organizations, concurrency=4, verify=None):
+        """
+        Save many organizations, in parallel.
+        See :py:meth:`save_datasets`.
+        """
+        return iter_parallel(
+            lambda org: self.save_organization(org, verify=verify),
+            organizations, concurrency=concurrency)
 
-    def create_organization(self, organization):
+    @traced('hl.create_organization')
+    def create_organization(self, organization, verify=None):
         """
         Create an organization
 
@@ -296,24 +484,29 @@ class CkanHighlevelClient(object):
         if organization.id is not None:
             raise ValueError("Cannot specify an id when creating an object")
 
-        serialized = organization.serialize()
+        with tracing.span('serialize'):
+            serialized = organization.serialize()
+        expected_data = dict(serialized)
         if 'extras' in serialized:
             serialized['extras'] = _stupidize_dict(serialized['extras'])
 
+        self._evict_cached('organization', name=organization.name)
         data = self._client.post_organization(serialized)
 
         if 'extras' in data:
             data['extras'] = _destupidize_dict(data['extras'])
 
         created = CkanOrganization(data)
+        self._set_cached('organization', created)
 
-        if not created.is_equivalent(organization):
-            self._mismatching_object("Created organization doesn't match",
-                                     organization, created)
+        self._verify_written("Created organization doesn't match",
+                             organization, created, expected_data, data,
+                             verify)
 
         return created
 
-    def update_organization(self, organization):
+    @traced('hl.update_organization')
+    def update_organization(self, organization, verify=None):
         """
         :rtype: :py:class:`CkanOrganization
             <.objects.ckan_organization.CkanOrganization>`
@@ -323,24 +516,31 @@ class CkanHighlevelClient(object):
         if organization.id is None:
             raise ValueError("Trying to update a organization without an id")
 
-        serialized = organization.serialize()
+        with tracing.span('serialize'):
+            serialized = organization.serialize()
+        expected_data = dict(serialized)
         if 'extras' in serialized:
             serialized['extras'] = _stupidize_dict(serialized['extras'])
 
+        self._evict_cached('organization', id=organization.id,
+                           name=organization.name)
         data = self._client.put_organization(serialized)
 
         if 'extras' in data:
             data['extras'] = _destupidize_dict(data['extras'])
 
         updated = CkanOrganization(data)
+        self._set_cached('organization', updated)
 
-        if not updated.is_equivalent(organization):
-            self._mismatching_object("Updated organization doesn't match",
-                                     organization, updated)
+        self._verify_written("Updated organization doesn't match",
+                             organization, updated, expected_data, data,
+                             verify)
 
         return updated
 
+    @traced('hl.delete_organization')
     def delete_organization(self, id):
+        self._evict_cached('organization', id=id)
         self._client.delete_organization(id)
 
     # ------------------------------------------------------------
@@ -362,6 +562,7 @@ class CkanHighlevelClient(object):
         for id in self.list_groups():
             yield self.get_group(id)
 
+    @traced('hl.get_group')
     def get_group(self, id, allow_deleted=False):
         """
         Get group, by id.
@@ -377,16 +578,23 @@ class CkanHighlevelClient(object):
         :rtype: :py:class:`CkanGroup <.objects.ckan_group.CkanGroup>`
         """
 
-        data = self._client.get_group(id)
+        group = self._get_cached('group', id=id)
 
-        if data['id'] != id:
-            raise HTTPError(404, '(logical) group id mismatch')
+        if group is None:
+            data = self._client.get_group(id)
 
-        if not (allow_deleted or data['state'] == 'active'):
+            if data['id'] != id:
+                raise HTTPError(404, '(logical) group id mismatch')
+
+            group = CkanGroup(data)
+            self._set_cached('group', group)
+
+        if not (allow_deleted or group.state == 'active'):
             raise HTTPError(404, '(logical) group state is deleted')
 
-        return CkanGroup(data)
+        return group
 
+    @traced('hl.get_group_by_name', arg_name='name')
     def get_group_by_name(self, name, allow_deleted=False):
         """
         Get group by name.
@@ -402,25 +610,41 @@ class CkanHighlevelClient(object):
         :rtype: :py:class:`CkanGroup <.objects.ckan_group.CkanGroup>`
         """
 
-        data = self._client.get_group(name)
+        group = self._get_cached('group', name=name)
 
-        if data['name'] != name:
-            raise HTTPError(404, '(logical) group name mismatch')
+        if group is None:
+            data = self._client.get_group(name)
 
-        if not (allow_deleted or data['state'] == 'active'):
-                raise HTTPError(404, '(logical) group state is deleted')
+            if data['name'] != name:
+                raise HTTPError(404, '(logical) group name mismatch')
+
+            group = CkanGroup(data)
+            self._set_cached('group', group)
+
+        if not (allow_deleted or group.state == 'active'):
+            raise HTTPError(404, '(logical) group state is deleted')
 
-        return CkanGroup(data)
+        return group
 
-    def save_group(self, group):
+    def save_group(self, group, verify=None):
         if not isinstance(group, CkanGroup):
             raise TypeError("Group must be a CkanGroup")
 
         if group.id is not None:
-            return self.update_group(group)
-        return self.create_group(group)
+            return self.update_group(group, verify=verify)
+        return self.create_group(group, verify=verify)
 
-    def create_group(self, group):
+    def save_groups(self, groups, concurrency=4, verify=None):
+        """
+        Save many groups, in parallel.
+        See :py:meth:`save_datasets`.
+        """
+        return iter_parallel(
+            lambda group: self.save_group(group, verify=verify),
+            groups, concurrency=concurrency)
+
+    @traced('hl.create_group')
+    def create_group(self, group, verify=None):
         """
         :rtype: :py:class:`CkanGroup <.objects.ckan_group.CkanGroup>`
         """
@@ -429,16 +653,20 @@ class CkanHighlevelClient(object):
         if group.id is not None:
             raise ValueError("Cannot specify an id when creating an object")
 
-        data = self._client.post_group(group.serialize())
+        with tracing.span('serialize'):
+            serialized = group.serialize()
+        self._evict_cached('group', name=group.name)
+        data = self._client.post_group(serialized)
         created = CkanGroup(data)
+        self._set_cached('group', created)
 
-        if not created.is_equivalent(group):
-            self._mismatching_object("Created group doesn't match",
-                                     group, created)
+        self._verify_written("Created group doesn't match",
+                             group, created, serialized, data, verify)
 
         return created
 
-    def update_group(self, group):
+    @traced('hl.update_group')
+    def update_group(self, group, verify=None):
         """
         :rtype: :py:class:`CkanGroup <.objects.ckan_group.CkanGroup>`
         """
@@ -447,18 +675,125 @@ class CkanHighlevelClient(object):
         if group.id is None:
             raise ValueError("Trying to update a group without an id")
 
-        data = self._client.put_group(group.serialize())
+        with tracing.span('serialize'):
+            serialized = group.serialize()
+        self._evict_cached('group', id=group.id, name=group.name)
+        data = self._client.put_group(serialized)
         updated = CkanGroup(data)
+        self._set_cached('group', updated)
 
-        if not updated.is_equivalent(group):
-            self._mismatching_object("Updated group doesn't match",
-                                     group, updated)
+        self._verify_written("Updated group doesn't match",
+                             group, updated, serialized, data, verify)
 
         return updated
 
+    @traced('hl.delete_group')
     def delete_group(self, id):
+        self._evict_cached('group', id=id)
         return self._client.delete_group(id)
 
+    # ------------------------------------------------------------
+    # Identity map
+    # ------------------------------------------------------------
+
+    def clear_identity_map(self):
+        """Drop all the objects from the identity map, if enabled"""
+        if self._identity_maps is not None:
+            for idmap in self._identity_maps.itervalues():
+                idmap.clear()
+
+    def _get_cached(self, obj_type, id=None, name=None):
+        if self._identity_maps is None:
+            return None
+        idmap = self._identity_maps[obj_type]
+        if id is not None:
+            return idmap.get_by_id(id)
+        return idmap.get_by_name(name)
+
+    def _set_cached(self, obj_type, obj):
+        if self._identity_maps is not None:
+            self._identity_maps[obj_type].add(obj)
+
+    def _evict_cached(self, obj_type, id=None, name=None):
+        if self._identity_maps is not None:
+            self._identity_maps[obj_type].discard(id=id, name=name)
+
+    # ------------------------------------------------------------
+    # Request hooks / statistics
+    # ------------------------------------------------------------
+
+    def add_request_hook(self, hook):
+        """Register a :py:class:`RequestHook <.hooks.RequestHook>`"""
+        self._client.add_hook(hook)
+
+    def get_request_stats(self):
+        """
+        Statistics about HTTP requests performed so far.
+        See :py:meth:`CkanLowlevelClient.get_request_stats()
+        <.low_level.CkanLowlevelClient.get_request_stats>`
+        """
+        return self._client.get_request_stats()
+
+    # ------------------------------------------------------------
+    # Verification of written objects
+    # ------------------------------------------------------------
+
+    def wait_verification(self):
+        """
+        Wait for verifications running in background to complete.
+
+        :raises OperationFailure:
+            if ``fail_on_inconsistency`` is enabled and any of the
+            objects verified in background didn't match.
+        """
+        self._background_verifier.wait()
+
+    def _verify_written(self, message, expected, actual,
+                        expected_data, actual_data, verify=None):
+        """
+        Verify an object returned by a write operation, according
+        to the verification policy.
+
+        ``expected_data`` and ``actual_data`` are the dicts that were
+        sent to / returned by the API; they're used to build copies
+        of the objects when verifying in background, as the caller
+        might modify the objects in the meanwhile.
+        """
+
+        policy = self._get_verification_policy(verify)
+        if not policy.should_verify():
+            return
+
+        if policy.background:
+            self._background_verifier.submit(
+                policy, message,
+                (type(expected), expected_data),
+                (type(actual), actual_data))
+            return
+
+        with tracing.span('is_equivalent'):
+            matching = policy.check(expected, actual)
+        if not matching:
+            self._mismatching_object(message, expected, actual)
+
+    def _get_verification_policy(self, verify=None):
+        """
+        Get the policy for a ``verify`` argument.
+
+        Policies given by mode name are kept per client, so that
+        sampling counts writes across calls.
+        """
+        if verify is None:
+            return self._verification
+        if isinstance(verify, VerificationPolicy):
+            return verify
+        with self._verification_lock:
+            policy = self._verification_modes.get(verify)
+            if policy is None:
+                policy = VerificationPolicy.get(verify)
+                self._verification_modes[verify] = policy
+            return policy
+
     def _mismatching_object(self, message, expected, actual):
         logger.warning(message)
         logger.warning("Differences: {0!r}".format(expected.compare(actual)))
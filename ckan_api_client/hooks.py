@@ -0,0 +1,387 @@
+"""
+Hooks called around HTTP requests performed by the
+:py:class:`CkanLowlevelClient <.low_level.CkanLowlevelClient>`,
+to collect metrics, log or throttle requests.
+"""
+
+import bisect
+import logging
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+_API2_PATH_RE = re.compile(r'^(/api/2/rest/[^/]+)/[^/]+')
+
+
+def get_path_template(path):
+    """
+    Get the "template" of a request path, replacing object ids
+    and dropping the query string, in order to group requests.
+
+    >>> get_path_template('/api/2/rest/dataset/1234')
+    '/api/2/rest/dataset/{id}'
+    >>> get_path_template('/api/3/action/organization_show?id=1234')
+    '/api/3/action/organization_show'
+    """
+    path = path.split('?', 1)[0]
+    return _API2_PATH_RE.sub(r'\1/{id}', path)
+
+
+class RequestEvent(object):
+    """
+    Information about a request, passed to hooks.
+
+    .. attribute:: method
+
+        HTTP method
+
+    .. attribute:: path
+
+        Requested path, relative to the Ckan root
+
+    .. attribute:: path_template
+
+        Path, with ids replaced (see :py:func:`get_path_template`)
+
+    .. attribute:: status
+
+        HTTP status code (``None`` until a response is received)
+
+    .. attribute:: latency
+
+        Time elapsed from the request to the response, in seconds
+
+    .. attribute:: request_size
+
+        Size of the request body, in bytes
+
+    .. attribute:: response_size
+
+        Size of the response body, in bytes
+
+    .. attribute:: retries
+
+        Number of times the request has been retried so far
+
+    .. attribute:: error
+
+        Exception raised, for failed requests
+    """
+
+    def __init__(self, method, path, request_size=0, retries=0):
+        self.method = method
+        self.path = path
+        self.path_template = get_path_template(path)
+        self.status = None
+        self.latency = None
+        self.request_size = request_size
+        self.response_size = 0
+        self.retries = retries
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'path': self.path,
+            'path_template': self.path_template,
+            'status': self.status,
+            'latency': self.latency,
+            'request_size': self.request_size,
+            'response_size': self.response_size,
+            'retries': self.retries,
+            'error': None if self.error is None else repr(self.error),
+        }
+
+    def __repr__(self):
+        return '<RequestEvent {0} {1} status={2}>'.format(
+            self.method, self.path, self.status)
+
+
+class RequestHook(object):
+    """
+    Base class for request hooks. All the methods do nothing
+    by default; subclasses override the ones they need.
+
+    Hooks are called synchronously, possibly from several threads
+    at once; exceptions they raise are logged and ignored.
+    """
+
+    def before_request(self, event):
+        """Called before sending a request"""
+
+    def after_response(self, event):
+        """Called after receiving a response (either ok or not)"""
+
+    def on_error(self, event):
+        """
+        Called when a request fails, either because of an error
+        status or of an exception (``event.error``)
+        """
+
+
+class StatsHook(RequestHook):
+    """
+    Keep simple counters of requests: ``calls``, ``errors``,
+    ``retries``, ``bytes_sent`` and ``bytes_received``.
+    """
+
+    def __init__(self):
+        self._stats = {'calls': 0, 'errors': 0, 'retries': 0,
+                       'bytes_sent': 0, 'bytes_received': 0}
+        self._lock = threading.Lock()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def before_request(self, event):
+        if event.retries:
+            with self._lock:
+                self._stats['retries'] += 1
+
+    def after_response(self, event):
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['bytes_sent'] += event.request_size
+            self._stats['bytes_received'] += event.response_size
+
+    def on_error(self, event):
+        with self._lock:
+            self._stats['errors'] += 1
+            if event.status is None:
+                # No response: after_response() wasn't called
+                self._stats['calls'] += 1
+                self._stats['bytes_sent'] += event.request_size
+
+
+class RateLimitHook(RequestHook):
+    """
+    Limit the rate of requests, delaying them as needed (token
+    bucket). The same hook can be shared by several clients, to
+    limit their overall rate.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: maximum number of requests per second
+        :param burst:
+            number of requests that can be sent at once,
+            after a period of inactivity
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def before_request(self, event):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Take the token now, even if it's not there yet, so that
+            # waiting requests are served in order.
+            self._tokens -= 1
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MetricsRegistry(object):
+    """
+    Minimal registry of counters and histograms, that can be
+    rendered in the Prometheus text exposition format.
+    """
+
+    #: Default histogram buckets, in seconds
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        """Set the help text of a metric"""
+        self._help[name] = text
+
+    def inc(self, name, labels=None, amount=1):
+        """Increment a counter"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        """Record a value in a histogram"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0, 'count': 0}
+            histogram = self._histograms[key]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def get_value(self, name, labels=None):
+        """Get the value of a counter (or count of a histogram)"""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key]['count']
+            return self._counters.get(key, 0)
+
+    def render(self):
+        """:return: all the metrics, in Prometheus text format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.iteritems())
+            histograms = sorted(self._histograms.iteritems())
+
+        described = set()
+
+        def _header(name, metric_type):
+            if name in described:
+                return
+            described.add(name)
+            if name in self._help:
+                lines.append('# HELP {0} {1}'.format(name, self._help[name]))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+
+        for (name, labels), value in counters:
+            _header(name, 'counter')
+            lines.append('{0}{1} {2}'.format(
+                name, _format_labels(labels), value))
+
+        for (name, labels), histogram in histograms:
+            _header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _format_labels(labels + (('le', repr(bound)),)),
+                    cumulative))
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _format_labels(labels + (('le', '+Inf'),)),
+                histogram['count']))
+            lines.append('{0}_sum{1} {2!r}'.format(
+                name, _format_labels(labels), histogram['sum']))
+            lines.append('{0}_count{1} {2}'.format(
+                name, _format_labels(labels), histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHook(RequestHook):
+    """
+    Record request metrics in a :py:class:`MetricsRegistry`:
+
+    - ``ckan_requests_total`` -- requests, by method, path
+      template and status
+    - ``ckan_request_errors_total`` -- failed requests
+    - ``ckan_request_duration_seconds`` -- latency histogram
+    - ``ckan_request_bytes_total`` / ``ckan_response_bytes_total``
+    - ``ckan_request_retries_total`` -- retried requests
+    """
+
+    def __init__(self, registry=None, prefix='ckan'):
+        if registry is None:
+            registry = MetricsRegistry()
+        self.registry = registry
+        self.prefix = prefix
+        for name, text in (
+                ('requests_total', 'HTTP requests performed'),
+                ('request_errors_total', 'Failed HTTP requests'),
+                ('request_duration_seconds', 'HTTP request latency'),
+                ('request_bytes_total', 'Bytes sent in request bodies'),
+                ('response_bytes_total', 'Bytes received in responses'),
+                ('request_retries_total', 'Retried HTTP requests')):
+            registry.describe(self._name(name), text)
+
+    def _name(self, name):
+        return '{0}_{1}'.format(self.prefix, name)
+
+    def before_request(self, event):
+        if event.retries:
+            self.registry.inc(self._name('request_retries_total'), {
+                'method': event.method, 'path': event.path_template})
+
+    def after_response(self, event):
+        labels = {'method': event.method, 'path': event.path_template}
+        self.registry.inc(self._name('requests_total'),
+                          dict(labels, status=str(event.status)))
+        self.registry.observe(self._name('request_duration_seconds'),
+                              event.latency, labels)
+        self.registry.inc(self._name('request_bytes_total'), labels,
+                          event.request_size)
+        self.registry.inc(self._name('response_bytes_total'), labels,
+                          event.response_size)
+
+    def on_error(self, event):
+        self.registry.inc(self._name('request_errors_total'), {
+            'method': event.method, 'path': event.path_template,
+            'status': str(event.status)})
+
+
+class LoggingHook(RequestHook):
+    """
+    Log a record for each request, carrying the event data in
+    the ``ckan_request`` attribute (for structured log handlers).
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG,
+                 error_level=logging.WARNING):
+        if logger is None:
+            logger = logging.getLogger('ckan_api_client.requests')
+        self.logger = logger
+        self.level = level
+        self.error_level = error_level
+
+    def after_response(self, event):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level, '%s %s -> %s (%.3fs, %d/%d bytes)',
+                event.method, event.path, event.status, event.latency,
+                event.request_size, event.response_size,
+                extra={'ckan_request': event.to_dict()})
+
+    def on_error(self, event):
+        self.logger.log(
+            self.error_level, '%s %s failed: %s',
+            event.method, event.path,
+            event.error if event.error is not None else event.status,
+            extra={'ckan_request': event.to_dict()})
+
+
+def call_hooks(hooks, name, event):
+    """Call a method on all the hooks, logging exceptions"""
+    for hook in hooks:
+        try:
+            getattr(hook, name)(event)
+        except Exception:
+            logger.exception('Request hook {0!r} failed'.format(hook))
+
+
+def _labels_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.iteritems()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\')
+                           .replace('"', '\\"'))
+        for key, value in labels))
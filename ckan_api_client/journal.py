@@ -0,0 +1,201 @@
+"""
+Durable journal of synchronization runs, used to resume
+interrupted runs without starting over.
+"""
+
+from collections import namedtuple
+import json
+import sqlite3
+import threading
+import time
+
+from .objects import BaseObject
+
+
+STATE_PENDING = 'pending'
+STATE_STARTED = 'started'
+STATE_DONE = 'done'
+
+
+class SyncOperation(namedtuple('SyncOperation', [
+        'seq', 'action', 'source_id', 'ckan_id', 'dataset'])):
+    """
+    An operation to be performed on a dataset during synchronization.
+
+    Keys:
+
+    - ``seq`` -- position of the operation in the run
+    - ``action`` -- one of ``'delete'``, ``'create'`` or ``'update'``
+    - ``source_id`` -- id of the dataset in the source
+    - ``ckan_id`` -- id of the dataset in Ckan (``None`` for creations)
+    - ``dataset`` -- dataset to be sent to Ckan, either as a
+      :py:class:`CkanDataset <.objects.ckan_dataset.CkanDataset>`
+      or serialized (``None`` for deletions)
+    """
+    __slots__ = ()
+
+
+class SyncJournal(object):
+    """
+    Journal of synchronization runs, stored in a SQLite database.
+
+    Each run is identified by the source name and a run id, and
+    contains the list of operations planned for that run, along
+    with their state (pending, started or done).
+
+    State changes are committed right away, so that the journal
+    is consistent even if the process dies in the middle of a run.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename:
+            path to the SQLite database file. Will be created
+            if it doesn't exist.
+        """
+        self.filename = filename
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock:
+            self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sync_run (
+                source_name TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                created REAL NOT NULL,
+                finished REAL,
+                PRIMARY KEY (source_name, run_id)
+            );
+            CREATE TABLE IF NOT EXISTS sync_operation (
+                source_name TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                ckan_id TEXT,
+                dataset TEXT,
+                state TEXT NOT NULL,
+                name TEXT,
+                PRIMARY KEY (source_name, run_id, seq)
+            );
+            """)
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def has_run(self, source_name, run_id):
+        """Check whether a run exists in the journal"""
+        cur = self._db.execute(
+            'SELECT 1 FROM sync_run WHERE source_name=? AND run_id=?',
+            (source_name, run_id))
+        return cur.fetchone() is not None
+
+    def find_unfinished_run(self, source_name):
+        """
+        :return: id of the latest unfinished run for the
+            given source, or ``None``
+        """
+        cur = self._db.execute(
+            'SELECT run_id FROM sync_run '
+            'WHERE source_name=? AND finished IS NULL '
+            'ORDER BY created DESC LIMIT 1', (source_name,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def create_run(self, source_name, run_id, operations):
+        """
+        Record a new run, along with all its planned operations.
+
+        :param operations: iterable of :py:class:`SyncOperation`
+        """
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO sync_run (source_name, run_id, created) '
+                'VALUES (?, ?, ?)', (source_name, run_id, time.time()))
+            self._db.executemany(
+                'INSERT INTO sync_operation (source_name, run_id, seq, '
+                'action, source_id, ckan_id, dataset, state) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((source_name, run_id, op.seq, op.action, op.source_id,
+                  op.ckan_id, _dump_dataset(op.dataset), STATE_PENDING)
+                 for op in operations))
+            self._db.commit()
+
+    def finish_run(self, source_name, run_id):
+        """Mark a run as finished"""
+        self._update(
+            'UPDATE sync_run SET finished=? '
+            'WHERE source_name=? AND run_id=?',
+            (time.time(), source_name, run_id))
+
+    def abandon_runs(self, source_name):
+        """
+        Mark all the unfinished runs of a source as finished, leaving
+        their remaining operations undone. Used when a new run is
+        planned, as it supersedes them.
+        """
+        self._update(
+            'UPDATE sync_run SET finished=? '
+            'WHERE source_name=? AND finished IS NULL',
+            (time.time(), source_name))
+
+    def iter_operations(self, source_name, run_id, states=None):
+        """
+        Iterate the operations of a run, in order.
+
+        :param states:
+            if specified, only return operations in one of these states
+        :return: generator of ``(state, name, SyncOperation)`` tuples,
+            where ``name`` is the dataset name used in the last
+            attempt (only recorded for creations).
+        """
+        cur = self._db.execute(
+            'SELECT seq, action, source_id, ckan_id, dataset, state, name '
+            'FROM sync_operation WHERE source_name=? AND run_id=? '
+            'ORDER BY seq', (source_name, run_id))
+        for row in cur.fetchall():
+            if states is not None and row[5] not in states:
+                continue
+            operation = SyncOperation(
+                seq=row[0], action=row[1], source_id=row[2],
+                ckan_id=row[3], dataset=_load_dataset(row[4]))
+            yield row[5], row[6], operation
+
+    def mark_started(self, source_name, run_id, seq, name=None):
+        """Mark an operation as started (recording the dataset name)"""
+        self._update(
+            'UPDATE sync_operation SET state=?, name=? '
+            'WHERE source_name=? AND run_id=? AND seq=?',
+            (STATE_STARTED, name, source_name, run_id, seq))
+
+    def mark_done(self, source_name, run_id, seq, ckan_id=None):
+        """Mark an operation as done"""
+        self._update(
+            'UPDATE sync_operation SET state=?, '
+            'ckan_id=COALESCE(?, ckan_id) '
+            'WHERE source_name=? AND run_id=? AND seq=?',
+            (STATE_DONE, ckan_id, source_name, run_id, seq))
+
+    def _update(self, query, args):
+        with self._lock:
+            self._db.execute(query, args)
+            self._db.commit()
+
+
+def _dump_dataset(dataset):
+    if dataset is None:
+        return None
+    if isinstance(dataset, BaseObject):
+        dataset = dataset.serialize()
+    return json.dumps(dataset)
+
+
+def _load_dataset(data):
+    if data is None:
+        return None
+    return json.loads(data)
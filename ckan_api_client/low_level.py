@@ -1,10 +1,20 @@
 import json
+import time
 import urlparse
 
 import requests
 
+from . import tracing
 from .exceptions import HTTPError, BadApiError
-from .utils import SuppressExceptionIf
+from .hooks import RequestEvent, StatsHook, call_hooks
+from .utils import SuppressExceptionIf, iter_parallel
+
+
+#: Methods that can safely be retried
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'))
+
+#: Status codes of responses that will be retried
+RETRY_STATUS_CODES = frozenset((502, 503, 504))
 
 
 class CkanLowlevelClient(object):
@@ -17,27 +27,82 @@ class CkanLowlevelClient(object):
     - Performs some checks on return values from the API
     """
 
-    def __init__(self, base_url, api_key=None):
+    def __init__(self, base_url, api_key=None, hooks=None,
+                 max_retries=0, retry_delay=1, pool_size=10, session=None):
         """
         :param basestring base_url:
             Base url for the Ckan installation
         :param basestring api_key:
             API key to be used for authentication.
             If omitted, no authentication information will be sent.
+        :param hooks:
+            list of :py:class:`RequestHook <.hooks.RequestHook>`
+            to be called around each request
+        :param max_retries:
+            number of times idempotent requests are retried in case
+            of connection errors or 502 / 503 / 504 responses
+            (default: 0, no retries)
+        :param retry_delay:
+            seconds to wait before the first retry; doubled
+            at each further retry.
+        :param pool_size:
+            maximum number of connections kept open to the server,
+            to be reused by further requests. Should be at least
+            the number of threads sharing the client.
+        :param session:
+            a :py:class:`requests.Session` to be used instead of a
+            new one (see :py:func:`make_session`), for example to
+            share a connection pool between clients. ``pool_size``
+            is ignored in this case.
         """
         self.base_url = base_url
         self.api_key = api_key
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.pool_size = pool_size
+        self.session = session or make_session(pool_size)
+        self._stats_hook = StatsHook()
+        self._hooks = [self._stats_hook]
+        for hook in hooks or ():
+            self.add_hook(hook)
+
+    def add_hook(self, hook):
+        """Register a :py:class:`RequestHook <.hooks.RequestHook>`"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def get_request_stats(self):
+        """
+        :return: a dict with the number of requests performed
+            (``calls``), failed (``errors``) and repeated after
+            a failure (``retries``) so far, and the amount of
+            ``bytes_sent`` and ``bytes_received`` (request /
+            response bodies).
+        """
+        return self._stats_hook.get_stats()
 
     @property
     def anonymous(self):
         """
-        Property, returning a copy of this client, without an api_key set
+        Property, returning a copy of this client, without an api_key set.
+
+        The copy shares the session, the registered hooks and the
+        request statistics of this client.
         """
-        return CkanLowlevelClient(self.base_url)
+        client = CkanLowlevelClient(
+            self.base_url, max_retries=self.max_retries,
+            retry_delay=self.retry_delay, pool_size=self.pool_size,
+            session=self.session)
+        client._stats_hook = self._stats_hook
+        client._hooks = list(self._hooks)
+        return client
 
     def request(self, method, path, **kwargs):
         """
-        Wrapper around :py:func:`requests.request`.
+        Wrapper around :py:meth:`requests.Session.request`, using
+        the (pooled) connections of this client.
 
         Extra functionality provided:
 
@@ -53,7 +118,11 @@ class CkanLowlevelClient(object):
         :param headers: HTTP headers to be added to the request
         :param data: Data to be sent in the request body
         :param kwargs: Extra keyword arguments will be passed
-            directly to the ``requests.request()`` call.
+            directly to the ``Session.request()`` call.
+
+        Registered hooks are called before each attempt and after
+        the response (or failure); idempotent requests are retried
+        according to ``max_retries``.
 
         :raises ckan_api_client.exceptions.HTTPError:
             in case the HTTP request returned a non-ok status code
@@ -77,9 +146,44 @@ class CkanLowlevelClient(object):
         if isinstance(path, (list, tuple)):
             path = '/'.join(path)
 
+        bytes_sent = 0
+        if isinstance(kwargs.get('data'), basestring):
+            bytes_sent = len(kwargs['data'])
+
         url = urlparse.urljoin(self.base_url, path)
-        response = requests.request(method, url, **kwargs)
-        if not response.ok:
+        retries = 0
+
+        while True:
+            event = RequestEvent(method, path, request_size=bytes_sent,
+                                 retries=retries)
+            call_hooks(self._hooks, 'before_request', event)
+
+            start = time.time()
+            try:
+                with tracing.span('http', method=method,
+                                  path=event.path_template,
+                                  retries=retries) as span:
+                    response = self.session.request(method, url, **kwargs)
+                    span.set('status', response.status_code)
+            except Exception, e:
+                event.latency = time.time() - start
+                event.error = e
+                call_hooks(self._hooks, 'on_error', event)
+                if (isinstance(e, (requests.ConnectionError,
+                                   requests.Timeout))
+                        and self._should_retry(method, retries)):
+                    retries += 1
+                    continue
+                raise
+
+            event.latency = time.time() - start
+            event.status = response.status_code
+            event.response_size = len(response.content)
+            call_hooks(self._hooks, 'after_response', event)
+
+            if response.ok:
+                return response
+
             # ------------------------------------------------------------
             # todo: attach message, if any available..
             # ------------------------------------------------------------
@@ -88,12 +192,30 @@ class CkanLowlevelClient(object):
             #       as it might be: json string, part of json object,
             #       part of html document
             # ------------------------------------------------------------
-            raise HTTPError(
+            event.error = HTTPError(
                 status_code=response.status_code,
                 message="Error while performing request",
                 original=self._figure_out_error_message(response))
+            call_hooks(self._hooks, 'on_error', event)
+
+            if (response.status_code in RETRY_STATUS_CODES
+                    and self._should_retry(method, retries)):
+                retries += 1
+                continue
 
-        return response
+            raise event.error
+
+    def _should_retry(self, method, retries):
+        """
+        Check whether a failed request should be retried,
+        waiting before returning ``True``.
+        """
+        if method.upper() not in IDEMPOTENT_METHODS:
+            return False
+        if retries >= self.max_retries:
+            return False
+        time.sleep(self.retry_delay * (2 ** retries))
+        return True
 
     def _figure_out_error_message(self, response):
         """
@@ -170,6 +292,157 @@ class CkanLowlevelClient(object):
         for ds_id in self.list_datasets():
             yield self.get_dataset(ds_id)
 
+    def list_dataset_names(self):
+        """
+        Return a list of the names of all (active) datasets,
+        using API v3 ``package_list``.
+        """
+
+        path = '/api/3/action/package_list'
+        response = self.request('GET', path)
+        data = response.json()['result']
+        self._validate_response_idlist(data, name='dataset name')
+        return data
+
+    def iter_modified_dataset_ids(self, since=None, page_size=100,
+                                  include_private=False):
+        """
+        Iterate ids of datasets modified since a given time.
+        See :py:meth:`iter_modified_datasets`.
+
+        :return: generator of ``(id, metadata_modified)`` tuples
+        """
+        datasets = self.iter_modified_datasets(
+            since=since, page_size=page_size,
+            fl=['id', 'metadata_modified'], include_private=include_private)
+        for dataset in datasets:
+            yield dataset['id'], dataset['metadata_modified']
+
+    def iter_modified_datasets(self, since=None, page_size=100, fl=None,
+                               include_private=False):
+        """
+        Iterate datasets modified since a given time, using
+        :py:meth:`search_datasets`, sorted by ``metadata_modified``.
+
+        Pages are requested by ``metadata_modified`` range, starting
+        from the last value seen, rather than by offset: datasets
+        modified while iterating are moved to the end of the list,
+        so they are not skipped (but they may be returned twice).
+
+        .. note:: deleted datasets are not returned by this method.
+
+        :param since:
+            ``metadata_modified`` value (ISO 8601 string, UTC) to
+            start from (inclusive). If ``None``, all the datasets
+            will be returned.
+        :param page_size: number of results to request at once
+        :param fl:
+            fields to be returned (see :py:meth:`search_datasets`);
+            must include ``metadata_modified``.
+        :param include_private: see :py:meth:`search_datasets`
+        :return: generator of dataset dicts
+        """
+
+        # Number of datasets already returned, modified at ``since``
+        skip = 0
+        while True:
+            fq = None
+            if since is not None:
+                fq = 'metadata_modified:[{0}Z TO *]'.format(
+                    since.rstrip('Z'))
+            count, results = self.search_datasets(
+                start=skip, rows=page_size,
+                sort='metadata_modified asc, id asc', fq=fq, fl=fl,
+                include_private=include_private)
+            for dataset in results:
+                yield dataset
+            if not results or skip + len(results) >= count:
+                break
+
+            last = results[-1]['metadata_modified']
+            if last != since:
+                since, skip = last, 0
+            skip += len([d for d in results
+                         if d['metadata_modified'] == last])
+
+    def search_datasets(self, start=0, rows=100, sort='id asc', fq=None,
+                        fl=None, include_private=False):
+        """
+        Get a page of (full) datasets, using API v3 ``package_search``.
+
+        Datasets are converted to the API v2 format, as returned
+        by :py:meth:`get_dataset`.
+
+        .. note:: deleted datasets are not returned by this method.
+
+        :param start: offset of the first result
+        :param rows: maximum number of results to return
+        :param sort: sort order; should be stable across requests,
+            for the pages to be consistent
+        :param fq: optional filter query
+        :param fl:
+            optional list of (search index) fields to be returned,
+            such as ``['id', 'extras_somekey']``. If specified, the
+            results are dicts with those fields only (as returned by
+            the API).
+        :param include_private:
+            whether to return private datasets too (the ones the
+            user is authorized to see)
+        :return: a ``(count, datasets)`` tuple, where ``count`` is
+            the total number of matching datasets.
+        """
+
+        path = '/api/3/action/package_search'
+        params = {'q': '*:*', 'sort': sort, 'rows': rows, 'start': start}
+        if fq is not None:
+            params['fq'] = fq
+        if fl is not None:
+            params['fl'] = ','.join(fl)
+        if include_private:
+            params['include_private'] = 'true'
+        response = self.request('GET', path, params=params)
+        data = response.json()['result']
+        self._validate_response_list_of_dict(data['results'], name='dataset')
+        if fl is not None:
+            return data['count'], data['results']
+        return data['count'], [_dataset_from_v3(d) for d in data['results']]
+
+    def iter_datasets_bulk(self, page_size=100, concurrency=4,
+                           sort='id asc', fq=None, fl=None,
+                           include_private=False):
+        """
+        Iterate over all the datasets returned by
+        :py:meth:`search_datasets`, requesting up to ``concurrency``
+        pages in parallel.
+
+        Datasets are yielded in no particular order; datasets
+        changed during the iteration may be missed or yielded twice.
+
+        :raises: the first error occurred fetching a page
+        :return: generator of dataset dicts (API v2 format, or
+            only the ``fl`` fields, if specified)
+        """
+
+        def get_page(start):
+            return self.search_datasets(
+                start=start, rows=page_size, sort=sort, fq=fq, fl=fl,
+                include_private=include_private)[1]
+
+        # The first page tells how many others are there
+        count, datasets = self.search_datasets(
+            rows=page_size, sort=sort, fq=fq, fl=fl,
+            include_private=include_private)
+        for dataset in datasets:
+            yield dataset
+
+        pages = iter_parallel(get_page, xrange(page_size, count, page_size),
+                              concurrency=concurrency)
+        for result in pages:
+            if result.error is not None:
+                raise result.error
+            for dataset in result.result:
+                yield dataset
+
     def get_dataset(self, dataset_id):
         """
         Get a dataset, using API v2
@@ -359,3 +632,31 @@ class CkanLowlevelClient(object):
         data = response.json()
         self._validate_response_list_of_dict(data)
         return data
+
+
+def make_session(pool_size=10):
+    """
+    Create a :py:class:`requests.Session`, keeping up to
+    ``pool_size`` connections open for reuse (for each host).
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _dataset_from_v3(data):
+    """Convert a dataset from the API v3 to the API v2 format"""
+    data = dict(data)
+    data.pop('organization', None)
+    if isinstance(data.get('extras'), list):
+        data['extras'] = dict(
+            (item['key'], item['value']) for item in data['extras'])
+    data['groups'] = [
+        group['id'] if isinstance(group, dict) else group
+        for group in data.get('groups') or []]
+    data['tags'] = [
+        tag['name'] if isinstance(tag, dict) else tag
+        for tag in data.get('tags') or []]
+    return data
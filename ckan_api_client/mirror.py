@@ -0,0 +1,415 @@
+"""
+Mirror the contents of a Ckan catalog (datasets, groups and
+organizations) to local storage.
+
+Available stores:
+
+- :py:class:`DirectoryStore` -- a directory with a JSON file per
+  object, in the layout read by the ``import_directory`` command;
+- :py:class:`SQLiteStore` -- a SQLite database with a table per
+  object type, in the format read by the ``import_sqlite`` command;
+- :py:class:`ArchiveStore` -- a (compressed) tar archive, with the
+  same layout as directories.
+
+Datasets are stored by id, groups and organizations by name; the
+groups and organization of datasets are referenced by name too (Ckan
+returns their ids), as the importers expect.
+
+Directories and SQLite databases keep track of the last run, so that
+they can be updated incrementally, fetching only the datasets modified
+in the meantime::
+
+    client = CkanLowlevelClient(base_url, pool_size=8)
+    store = open_store('/srv/mirror/catalog.sqlite')
+    CatalogMirror(client, store, concurrency=8).run(incremental=True)
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import tarfile
+import tempfile
+import time
+from StringIO import StringIO
+
+from .exceptions import HTTPError
+from .utils import iter_parallel
+
+
+logger = logging.getLogger(__name__)
+
+OBJECT_TYPES = ('dataset', 'group', 'organization')
+
+#: Extensions of the archive formats, with the matching tarfile modes
+ARCHIVE_MODES = (
+    ('.tar.gz', 'w:gz'),
+    ('.tgz', 'w:gz'),
+    ('.tar.bz2', 'w:bz2'),
+    ('.tbz2', 'w:bz2'),
+    ('.tar', 'w'),
+)
+
+
+class DirectoryStore(object):
+    """
+    Store objects as JSON files, in a subdirectory for each
+    object type, named after their key. The state is kept in
+    a hidden file, ignored by ``import_directory``.
+    """
+
+    incremental = True
+    state_file = '.mirror-state.json'
+
+    def __init__(self, path):
+        self.path = path
+        for obj_type in OBJECT_TYPES:
+            dirname = os.path.join(path, obj_type)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+    def get_state(self):
+        filename = os.path.join(self.path, self.state_file)
+        if not os.path.exists(filename):
+            return {}
+        with open(filename) as fp:
+            return json.load(fp)
+
+    def set_state(self, state):
+        self._write_file(os.path.join(self.path, self.state_file),
+                         json.dumps(state))
+
+    def list_ids(self, obj_type):
+        return set(
+            name for name in os.listdir(os.path.join(self.path, obj_type))
+            if not (name.startswith('.') or name.endswith('~')))
+
+    def write(self, obj_type, key, obj):
+        self._write_file(os.path.join(self.path, obj_type, key),
+                         json.dumps(obj))
+
+    def delete(self, obj_type, key):
+        os.unlink(os.path.join(self.path, obj_type, key))
+
+    def close(self):
+        pass
+
+    def _write_file(self, filename, data):
+        # Write to a (hidden) temporary file, then rename it,
+        # so that an interrupted run won't leave truncated files
+        fd, tmpname = tempfile.mkstemp(
+            prefix='.', dir=os.path.dirname(filename))
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.rename(tmpname, filename)
+
+
+class SQLiteStore(object):
+    """
+    Store objects in a SQLite database, with a ``(id, json_data)``
+    table for each object type, ``id`` being the object key.
+    The state is kept in the ``mirror_state`` table.
+    """
+
+    incremental = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        for obj_type in OBJECT_TYPES:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS "{0}" '
+                '(id TEXT PRIMARY KEY, json_data TEXT)'.format(obj_type))
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS mirror_state '
+            '(key TEXT PRIMARY KEY, value TEXT)')
+
+    def get_state(self):
+        return dict(
+            (key, json.loads(value)) for key, value in
+            self.db.execute('SELECT key, value FROM mirror_state'))
+
+    def set_state(self, state):
+        self.db.execute('DELETE FROM mirror_state')
+        self.db.executemany(
+            'INSERT INTO mirror_state (key, value) VALUES (?, ?)',
+            ((key, json.dumps(value)) for key, value in state.iteritems()))
+        self.db.commit()
+
+    def list_ids(self, obj_type):
+        return set(row[0] for row in self.db.execute(
+            'SELECT id FROM "{0}"'.format(obj_type)))
+
+    def write(self, obj_type, key, obj):
+        self.db.execute(
+            'INSERT OR REPLACE INTO "{0}" (id, json_data) VALUES (?, ?)'
+            .format(obj_type), (key, json.dumps(obj)))
+
+    def delete(self, obj_type, key):
+        self.db.execute('DELETE FROM "{0}" WHERE id = ?'.format(obj_type),
+                        (key,))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class ArchiveStore(object):
+    """
+    Store objects in a tar archive, compressed according to the
+    file extension (see :py:data:`ARCHIVE_MODES`).
+
+    Archives are written from scratch on each run, so they can't
+    be updated incrementally, and there is never anything to delete.
+    """
+
+    incremental = False
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.tar = tarfile.open(filename, _get_archive_mode(filename))
+        self._mtime = time.time()
+
+    def get_state(self):
+        return {}
+
+    def set_state(self, state):
+        pass
+
+    def list_ids(self, obj_type):
+        return set()
+
+    def write(self, obj_type, key, obj):
+        data = json.dumps(obj)
+        info = tarfile.TarInfo('{0}/{1}'.format(obj_type, key))
+        info.size = len(data)
+        info.mtime = self._mtime
+        self.tar.addfile(info, StringIO(data))
+
+    def delete(self, obj_type, key):
+        pass  # list_ids() is always empty
+
+    def close(self):
+        self.tar.close()
+
+
+def _get_archive_mode(filename):
+    for extension, mode in ARCHIVE_MODES:
+        if filename.endswith(extension):
+            return mode
+    return None
+
+
+def guess_format(destination):
+    """
+    Guess the format of a store from the file extension:
+    ``.sqlite`` / ``.db`` for databases, any of
+    :py:data:`ARCHIVE_MODES` for archives, else a directory.
+    """
+    if destination.endswith(('.sqlite', '.db')):
+        return 'sqlite'
+    if _get_archive_mode(destination) is not None:
+        return 'archive'
+    return 'directory'
+
+
+def open_store(destination, format=None):
+    """
+    Open a store for a mirror.
+
+    :param destination: path of the directory, database or archive
+    :param format:
+        one of ``'directory'``, ``'sqlite'`` or ``'archive'``.
+        If not specified, it is guessed with :py:func:`guess_format`.
+    """
+
+    if format is None:
+        format = guess_format(destination)
+
+    if format == 'directory':
+        return DirectoryStore(destination)
+    if format == 'sqlite':
+        return SQLiteStore(destination)
+    if format == 'archive':
+        return ArchiveStore(destination)
+    raise ValueError("Unsupported format: {0!r}".format(format))
+
+
+class CatalogMirror(object):
+    """
+    Copy the objects of a Ckan catalog to a store.
+
+    Datasets are fetched in pages through ``package_search``
+    (or one by one, if ``bulk`` is ``False``); groups and
+    organizations one by one. Up to ``concurrency`` requests
+    are run in parallel: the client ``pool_size`` should be at
+    least as large, to reuse connections.
+
+    On incremental runs, modified datasets are fetched one page
+    at a time, by ``metadata_modified`` range (see
+    :py:meth:`CkanLowlevelClient.iter_modified_datasets()
+    <.low_level.CkanLowlevelClient.iter_modified_datasets>`), so
+    that datasets modified while mirroring are not missed.
+
+    Private datasets are mirrored too, if the client API key
+    is authorized to see them.
+    """
+
+    def __init__(self, client, store, page_size=100, concurrency=8,
+                 bulk=True):
+        """
+        :param client:
+            a :py:class:`CkanLowlevelClient
+            <.low_level.CkanLowlevelClient>`
+        :param store: the store to write to (see :py:func:`open_store`)
+        """
+        self.client = client
+        self.store = store
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.bulk = bulk
+
+    def run(self, incremental=False):
+        """
+        Run the mirror, closing the store at the end.
+
+        Objects no longer in Ckan are removed from the store.
+
+        :param incremental:
+            if ``True``, and the store has been written by a previous
+            run, only fetch the datasets modified since then.
+            Groups and organizations are always fetched, as Ckan
+            doesn't tell when they were modified.
+        :raises ValueError:
+            if ``incremental`` is ``True`` but the store doesn't
+            support incremental updates (archives)
+        :return: a dict mapping object types to dicts with the
+            number of objects ``written`` and ``deleted``.
+        """
+
+        if incremental and not self.store.incremental:
+            self.store.close()
+            raise ValueError("This store can't be updated incrementally")
+
+        state = {}
+        if incremental:
+            state = self.store.get_state()
+        since = state.get('datasets_modified')
+
+        try:
+            # Groups and organizations go first, to know their names
+            group_names, org_names = {}, {}
+            counts = {
+                'group': self._mirror_objects(
+                    'group', self.client.list_groups(),
+                    self.client.get_group, group_names),
+                'organization': self._mirror_objects(
+                    'organization', self.client.list_organizations(),
+                    self.client.get_organization, org_names),
+            }
+            counts['dataset'] = self._mirror_datasets(
+                since, group_names, org_names)
+            state['datasets_modified'] = counts['dataset'].pop(
+                'last_modified') or since
+            state['last_run'] = datetime.datetime.utcnow().isoformat()
+            self.store.set_state(state)
+        finally:
+            self.store.close()
+
+        return counts
+
+    def _mirror_datasets(self, since, group_names, org_names):
+        if since is None:
+            logger.info('Mirroring all datasets')
+            if self.bulk:
+                datasets = self.client.iter_datasets_bulk(
+                    page_size=self.page_size, concurrency=self.concurrency,
+                    include_private=True)
+            else:
+                datasets = self._fetch_all(
+                    self.client.list_datasets(), self.client.get_dataset)
+
+        else:
+            logger.info('Mirroring datasets modified since %s', since)
+            if self.bulk:
+                datasets = self.client.iter_modified_datasets(
+                    since, page_size=self.page_size, include_private=True)
+            else:
+                datasets = self._fetch_all(
+                    (id for id, _ in self.client.iter_modified_dataset_ids(
+                        since, page_size=self.page_size,
+                        include_private=True)),
+                    self.client.get_dataset)
+
+        written, last_modified = set(), None
+        for dataset in datasets:
+            self.store.write('dataset', dataset['id'], _refer_by_name(
+                dataset, group_names, org_names))
+            written.add(dataset['id'])
+            last_modified = max(last_modified, dataset['metadata_modified'])
+
+        # On incremental runs, we only know about the modified
+        # datasets: find out the deleted ones from the list.
+        existing = written
+        if since is not None:
+            existing = set(self.client.list_datasets())
+
+        deleted = self.store.list_ids('dataset') - existing
+        for id in deleted:
+            self.store.delete('dataset', id)
+
+        logger.info('Datasets: %d written, %d deleted',
+                    len(written), len(deleted))
+        return {'written': len(written), 'deleted': len(deleted),
+                'last_modified': last_modified}
+
+    def _mirror_objects(self, obj_type, ids, get_object, names):
+        """
+        Mirror all the groups or organizations, filling ``names``
+        with the ``{id: name}`` mapping of the objects written.
+        """
+        logger.info('Mirroring %s objects', obj_type)
+        written = set()
+        for obj in self._fetch_all(ids, get_object):
+            # Organizations come from API v3, with a list of extras
+            if isinstance(obj.get('extras'), list):
+                obj['extras'] = dict((item['key'], item['value'])
+                                     for item in obj['extras'])
+            self.store.write(obj_type, obj['name'], obj)
+            written.add(obj['name'])
+            names[obj['id']] = obj['name']
+
+        deleted = self.store.list_ids(obj_type) - written
+        for id in deleted:
+            self.store.delete(obj_type, id)
+
+        return {'written': len(written), 'deleted': len(deleted)}
+
+    def _fetch_all(self, ids, get_object):
+        """
+        Fetch objects in parallel, skipping the ones deleted in
+        the meantime.
+        """
+        results = iter_parallel(get_object, ids,
+                                concurrency=self.concurrency)
+        for result in results:
+            if result.error is None:
+                yield result.result
+            elif not (isinstance(result.error, HTTPError) and
+                      result.error.status_code == 404):
+                raise result.error
+
+
+def _refer_by_name(dataset, group_names, org_names):
+    """
+    Replace the ids of groups / organization of a dataset with
+    their names, if known.
+    """
+    dataset = dict(dataset)
+    dataset['groups'] = [group_names.get(group, group)
+                         for group in dataset.get('groups') or []]
+    if dataset.get('owner_org'):
+        dataset['owner_org'] = org_names.get(
+            dataset['owner_org'], dataset['owner_org'])
+    return dataset
@@ -0,0 +1,146 @@
+"""
+Synchronization of many harvest sources at once.
+
+Running a separate synchronization for each source means crawling
+the whole Ckan catalog once per source. :py:class:`MultiSourceSync`
+crawls it just once (in pages, through the search API), partitions
+the datasets by source, and runs the synchronizations concurrently,
+sharing a connection pool and (optionally) a rate limit. The data of
+each source is streamed, rather than loaded in memory at once.
+
+Sources are listed in a JSON manifest (see :py:func:`load_manifest`)::
+
+    {"sources": [
+        {"name": "statistica-prov", "path": "prov.sqlite"},
+        {"name": "statistica-subpro", "path": "subpro.ckanarc"}
+    ]}
+"""
+
+import json
+import logging
+import os
+
+from .hooks import RateLimitHook
+from .low_level import make_session
+from .sources import open_source
+from .syncing import SynchronizationClient
+from .utils import iter_parallel
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(filename):
+    """
+    Load a manifest of sources.
+
+    The manifest is a JSON object whose ``sources`` key lists
+    objects with the ``name`` of each source and the ``path``
+    of its data (a directory, SQLite database or source archive,
+    see :py:func:`open_source() <.sources.open_source>`),
+    relative to the manifest.
+
+    :return: list of ``(name, path)`` tuples
+    """
+    with open(filename) as fp:
+        manifest = json.load(fp)
+    base_dir = os.path.dirname(os.path.abspath(filename))
+
+    sources = []
+    for source in manifest['sources']:
+        if not source.get('name') or not source.get('path'):
+            raise ValueError('Sources need a name and a path')
+        sources.append((source['name'],
+                        os.path.join(base_dir, source['path'])))
+
+    names = [name for name, _ in sources]
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicate source names in manifest')
+    return sources
+
+
+class MultiSourceSync(object):
+    """
+    Synchronize many sources concurrently, crawling Ckan only once.
+
+    .. warning::
+        Sources sharing groups or organizations might try to create
+        them at the same time: the synchronization of all but one of
+        them would then fail. Create shared groups and organizations
+        beforehand, or run those sources separately.
+    """
+
+    def __init__(self, base_url, api_key=None, workers=4, concurrency=4,
+                 pool_size=None, rate_limit=None, **kw):
+        """
+        :param workers: number of sources synchronized at once
+        :param concurrency:
+            number of datasets synchronized at once, for each source
+        :param pool_size:
+            size of the connection pool shared by all the clients
+            (default: enough for the concurrency of all the workers)
+        :param rate_limit:
+            maximum number of requests per second, for all the
+            sources together (default: no limit)
+        :param kw:
+            other arguments for the :py:class:`SynchronizationClient
+            <.syncing.SynchronizationClient>` of each source
+        """
+        self.base_url = base_url
+        self.api_key = api_key
+        self.workers = workers
+        self.concurrency = concurrency
+        self._kw = kw
+        if pool_size is None:
+            pool_size = workers * concurrency
+        self.session = make_session(pool_size)
+        self._hooks = list(kw.pop('request_hooks', None) or [])
+        if rate_limit is not None:
+            self._hooks.append(RateLimitHook(rate_limit))
+
+    def make_client(self):
+        """
+        :return: a :py:class:`SynchronizationClient
+            <.syncing.SynchronizationClient>` sharing the connection
+            pool and hooks of this object
+        """
+        return SynchronizationClient(
+            self.base_url, self.api_key, session=self.session,
+            request_hooks=self._hooks, **self._kw)
+
+    def run(self, sources):
+        """
+        Synchronize sources.
+
+        :param sources: iterable of ``(name, path)`` tuples
+        :return: dict mapping source names to their
+            :py:class:`SyncReport <.report.SyncReport>`, or to
+            the exception that made them fail
+        """
+
+        sources = list(sources)
+        logger.info('Crawling Ckan datasets')
+        crawled = self.make_client().crawl_sources()
+
+        def _sync(source):
+            name, path = source
+            reader = open_source(path)
+            try:
+                logger.info('Synchronizing source {0}'.format(name))
+                return self.make_client().sync_source(
+                    name, reader, concurrency=self.concurrency,
+                    ckan_datasets=crawled.get(name, {}))
+            finally:
+                reader.close()
+
+        results = {}
+        for result in iter_parallel(_sync, sources,
+                                    concurrency=self.workers):
+            name = result.item[0]
+            if result.error is not None:
+                logger.error('Synchronization of source {0} failed: {1}'
+                             .format(name, result.error))
+                results[name] = result.error
+            else:
+                results[name] = result.result
+        return results
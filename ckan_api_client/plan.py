@@ -0,0 +1,198 @@
+"""
+Synchronization plans, describing what a synchronization run
+would do, without actually doing it.
+"""
+
+import json
+
+from .journal import SyncOperation
+from .objects import BaseObject
+
+
+#: Prefix of the placeholder ids used in plans for groups and
+#: organizations that don't exist yet in Ckan.
+PLACEHOLDER_PREFIX = 'planned'
+
+
+def make_placeholder_id(obj_type, name):
+    """Build the placeholder id for a group / organization to be created"""
+    return '{0}-{1}:{2}'.format(PLACEHOLDER_PREFIX, obj_type, name)
+
+
+class SyncPlan(object):
+    """
+    Full description of the changes a synchronization would apply.
+
+    .. attribute:: source_name
+
+        Name of the synchronized source
+
+    .. attribute:: groups
+
+        List of dicts describing group upserts, with keys ``name``,
+        ``action`` (``'create'``, ``'update'``, ``'reactivate'``
+        or ``'none'``), ``ckan_id`` and ``data`` (the source object)
+
+    .. attribute:: organizations
+
+        Same as :py:attr:`groups`, for organizations
+
+    .. attribute:: operations
+
+        List of :py:class:`SyncOperation <.journal.SyncOperation>`
+        on datasets (deletes, then creates, then updates)
+
+    .. attribute:: changes
+
+        Dict mapping source ids of datasets to be updated to the
+        list of changed fields
+
+    .. attribute:: failures
+
+        List of the operations that failed while planning (eg.
+        datasets that couldn't be prepared), as dicts with
+        ``action``, ``id`` and ``error`` keys, as in
+        :py:attr:`SyncReport.failures <.report.SyncReport.failures>`.
+        These objects are left out of the plan.
+    """
+
+    def __init__(self, source_name, groups=None, organizations=None,
+                 operations=None, changes=None, failures=None):
+        self.source_name = source_name
+        self.groups = groups or []
+        self.organizations = organizations or []
+        self.operations = operations or []
+        self.changes = changes or {}
+        self.failures = failures or []
+
+    def iter_operations(self, action):
+        """Iterate dataset operations of a given type"""
+        for operation in self.operations:
+            if operation.action == action:
+                yield operation
+
+    @property
+    def datasets_to_delete(self):
+        return [op.source_id for op in self.iter_operations('delete')]
+
+    @property
+    def datasets_to_create(self):
+        return [op.source_id for op in self.iter_operations('create')]
+
+    @property
+    def datasets_to_update(self):
+        return [op.source_id for op in self.iter_operations('update')]
+
+    def estimate_cost(self):
+        """
+        Estimate the number of HTTP requests and the amount of data
+        needed to apply this plan.
+
+        The estimate assumes:
+
+        - a GET for each group / organization, plus a write for
+          the ones to be created or updated
+        - one request for each dataset to be deleted
+        - a POST for each dataset to be created (name conflicts,
+          requiring further attempts, are not accounted for)
+        - a GET plus a PUT for each dataset to be updated
+
+        Sizes are those of the JSON-serialized objects; responses
+        are assumed to be about as big as the objects sent.
+
+        :return: a dict with ``http_calls``, ``bytes_sent`` and
+            ``bytes_received`` keys, both in total and in the
+            ``by_action`` breakdown.
+        """
+
+        by_action = {}
+
+        def _add(action, calls, sent, received):
+            cost = by_action.setdefault(action, {
+                'count': 0, 'http_calls': 0,
+                'bytes_sent': 0, 'bytes_received': 0})
+            cost['count'] += 1
+            cost['http_calls'] += calls
+            cost['bytes_sent'] += sent
+            cost['bytes_received'] += received
+
+        for obj_type, upserts in (('group', self.groups),
+                                  ('organization', self.organizations)):
+            for upsert in upserts:
+                size = _json_size(upsert['data'])
+                if upsert['action'] == 'none':
+                    _add('{0}_unchanged'.format(obj_type), 1, 0, size)
+                else:
+                    _add('{0}_{1}'.format(obj_type, upsert['action']),
+                         2, size, 2 * size)
+
+        for operation in self.operations:
+            if operation.action == 'delete':
+                _add('delete', 1, _json_size({'id': operation.ckan_id}), 0)
+                continue
+            size = _json_size(operation.dataset)
+            if operation.action == 'create':
+                _add('create', 1, size, size)
+            else:
+                _add('update', 2, size, 2 * size)
+
+        total = {'http_calls': 0, 'bytes_sent': 0, 'bytes_received': 0}
+        for cost in by_action.itervalues():
+            for key in total:
+                total[key] += cost[key]
+        total['by_action'] = by_action
+        return total
+
+    def to_dict(self):
+        """Return a JSON-serializable representation of the plan"""
+        return {
+            'source_name': self.source_name,
+            'groups': self.groups,
+            'organizations': self.organizations,
+            'operations': [
+                _serialize_operation(op) for op in self.operations],
+            'changes': self.changes,
+            'failures': self.failures,
+            'cost': self.estimate_cost(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Load a plan from its :py:meth:`to_dict` representation"""
+        return cls(
+            source_name=data['source_name'],
+            groups=data['groups'],
+            organizations=data['organizations'],
+            operations=[SyncOperation(**op) for op in data['operations']],
+            changes=data['changes'],
+            failures=data.get('failures'))
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def __repr__(self):
+        return ('{0}({1!r}, delete={2}, create={3}, update={4}, '
+                'failures={5})'.format(
+                    self.__class__.__name__, self.source_name,
+                    len(self.datasets_to_delete),
+                    len(self.datasets_to_create),
+                    len(self.datasets_to_update), len(self.failures)))
+
+
+def _serialize_operation(operation):
+    data = operation._asdict()
+    if isinstance(data['dataset'], BaseObject):
+        data['dataset'] = data['dataset'].serialize()
+    return data
+
+
+def _json_size(obj):
+    if obj is None:
+        return 0
+    if isinstance(obj, BaseObject):
+        obj = obj.serialize()
+    return len(json.dumps(obj))
@@ -0,0 +1,147 @@
+"""
+Profiling helpers, used by the ``--profile`` option of the
+command-line client.
+"""
+
+import cProfile
+import pstats
+import sys
+import threading
+import time
+
+
+#: Categories of the profile summary, with the predicates used to
+#: tell whether a function (by filename) belongs to them.
+CATEGORIES = (
+    ('http', 'HTTP', lambda filename: (
+        '/requests/' in filename or '/urllib3/' in filename or
+        filename.endswith(('/httplib.py', '/socket.py', '/ssl.py')))),
+    ('json', 'JSON (de)serialization', lambda filename: (
+        '/json/' in filename or '/simplejson/' in filename)),
+    ('objects', 'Object model', lambda filename: (
+        '/ckan_api_client/objects/' in filename)),
+)
+
+
+class Profiler(object):
+    """
+    Profile code running in the current thread and, optionally,
+    in all the threads started while profiling (such as the ones
+    of the pools used for concurrent requests).
+
+    Usage::
+
+        profiler = Profiler()
+        profiler.start()
+        do_something()
+        profiler.stop()
+        profiler.dump_stats('out.prof')
+        print(profiler.format_summary())
+    """
+
+    def __init__(self, threads=True):
+        self.threads = threads
+        self.wall_time = None
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._start = None
+
+    def _enable_profile(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def _start_thread(self, frame, event, arg):
+        # Called as profile function on the first event of new
+        # threads: replace it with an actual profiler.
+        sys.setprofile(None)
+        self._enable_profile()
+
+    def start(self):
+        self._start = time.time()
+        if self.threads:
+            threading.setprofile(self._start_thread)
+        self._enable_profile()
+
+    def stop(self):
+        self._profiles[0].disable()
+        threading.setprofile(None)
+        self.wall_time = time.time() - self._start
+
+    def runcall(self, func, *args, **kwargs):
+        """Profile a function call, returning its result"""
+        self.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop()
+
+    def get_stats(self):
+        """
+        :return: statistics merged from all the profiled threads
+        :rtype: :py:class:`pstats.Stats`
+        """
+        stats = None
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def dump_stats(self, filename):
+        """Write statistics to a file, readable with :py:mod:`pstats`"""
+        self.get_stats().dump_stats(filename)
+
+    def get_summary(self):
+        """
+        Split the profiled time in :py:data:`CATEGORIES`.
+
+        The time of a category is the time spent in calls to its
+        functions from functions outside of it (including nested
+        calls), so that it's not counted more than once.
+
+        :return: dict mapping category names (plus ``'total'``,
+            the wall time, and ``'other'``) to seconds
+        """
+
+        summary = dict((name, 0.0) for name, _, _ in CATEGORIES)
+        stats = self.get_stats()
+        if stats is not None:
+            for name, _, predicate in CATEGORIES:
+                summary[name] = _get_category_time(stats.stats, predicate)
+        summary['total'] = self.wall_time
+        summary['other'] = max(0.0, self.wall_time - sum(
+            summary[name] for name, _, _ in CATEGORIES))
+        return summary
+
+    def format_summary(self):
+        summary = self.get_summary()
+        total = summary['total'] or 1
+        lines = ['Wall time: {0:.3f}s'.format(summary['total'])]
+        for name, title in [(n, t) for n, t, _ in CATEGORIES] + [
+                ('other', 'Other')]:
+            lines.append('  {0:<25} {1:>9.3f}s {2:>6.1%}'.format(
+                title + ':', summary[name], summary[name] / total))
+        if self.threads:
+            lines.append('Times are summed over threads, so they can '
+                         'exceed the wall time.')
+        return '\n'.join(lines)
+
+
+def _get_category_time(stats, predicate):
+    total = 0.0
+    for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+        if not predicate(func[0]):
+            continue
+        for caller, caller_stats in callers.iteritems():
+            if not predicate(caller[0]):
+                # (nc, cc, tt, ct) for calls from this caller
+                total += caller_stats[3]
+    return total
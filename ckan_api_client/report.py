@@ -0,0 +1,175 @@
+"""
+Reports of synchronization runs.
+"""
+
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+
+#: Phases of a synchronization run, whose duration is measured
+PHASES = ('upsert', 'crawl', 'diff', 'delete', 'create', 'update')
+
+
+class SyncReport(object):
+    """
+    Report of a synchronization run, returned by the
+    :py:class:`SynchronizationClient
+    <.syncing.SynchronizationClient>` ``sync*()`` methods.
+
+    Updated concurrently by the threads performing the run.
+
+    .. attribute:: source_name
+
+        Name of the synchronized source
+
+    .. attribute:: counts
+
+        Dict mapping object types (``'dataset'``, ``'group'``,
+        ``'organization'``) to dicts of ``{action: count}``
+
+    .. attribute:: timings
+
+        Dict mapping phases (see :py:data:`PHASES`) to the time
+        spent on them, in seconds. When operations run concurrently,
+        this is the sum of the time spent by each thread.
+
+    .. attribute:: http
+
+        Dict with the number of HTTP ``calls`` and ``errors``
+        and the amount of ``bytes_sent`` and ``bytes_received``
+
+    .. attribute:: retries
+
+        Number of requests repeated, either after a 409 (name
+        conflict) or by the low-level client, after a connection
+        error or a 502 / 503 / 504 response
+
+    .. attribute:: renames
+
+        Number of datasets renamed to avoid name conflicts
+
+    .. attribute:: failures
+
+        List of failed operations, as dicts with ``action``,
+        ``id`` and ``error`` keys
+    """
+
+    def __init__(self, source_name=None):
+        self.source_name = source_name
+        self.started = time.time()
+        self.finished = None
+        self.counts = {}
+        self.timings = dict((phase, 0.0) for phase in PHASES)
+        self.http = {'calls': 0, 'errors': 0,
+                     'bytes_sent': 0, 'bytes_received': 0}
+        self.retries = 0
+        self.renames = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        """``True`` if no operation failed"""
+        return not self.failures
+
+    def count(self, obj_type, action, amount=1):
+        with self._lock:
+            counts = self.counts.setdefault(obj_type, {})
+            counts[action] = counts.get(action, 0) + amount
+
+    def get_count(self, obj_type, action):
+        return self.counts.get(obj_type, {}).get(action, 0)
+
+    def add_timing(self, phase, seconds):
+        with self._lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, phase):
+        """Context manager measuring time spent on a phase"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_timing(phase, time.time() - start)
+
+    def add_retry(self, amount=1):
+        with self._lock:
+            self.retries += amount
+
+    def add_rename(self):
+        with self._lock:
+            self.renames += 1
+
+    def add_failure(self, action, id, error):
+        with self._lock:
+            self.failures.append({
+                'action': action, 'id': id,
+                'error': '{0}: {1}'.format(type(error).__name__, error)})
+
+    def add_http_stats(self, stats):
+        """Add HTTP statistics, from a dict with the same keys"""
+        with self._lock:
+            for key in self.http:
+                self.http[key] += stats.get(key, 0)
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def duration(self):
+        """Total duration of the run, in seconds"""
+        if self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def merge(self, other):
+        """Add counters from another report (eg. of a shard)"""
+        for obj_type, counts in other.counts.iteritems():
+            for action, amount in counts.iteritems():
+                self.count(obj_type, action, amount)
+        for phase, seconds in other.timings.iteritems():
+            self.add_timing(phase, seconds)
+        self.add_http_stats(other.http)
+        with self._lock:
+            self.retries += other.retries
+            self.renames += other.renames
+            self.failures.extend(other.failures)
+
+    def to_dict(self):
+        """Return a JSON-serializable representation of the report"""
+        return {
+            'source_name': self.source_name,
+            'started': self.started,
+            'finished': self.finished,
+            'duration': self.duration,
+            'counts': self.counts,
+            'timings': self.timings,
+            'http': self.http,
+            'retries': self.retries,
+            'renames': self.renames,
+            'failures': self.failures,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        report = cls(data['source_name'])
+        report.started = data['started']
+        report.finished = data['finished']
+        report.counts = data['counts']
+        report.timings = data['timings']
+        report.http = data['http']
+        report.retries = data['retries']
+        report.renames = data['renames']
+        report.failures = data['failures']
+        return report
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def __repr__(self):
+        return '{0}({1!r}, counts={2!r}, failures={3})'.format(
+            self.__class__.__name__, self.source_name, self.counts,
+            len(self.failures))
@@ -0,0 +1,147 @@
+"""
+Local snapshot of the datasets in a Ckan instance, allowing
+incremental crawling based on ``metadata_modified`` watermarks.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+
+from .objects import CkanDataset
+
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetSnapshot(object):
+    """
+    Copy of Ckan datasets, stored in a SQLite database, along with
+    the highest ``metadata_modified`` value seen (the "watermark").
+
+    On each :py:meth:`refresh`, only datasets modified since the
+    watermark (plus the ones missing from the snapshot) are fetched
+    from Ckan, and datasets no longer in Ckan are dropped.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename:
+            path to the SQLite database file. Will be created
+            if it doesn't exist.
+        """
+        self.filename = filename
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock:
+            self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshot_dataset (
+                id TEXT PRIMARY KEY,
+                metadata_modified TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshot_info (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """)
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    @property
+    def watermark(self):
+        """Highest ``metadata_modified`` seen so far (or ``None``)"""
+        cur = self._db.execute(
+            "SELECT value FROM snapshot_info WHERE key='watermark'")
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def list_ids(self):
+        """:return: set of the ids of datasets in the snapshot"""
+        return set(self._get_modified())
+
+    def _get_modified(self):
+        cur = self._db.execute(
+            'SELECT id, metadata_modified FROM snapshot_dataset')
+        return dict(cur.fetchall())
+
+    def get_dataset(self, id):
+        """:rtype: :py:class:`CkanDataset` or ``None``"""
+        cur = self._db.execute(
+            'SELECT data FROM snapshot_dataset WHERE id=?', (id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return CkanDataset(json.loads(row[0]))
+
+    def iter_datasets(self):
+        """Iterate all the datasets in the snapshot, by id"""
+        cur = self._db.execute(
+            'SELECT data FROM snapshot_dataset ORDER BY id')
+        for row in cur:
+            yield CkanDataset(json.loads(row[0]))
+
+    def refresh(self, client):
+        """
+        Bring the snapshot up to date.
+
+        Costs a ``list_datasets`` request, a few ``package_search``
+        pages for the datasets modified since the last refresh, and
+        a ``get_dataset`` request for each of them.
+
+        :param client:
+            :py:class:`CkanHighlevelClient
+            <.high_level.CkanHighlevelClient>` to be used
+        :return: a ``(fetched, removed)`` tuple with the number of
+            datasets fetched and dropped.
+        """
+
+        since = self.watermark
+        watermark = since
+        known = self._get_modified()
+        known_ids = set(known)
+        current_ids = set(client.list_datasets())
+
+        removed = known_ids - current_ids
+        to_fetch = {}
+        for id in current_ids - known_ids:
+            to_fetch[id] = None
+
+        for id, modified in client.iter_modified_dataset_ids(since=since):
+            if watermark is None or modified > watermark:
+                watermark = modified
+            if id in current_ids and known.get(id) != modified:
+                to_fetch[id] = modified
+
+        logger.info('Refreshing snapshot: {0} datasets to fetch, '
+                    '{1} to remove'.format(len(to_fetch), len(removed)))
+
+        for id, modified in sorted(to_fetch.iteritems()):
+            dataset = client.get_dataset(id)
+            self._store(dataset, modified)
+
+        with self._lock:
+            self._db.executemany(
+                'DELETE FROM snapshot_dataset WHERE id=?',
+                ((id,) for id in removed))
+            if watermark is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO snapshot_info (key, value) '
+                    "VALUES ('watermark', ?)", (watermark,))
+            self._db.commit()
+
+        return len(to_fetch), len(removed)
+
+    def _store(self, dataset, modified):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO snapshot_dataset '
+                '(id, metadata_modified, data) VALUES (?, ?, ?)',
+                (dataset.id, modified, json.dumps(dataset.serialize())))
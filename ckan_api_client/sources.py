@@ -0,0 +1,489 @@
+"""
+Readers for harvest sources stored on disk.
+
+:py:class:`DirectorySource` reads sources in the layout used by the
+``import_directory`` command: a directory for each object type, with
+a JSON file per object::
+
+    source_dir
+    |-- dataset
+    |   '-- <json files>
+    |-- group
+    |   '-- <json files>
+    '-- organization
+        '-- <json files>
+
+Files are only listed (with their modification time and size) upfront;
+their content is loaded on demand, by a pool of threads.
+
+:py:class:`SQLiteSource` reads sources in the format used by the
+``import_sqlite`` command: a ``(id, json_data)`` table for each
+object type.
+
+:py:class:`SourceArchive` reads single-file source archives, written
+by :py:class:`SourceArchiveWriter`. These are much faster to open and
+scan than the other formats, for large sources. Their layout is::
+
+    MAGIC | record | record | .. | index | trailer
+
+where records are JSON-serialized objects, the index is a JSON object
+mapping object types to ``{key: [offset, length]}`` dicts, and the
+trailer holds the offset and length of the index (two little-endian
+unsigned 64-bit integers) followed by the magic string again.
+Archives are only ever appended to: new records and a new index are
+written after the existing ones, superseding them.
+
+All the readers share the same interface (:py:meth:`iter_objects`,
+:py:meth:`load_all`), accepted by :py:meth:`SynchronizationClient.\
+sync_source() <ckan_api_client.syncing.SynchronizationClient.sync_source>`.
+
+A :py:class:`SourceManifest` records the state of the files at the
+last successful import, so that unchanged files can be skipped.
+"""
+
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+
+from .utils import iter_chunks, iter_parallel
+
+
+OBJECT_TYPES = ('dataset', 'group', 'organization')
+
+#: Magic string at the start and at the end of source archives
+ARCHIVE_MAGIC = 'CKANSRC1'
+
+_TRAILER = struct.Struct('<QQ8s')
+
+
+def get_object_key(obj_type, obj):
+    """
+    Key of an object in the source: the id for datasets,
+    the name for groups and organizations.
+    """
+    if obj_type == 'dataset':
+        return obj['id']
+    return obj['name']
+
+
+class DirectorySource(object):
+    """
+    Lazy reader of a source directory.
+    """
+
+    def __init__(self, path, concurrency=4, batch_size=50):
+        """
+        :param path: path of the source directory
+        :param concurrency: number of threads reading files
+        :param batch_size:
+            number of files read by each task given to the threads
+            (handing out files one by one would make the overhead
+            of the pool larger than the time taken to read them)
+        """
+        self.path = path
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+    def list_files(self, obj_type):
+        """
+        List the files of a given object type.
+
+        :return: dict mapping file names to ``(mtime, size)`` tuples
+        """
+        base_dir = os.path.join(self.path, obj_type)
+        files = {}
+        for name in os.listdir(base_dir):
+            if name.startswith('.') or name.endswith('~'):
+                # Skip hidden / backup files
+                continue
+            stat = os.stat(os.path.join(base_dir, name))
+            files[name] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def load(self, obj_type, name):
+        """Load the object stored in a file"""
+        with open(os.path.join(self.path, obj_type, name), 'rb') as fp:
+            return json.load(fp)
+
+    def iter_objects(self, obj_type, names=None):
+        """
+        Load objects in parallel.
+
+        :param names:
+            names of the files to load (default: all of them)
+        :return: generator of ``(name, key, object)`` tuples,
+            in no particular order
+        """
+        if names is None:
+            names = self.list_files(obj_type)
+
+        def load_batch(batch):
+            return [self.load(obj_type, name) for name in batch]
+
+        results = iter_parallel(load_batch,
+                                iter_chunks(names, self.batch_size),
+                                concurrency=self.concurrency)
+        for result in results:
+            if result.error is not None:
+                raise result.error
+            for name, obj in zip(result.item, result.result):
+                yield name, get_object_key(obj_type, obj), obj
+
+    def load_all(self, obj_type):
+        """:return: dict mapping keys to all the objects of a type"""
+        return dict((key, obj) for _, key, obj in self.iter_objects(obj_type))
+
+    def close(self):
+        pass
+
+
+def iter_sqlite_table(db, table, batch_size=500, where=None, params=()):
+    """
+    Generate ``(id, object)`` tuples from a ``(id, json_data)``
+    table, fetching ``batch_size`` rows at a time and parsing
+    them lazily.
+
+    :param where: optional condition for the ``WHERE`` clause
+    :param params: parameters of the condition
+    """
+    query = 'SELECT id, json_data FROM "{0}"'.format(table)
+    if where is not None:
+        query += ' WHERE {0}'.format(where)
+    cur = db.cursor()
+    cur.execute(query, params)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield str(row[0]), json.loads(row[1])
+
+
+class SQLiteSource(object):
+    """
+    Reader of a source stored in a SQLite database.
+    """
+
+    def __init__(self, filename, tables=None, batch_size=500):
+        """
+        :param filename: path of the database
+        :param tables: dict mapping object types to table names
+            (by default, tables are named after object types)
+        :param batch_size: number of rows fetched at once
+        """
+        self.filename = filename
+        self.tables = dict((obj_type, obj_type) for obj_type in OBJECT_TYPES)
+        self.tables.update(tables or {})
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(filename)
+
+    def iter_objects(self, obj_type):
+        """:return: generator of ``(id, id, object)`` tuples"""
+        rows = iter_sqlite_table(self.db, self.tables[obj_type],
+                                 batch_size=self.batch_size)
+        for key, obj in rows:
+            yield key, key, obj
+
+    def load_all(self, obj_type):
+        return dict(iter_sqlite_table(self.db, self.tables[obj_type],
+                                      batch_size=self.batch_size))
+
+    def close(self):
+        self.db.close()
+
+
+class SourceArchive(object):
+    """
+    Reader of a source archive, memory-mapped.
+
+    Usage::
+
+        with SourceArchive('source.ckanarc') as archive:
+            dataset = archive.get('dataset', 'ds-0001')
+            for key, data in archive.iter_raw('dataset'):
+                pass  # data is a buffer on the mapped file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fp = open(filename, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._fp.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files cannot be mapped
+            self._fp.close()
+            raise ValueError('Not a source archive: {0}'.format(filename))
+
+        size = len(self._mmap)
+        if (size < len(ARCHIVE_MAGIC) + _TRAILER.size or
+                self._mmap[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC):
+            self.close()
+            raise ValueError('Not a source archive: {0}'.format(filename))
+        offset, length, magic = _TRAILER.unpack(
+            self._mmap[size - _TRAILER.size:])
+        if magic != ARCHIVE_MAGIC:
+            self.close()
+            raise ValueError('Truncated source archive: {0}'
+                             .format(filename))
+
+        #: Offset of the index (i.e. where the data ends)
+        self.index_offset = offset
+        #: dict mapping object types to ``{key: (offset, length)}``
+        self.index = json.loads(self._mmap[offset:offset + length])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+        self._fp.close()
+
+    def keys(self, obj_type):
+        return self.index.get(obj_type, {}).keys()
+
+    def get_raw(self, obj_type, key):
+        """
+        :return: the serialized object, as a buffer on the mapped file
+        :raises KeyError: if there is no such object
+        """
+        offset, length = self.index.get(obj_type, {})[key]
+        return buffer(self._mmap, offset, length)
+
+    def get(self, obj_type, key):
+        """
+        :return: the object with the given key
+        :raises KeyError: if there is no such object
+        """
+        offset, length = self.index.get(obj_type, {})[key]
+        return json.loads(self._mmap[offset:offset + length])
+
+    def iter_raw(self, obj_type):
+        """
+        Scan the objects of a type, in file order, without copying
+        their data.
+
+        :return: generator of ``(key, buffer)`` tuples
+        """
+        entries = sorted(self.index.get(obj_type, {}).iteritems(),
+                         key=lambda item: item[1][0])
+        for key, (offset, length) in entries:
+            yield key, buffer(self._mmap, offset, length)
+
+    def iter_objects(self, obj_type):
+        """:return: generator of ``(key, key, object)`` tuples"""
+        for key, data in self.iter_raw(obj_type):
+            yield key, key, json.loads(str(data))
+
+    def load_all(self, obj_type):
+        return dict((key, obj) for _, key, obj in self.iter_objects(obj_type))
+
+
+class SourceArchiveWriter(object):
+    """
+    Writer of source archives.
+
+    The index is kept in memory, and written by :py:meth:`close`:
+    the archive is unreadable until then.
+    """
+
+    def __init__(self, filename, append=False):
+        """
+        :param filename: path of the archive
+        :param append:
+            if ``True``, and the archive exists, add objects to it
+            (replacing the ones with the same key), instead of
+            overwriting it.
+        """
+        self.filename = filename
+        if append and os.path.exists(filename):
+            with SourceArchive(filename) as archive:
+                self.index = archive.index
+            self._fp = open(filename, 'ab')
+        else:
+            self.index = {}
+            self._fp = open(filename, 'wb')
+            self._fp.write(ARCHIVE_MAGIC)
+        for obj_type in OBJECT_TYPES:
+            self.index.setdefault(obj_type, {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def write(self, obj_type, key, obj):
+        """
+        Add an object to the archive.
+
+        :param obj: the object, or its JSON serialization (as string
+            or buffer), that is written as-is (unicode strings are
+            encoded to UTF-8 first).
+        """
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+        elif not isinstance(obj, (str, buffer)):
+            obj = json.dumps(obj)
+        offset = self._fp.tell()
+        self._fp.write(obj)
+        self.index.setdefault(obj_type, {})[key] = (offset, len(obj))
+
+    def delete(self, obj_type, key):
+        self.index.get(obj_type, {}).pop(key, None)
+
+    def close(self):
+        offset = self._fp.tell()
+        index = json.dumps(self.index)
+        self._fp.write(index)
+        self._fp.write(_TRAILER.pack(offset, len(index), ARCHIVE_MAGIC))
+        self._fp.close()
+
+
+def open_source(path, **kwargs):
+    """
+    Open a source reader, according to the path: a
+    :py:class:`DirectorySource` for directories, a
+    :py:class:`SQLiteSource` for ``.sqlite`` / ``.db`` files,
+    else a :py:class:`SourceArchive`.
+
+    Keyword arguments are passed to the reader.
+    """
+    if os.path.isdir(path):
+        return DirectorySource(path, **kwargs)
+    if path.endswith(('.sqlite', '.db')):
+        return SQLiteSource(path, **kwargs)
+    return SourceArchive(path, **kwargs)
+
+
+def write_archive(source, filename, append=False):
+    """
+    Write all the objects of a source to an archive.
+
+    :param source: a source reader (see :py:func:`open_source`)
+    :return: dict with the number of objects written, by type
+    """
+    counts = {}
+    with SourceArchiveWriter(filename, append=append) as writer:
+        for obj_type in OBJECT_TYPES:
+            counts[obj_type] = 0
+            if isinstance(source, SourceArchive):
+                # No need to parse objects: copy them as they are
+                objects = source.iter_raw(obj_type)
+            else:
+                objects = ((key, obj) for _, key, obj
+                           in source.iter_objects(obj_type))
+            for key, obj in objects:
+                writer.write(obj_type, key, obj)
+                counts[obj_type] += 1
+    return counts
+
+
+def extract_archive(archive, destination):
+    """
+    Write the objects of an archive to a SQLite database (if the
+    destination ends in ``.sqlite`` or ``.db``) or to a directory,
+    in the formats read by :py:class:`SQLiteSource` and
+    :py:class:`DirectorySource`.
+
+    :param archive: a :py:class:`SourceArchive`
+    :raises ValueError:
+        when extracting to a directory, if any of the keys is not
+        a valid file name (nothing is written in that case)
+    :return: dict with the number of objects written, by type
+    """
+    counts = {}
+    if destination.endswith(('.sqlite', '.db')):
+        db = sqlite3.connect(destination)
+        try:
+            for obj_type in OBJECT_TYPES:
+                db.execute('CREATE TABLE IF NOT EXISTS "{0}" '
+                           '(id TEXT PRIMARY KEY, json_data TEXT)'
+                           .format(obj_type))
+                counts[obj_type] = db.executemany(
+                    'INSERT OR REPLACE INTO "{0}" (id, json_data) '
+                    'VALUES (?, ?)'.format(obj_type),
+                    ((key, str(data)) for key, data
+                     in archive.iter_raw(obj_type))).rowcount
+            db.commit()
+        finally:
+            db.close()
+        return counts
+
+    # Keys come from the archive: make sure they can't be used
+    # to write outside of the destination
+    for obj_type in OBJECT_TYPES:
+        for key in archive.keys(obj_type):
+            if not _is_safe_file_name(key):
+                raise ValueError('Invalid {0} key: {1!r}'
+                                 .format(obj_type, key))
+
+    for obj_type in OBJECT_TYPES:
+        dirname = os.path.join(destination, obj_type)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        counts[obj_type] = 0
+        for key, data in archive.iter_raw(obj_type):
+            with open(os.path.join(dirname, key), 'wb') as fp:
+                fp.write(data)
+            counts[obj_type] += 1
+    return counts
+
+
+def _is_safe_file_name(name):
+    return not (not name or name.startswith('/') or '..' in name
+                or os.sep in name or '\0' in name
+                or (os.altsep and os.altsep in name))
+
+
+class SourceManifest(object):
+    """
+    State of the files of a source at the last import: for each
+    file, its modification time and size, and the key of the object
+    it contains.
+
+    Changes are recorded in memory, and only written by :py:meth:`save`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._files = {}
+        if os.path.exists(filename):
+            with open(filename) as fp:
+                self._files = json.load(fp)
+
+    def is_unchanged(self, obj_type, name, stat):
+        """
+        Check whether a file is unchanged since the last import.
+
+        :param stat: ``(mtime, size)`` tuple
+        """
+        entry = self._files.get(obj_type, {}).get(name)
+        return entry is not None and tuple(entry[:2]) == tuple(stat)
+
+    def get_key(self, obj_type, name):
+        return self._files[obj_type][name][2]
+
+    def update(self, obj_type, name, stat, key):
+        self._files.setdefault(obj_type, {})[name] = list(stat) + [key]
+
+    def retain(self, obj_type, names):
+        """Forget about files not in ``names``"""
+        entries = self._files.get(obj_type, {})
+        for name in set(entries) - set(names):
+            del entries[name]
+
+    def save(self):
+        # Write to a temporary file, then rename it, so that an
+        # interrupted write won't leave a truncated manifest
+        fd, tmpname = tempfile.mkstemp(
+            prefix='.', dir=os.path.dirname(os.path.abspath(self.filename)))
+        with os.fdopen(fd, 'wb') as fp:
+            json.dump(self._files, fp)
+        os.rename(tmpname, self.filename)
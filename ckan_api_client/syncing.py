@@ -1,11 +1,24 @@
-import copy
+import binascii
+from contextlib import contextmanager
+import datetime
+import itertools
 import logging
+from multiprocessing import Pool
 import random
+import threading
+import time
+import uuid
 
+from ckan_api_client import tracing
 from ckan_api_client.exceptions import HTTPError
 from ckan_api_client.high_level import CkanHighlevelClient
+from ckan_api_client.journal import (
+    SyncOperation, STATE_PENDING, STATE_STARTED)
 from ckan_api_client.objects import CkanDataset, CkanOrganization, CkanGroup
-from ckan_api_client.utils import IDMap, IDPair
+from ckan_api_client.plan import SyncPlan, make_placeholder_id
+from ckan_api_client.report import SyncReport
+from ckan_api_client.tracing import traced
+from ckan_api_client.utils import IDMap, IDPair, iter_chunks, iter_parallel
 
 
 # Extras field containing id of the external source.
@@ -78,18 +91,86 @@ class SynchronizationClient(object):
             - 'add' add groups, keep old ones (default)
             - 'replace' replace all existing groups
             - 'preserve' leave groups alone
+
+        :param dataset_name_preflight:
+            if ``True`` (the default), names of datasets to be created
+            are checked against the list of names already in use
+            (retrieved with a single request) and renamed beforehand,
+            instead of relying on 409 responses to detect conflicts.
+
+        :param upsert_concurrency:
+            number of groups / organizations to be upserted at once
+            (default: 4)
+
+        :param fail_fast:
+            if ``True`` (the default), the first failing operation
+            aborts the synchronization, raising an exception.
+            Otherwise, failures are recorded in the returned
+            :py:class:`SyncReport <.report.SyncReport>` and the
+            synchronization goes on (datasets that couldn't be
+            prepared are left alone).
+
+        :param verification:
+            verification policy for written objects, passed to
+            the high-level client. See :py:class:`CkanHighlevelClient
+            <.high_level.CkanHighlevelClient>`.
+
+        :param identity_map:
+            whether to enable the identity map (cache of groups and
+            organizations) on the high-level client.
+
+        :param request_hooks:
+            request hooks, passed to the high-level client.
+
+        :param max_retries:
+            retries of failed idempotent requests, passed to the
+            high-level client.
+
+        :param pool_size:
+            size of the HTTP connection pool, passed to the
+            high-level client.
+
+        :param session:
+            :py:class:`requests.Session` (holding the connection
+            pool) passed to the high-level client.
+
+        :param snapshot:
+            a :py:class:`DatasetSnapshot <.snapshot.DatasetSnapshot>`.
+            If specified, it is refreshed (fetching only datasets
+            modified since the previous run) and used instead of
+            retrieving all the datasets from Ckan.
         """
-        self._client = CkanHighlevelClient(base_url, api_key)
+        # Needed to build clients for worker processes
+        self._init_args = (base_url, api_key, dict(kw))
+
+        self._client = CkanHighlevelClient(
+            base_url, api_key,
+            verification=kw.pop('verification', None),
+            identity_map=kw.pop('identity_map', False),
+            request_hooks=kw.pop('request_hooks', None),
+            max_retries=kw.pop('max_retries', 0),
+            pool_size=kw.pop('pool_size', 10),
+            session=kw.pop('session', None))
+        self._snapshot = kw.pop('snapshot', None)
+
+        # Report of the current run
+        self._report = SyncReport()
+        self._http_baseline = None
         self._conf = {
             'organization_merge_strategy': 'create',
             'group_merge_strategy': 'create',
             'dataset_preserve_names': True,
             'dataset_preserve_organization': True,
             'dataset_group_merge_strategy': 'add',
+            'dataset_name_preflight': True,
+            'upsert_concurrency': 4,
+            'fail_fast': True,
         }
         self._conf.update(kw)
 
-    def sync(self, source_name, data):
+    @traced('sync', arg_name='source_name')
+    def sync(self, source_name, data, journal=None, run_id=None,
+             ckan_datasets=None, resume=False):
         """
         Synchronize data from a source into Ckan.
 
@@ -103,113 +184,1124 @@ class SynchronizationClient(object):
             Data to be synchronized. Should be a dict (or dict-like)
             with top level keys coresponding to the object type,
             mapping to dictionaries of ``{'id': <object>}``.
+        :param journal:
+            A :py:class:`SyncJournal <.journal.SyncJournal>`. If
+            specified, planned operations are recorded in the journal
+            and marked as done as they complete. Runs with failed
+            operations are left unfinished.
+            If the run identified by ``run_id`` (or, when ``resume``
+            is ``True``, the latest unfinished run for the same source)
+            is found in the journal, it will be resumed instead: only
+            the remaining operations are performed, ignoring ``data``
+            and without computing the differences again.
+            When a new run is planned, the unfinished runs of the
+            source are abandoned, as they are superseded by it.
+        :param run_id:
+            Id of the run in the journal. A new one is generated
+            if not specified.
+        :param ckan_datasets:
+            dict mapping source ids to the datasets of this source
+            currently in Ckan, as returned by :py:meth:`crawl_sources`.
+            If specified, Ckan is not crawled again.
+        :param resume:
+            if ``True``, resume the latest unfinished run of the
+            source, if any, when ``run_id`` is not specified.
+        :rtype: :py:class:`SyncReport <.report.SyncReport>`
         """
 
-        groups = dict(
-            (key, CkanGroup(val))
-            for key, val in data['group'].iteritems())
+        self._start_report(source_name)
 
-        organizations = dict(
-            (key, CkanOrganization(val))
-            for key, val in data['organization'].iteritems())
+        if journal is not None:
+            if run_id is None and resume:
+                run_id = journal.find_unfinished_run(source_name)
+            if run_id is not None and journal.has_run(source_name, run_id):
+                logger.info('Resuming synchronization run {0}'
+                            .format(run_id))
+                self._resume_run(source_name, journal, run_id)
+                return self._finish_report()
+            if run_id is None:
+                run_id = _generate_run_id()
 
-        # Upsert groups and organizations
-        groups_map = self._upsert_groups(groups)
-        orgs_map = self._upsert_organizations(organizations)
+        with self._phase('upsert'):
+            groups_map, orgs_map = self._upsert_groups_and_organizations(
+                data['group'], data['organization'])
 
         # Create list of datasets to be synced
-        source_datasets = {}
-        for source_id, dataset_dict in data['dataset'].iteritems():
-            _dataset_dict = copy.deepcopy(dataset_dict)
+        with self._phase('diff'):
+            source_datasets, failed_ids = self._prepare_source_datasets(
+                source_name, data['dataset'], groups_map, orgs_map)
 
-            # We need to make sure "source" datasets
-            # don't have (otherwise misleading) ids
-            _dataset_dict.pop('id', None)
+        # Retrieve list of datasets from Ckan
+        with self._phase('crawl'):
+            if ckan_datasets is None:
+                ckan_datasets = self._find_datasets_by_source(source_name)
+            else:
+                ckan_datasets = dict(ckan_datasets)
 
-            # We need to update groups and organizations,
-            # to map their name from the source into a
-            # ckan id
-            _dataset_dict['groups'] = [
-                groups_map.to_ckan(grp_id)
-                for grp_id in _dataset_dict['groups']
-            ]
-            _dataset_dict['owner_org'] = \
-                orgs_map.to_ckan(_dataset_dict['owner_org'])
+        # Datasets we failed to prepare must be left alone
+        for source_id in failed_ids:
+            ckan_datasets.pop(source_id, None)
 
-            dataset = CkanDataset(_dataset_dict)
+        # Compare collections to find differences
+        with self._phase('diff'):
+            differences = self._compare_collections(
+                ckan_datasets, source_datasets)
+            operations = self._plan_dataset_operations(
+                ckan_datasets, source_datasets, differences)
 
-            # We also want to add the "source id", used for further
-            # synchronizations to find stuff
-            dataset.extras[HARVEST_SOURCE_ID_FIELD] = \
-                self._join_source_id(source_name, source_id)
+        if journal is not None:
+            journal.abandon_runs(source_name)
+            journal.create_run(source_name, run_id, operations)
 
-            source_datasets[source_id] = dataset
+        self._run_operations(operations, source_name, journal, run_id)
+        return self._finish_report()
 
-        # Retrieve list of datasets from Ckan
-        ckan_datasets = self._find_datasets_by_source(source_name)
+    @contextmanager
+    def _phase(self, phase, parent=None, **attributes):
+        """
+        Context manager measuring the time spent on a phase of the
+        current run, and tracing it as a ``sync.<phase>`` span.
+        """
+        with tracing.span('sync.' + phase, parent=parent, **attributes):
+            with self._report.timer(phase):
+                yield
+
+    def _start_report(self, source_name):
+        """Start collecting the report of a new run"""
+        self._report = SyncReport(source_name)
+        self._http_baseline = self._client.get_request_stats()
+        return self._report
+
+    def _finish_report(self):
+        """Complete the report of the current run and return it"""
+        report = self._report
+        stats = self._client.get_request_stats()
+        stats = dict((key, value - self._http_baseline.get(key, 0))
+                     for key, value in stats.iteritems())
+        report.add_http_stats(stats)
+        report.add_retry(stats.get('retries', 0))
+        report.finish()
+        logger.info('Synchronization of {0} done: {1!r}'
+                    .format(report.source_name, report.counts))
+        return report
+
+    def _prepare_source_datasets(self, source_name, datasets, groups_map,
+                                 orgs_map):
+        """
+        Prepare all the source datasets (see
+        :py:meth:`_prepare_source_dataset`).
 
-        # Compare collections to find differences
-        differences = self._compare_collections(
-            ckan_datasets, source_datasets)
+        :return: a ``(prepared, failed_ids)`` tuple, where ``prepared``
+            maps source ids to datasets, and ``failed_ids`` is the set
+            of source ids of datasets that couldn't be prepared (only
+            when not in ``fail_fast`` mode).
+        """
+        prepared = {}
+        failed_ids = set()
+        for source_id, dataset_dict in datasets.iteritems():
+            try:
+                prepared[source_id] = self._prepare_source_dataset(
+                    source_name, source_id, dataset_dict,
+                    groups_map, orgs_map)
+            except Exception, e:
+                self._report.add_failure('prepare', source_id, e)
+                if self._conf['fail_fast']:
+                    raise
+                failed_ids.add(source_id)
+        return prepared, failed_ids
+
+    def plan(self, source_name, data):
+        """
+        Compute what :py:meth:`sync` would do, without writing
+        anything to Ckan.
+
+        Groups and organizations that don't exist yet are referenced
+        by placeholder ids in the planned datasets, which will be
+        replaced with the actual ids by :py:meth:`apply`.
+
+        Datasets that couldn't be prepared, and groups / organizations
+        whose lookup failed, are listed in the plan ``failures``;
+        the report of the last run is left untouched.
+
+        :param source_name: see :py:meth:`sync`
+        :param data: see :py:meth:`sync`
+        :rtype: :py:class:`SyncPlan <.plan.SyncPlan>`
+        """
+
+        # Failures are collected in a scratch report, as the one
+        # of the last run has already been returned to the caller.
+        report, self._report = self._report, SyncReport(source_name)
+        try:
+            actions = {}
+            groups_map, orgs_map = self._upsert_groups_and_organizations(
+                data['group'], data['organization'], dry_run=True,
+                actions=actions)
+
+            source_datasets, failed_ids = self._prepare_source_datasets(
+                source_name, data['dataset'], groups_map, orgs_map)
+
+            ckan_datasets = self._find_datasets_by_source(source_name)
+            for source_id in failed_ids:
+                ckan_datasets.pop(source_id, None)
+            differences = self._compare_collections(
+                ckan_datasets, source_datasets)
+
+            changes = {}
+            operations = self._plan_dataset_operations(
+                ckan_datasets, source_datasets, differences, changes=changes)
+            failures = self._report.failures
+        finally:
+            self._report = report
+
+        def _upserts(obj_type):
+            return [
+                {'name': name, 'action': action, 'ckan_id': ckan_id,
+                 'data': data[obj_type][name]}
+                for name, (action, ckan_id)
+                in sorted(actions[obj_type].iteritems())]
+
+        return SyncPlan(
+            source_name,
+            groups=_upserts('group'),
+            organizations=_upserts('organization'),
+            operations=operations,
+            changes=changes,
+            failures=failures)
+
+    @traced('sync.apply')
+    def apply(self, plan, journal=None, run_id=None):
+        """
+        Apply a plan computed by :py:meth:`plan`.
+
+        Groups and organizations are upserted again (as they might
+        have changed in the meanwhile), then the planned dataset
+        operations are performed.
+
+        :param plan: a :py:class:`SyncPlan <.plan.SyncPlan>`
+        :param journal: see :py:meth:`sync`
+        :param run_id: see :py:meth:`sync`
+        :rtype: :py:class:`SyncReport <.report.SyncReport>`
+        """
+
+        source_name = plan.source_name
+        self._start_report(source_name)
+
+        with self._phase('upsert'):
+            groups_map, orgs_map = self._upsert_groups_and_organizations(
+                dict((g['name'], g['data']) for g in plan.groups),
+                dict((o['name'], o['data']) for o in plan.organizations))
+
+        # Replace placeholder ids with the actual ones
+        placeholders = {}
+        for group in plan.groups:
+            placeholders[make_placeholder_id('group', group['name'])] = \
+                groups_map.to_ckan(group['name'])
+        for org in plan.organizations:
+            placeholders[make_placeholder_id('organization', org['name'])] \
+                = orgs_map.to_ckan(org['name'])
+
+        operations = [
+            op._replace(dataset=_replace_placeholders(
+                op.dataset, placeholders))
+            for op in plan.operations]
+
+        if journal is not None:
+            if run_id is None:
+                run_id = _generate_run_id()
+            journal.abandon_runs(source_name)
+            journal.create_run(source_name, run_id, operations)
+
+        self._run_operations(operations, source_name, journal, run_id)
+        return self._finish_report()
+
+    @traced('sync', arg_name='source_name')
+    def sync_sharded(self, source_name, data, workers=4):
+        """
+        Sharded version of :py:meth:`sync`, spreading the work
+        across ``workers`` processes.
+
+        - groups and organizations are upserted once, in the
+          calling process; the resulting id maps are passed
+          to all the workers
+        - the list of Ckan datasets is split among the workers,
+          which retrieve them in parallel
+        - names of datasets to be created are checked (see the
+          ``dataset_name_preflight`` option) in the calling process,
+          for all the shards at once
+        - source datasets are partitioned by hash of their
+          source id; each worker then synchronizes its shard,
+          using its own client.
+
+        .. note:: journals are not supported in sharded mode, and
+            tracing spans are only collected in the calling process.
+
+        :param source_name: see :py:meth:`sync`
+        :param data: see :py:meth:`sync`
+        :param workers: number of worker processes
+        :return: a :py:class:`SyncReport <.report.SyncReport>`,
+            merging the reports of all the shards. Shards that
+            failed altogether are reported as ``'shard'`` failures.
+        """
+
+        report = self._start_report(source_name)
+
+        with self._phase('upsert'):
+            groups_map, orgs_map = self._upsert_groups_and_organizations(
+                data['group'], data['organization'])
+
+        # Workers build their own client (and connection pool)
+        base_url, api_key, conf = self._init_args
+        conf = dict((key, value) for key, value in conf.iteritems()
+                    if key not in ('session', 'snapshot'))
+        pool = Pool(workers, initializer=_shard_worker_init,
+                    initargs=(self.__class__, base_url, api_key, conf))
+        try:
+            # Phase 1: retrieve Ckan datasets, split by position
+            ckan_ids = self._client.list_datasets()
+            crawled = pool.map(_shard_worker_crawl, [
+                (source_name, ckan_ids[i::workers])
+                for i in xrange(workers)])
+
+            for _, crawl_report in crawled:
+                report.merge(SyncReport.from_dict(crawl_report))
+            ckan_datasets = dict(itertools.chain(
+                *(pairs for pairs, _ in crawled)))
+
+            # Names are assigned once for all the shards, so that
+            # they can't pick the same ones.
+            source_datasets = data['dataset']
+            if self._conf['dataset_name_preflight']:
+                with self._phase('diff'):
+                    source_datasets = self._assign_source_dataset_names(
+                        ckan_datasets, source_datasets)
+
+            shards = [({}, {}) for _ in xrange(workers)]
+            for source_id, dataset in ckan_datasets.iteritems():
+                shards[_get_shard(source_id, workers)][0][source_id] = \
+                    dataset
+            for source_id, dataset in source_datasets.iteritems():
+                shards[_get_shard(source_id, workers)][1][source_id] = \
+                    dataset
+
+            # Phase 2: synchronize each shard
+            reports = pool.map(_shard_worker_sync, [
+                (shard, source_name, ckan_shard, source_shard,
+                 groups_map, orgs_map)
+                for shard, (ckan_shard, source_shard)
+                in enumerate(shards)])
+        finally:
+            pool.close()
+            pool.join()
+
+        for shard_report in reports:
+            report.merge(SyncReport.from_dict(shard_report))
+        return self._finish_report()
+
+    @traced('sync', arg_name='source_name')
+    def sync_pipelined(self, source_name, data, concurrency=4):
+        """
+        Pipelined version of :py:meth:`sync`, overlapping the
+        retrieval of Ckan datasets with writes, using a pool of
+        ``concurrency`` threads:
+
+        - updates are dispatched as soon as the matching Ckan
+          dataset has been retrieved, while crawling goes on
+        - once the crawl is over (and thus all the datasets to be
+          created are known), creations and deletions are dispatched
+          right away, without waiting for pending updates.
+          A creation waits for a deletion only if the deleted dataset
+          is using the name it needs.
+
+        Source datasets are converted lazily, when dispatched.
+
+        .. note:: journals are not supported in pipelined mode.
+
+        :param source_name: see :py:meth:`sync`
+        :param data: see :py:meth:`sync`
+        :param concurrency: number of concurrent write operations
+        :raises: in ``fail_fast`` mode, the first exception raised
+            by an operation, once all the others are completed.
+        :rtype: :py:class:`SyncReport <.report.SyncReport>`
+        """
+
+        report = self._start_report(source_name)
+
+        with self._phase('upsert'):
+            groups_map, orgs_map = self._upsert_groups_and_organizations(
+                data['group'], data['organization'])
+
+        def _prepare(source_id):
+            return self._prepare_source_dataset(
+                source_name, source_id, data['dataset'][source_id],
+                groups_map, orgs_map)
+
+        tasks = self._iter_pipeline_tasks(
+            source_name, data['dataset'], _prepare)
+
+        # Tasks run in other threads: pass the parent span explicitly
+        parent_span = tracing.current_span()
+
+        def _run_task(task):
+            with self._phase(task[0], parent=parent_span, id=task[1]):
+                return task[2](*task[3:])
 
-        # ------------------------------------------------------------
-        # We now need to create/update/delete datasets.
+        errors = []
+        for result in iter_parallel(_run_task, tasks,
+                                    concurrency=concurrency):
+            action, source_id = result.item[:2]
+            if result.error is not None:
+                logger.error('Operation {0} on dataset {1} failed: {2!r}'
+                             .format(action, source_id, result.error))
+                report.add_failure(action, source_id, result.error)
+                errors.append(result.error)
+            elif result.result is not False:
+                report.count('dataset', action)
 
-        # todo: we need to make sure dataset names are not
-        # already used by another dataset. The only
-        # way is to randomize resource names and hope
-        # a 409 response indicates duplicate name..
+        self._client.wait_verification()
+
+        if errors and self._conf['fail_fast']:
+            raise errors[0]
+        return self._finish_report()
+
+    def _iter_pipeline_tasks(self, source_name, source_datasets, prepare):
+        """
+        Generate tasks for :py:meth:`sync_pipelined`, as
+        ``(action, source_id, function, args...)`` tuples.
+
+        The crawl happens while the tasks are consumed.
+        """
+
+        # {source_id: (ckan_id, name)} for datasets already in Ckan
+        ckan_index = {}
+
+        crawl = _timed_iter(self._iter_datasets_by_source(source_name),
+                            self._report, 'crawl')
+        for source_id, old_dataset in crawl:
+            ckan_index[source_id] = (old_dataset.id, old_dataset.name)
+            if source_id in source_datasets:
+                yield ('update', source_id, self._pipeline_update,
+                       old_dataset, prepare, source_id)
+
+        # Crawl over: we now know which datasets are to be deleted
+        # and which names they will free.
+        to_delete = dict(
+            (name, ckan_id)
+            for source_id, (ckan_id, name) in ckan_index.iteritems()
+            if source_id not in source_datasets)
+
+        to_create = sorted(set(source_datasets) - set(ckan_index))
+        if to_create and self._conf['dataset_name_preflight']:
+            used_names = set(self._client.list_dataset_names())
+            used_names.difference_update(to_delete)
+        else:
+            used_names = None
+
+        for source_id in to_create:
+            try:
+                dataset = prepare(source_id)
+            except Exception, e:
+                self._report.add_failure('prepare', source_id, e)
+                if self._conf['fail_fast']:
+                    raise
+                continue
+            if used_names is not None:
+                self._assign_dataset_name(source_id, dataset, used_names)
+            # Delete the dataset using this name first, if any
+            delete_id = to_delete.pop(dataset.name[:80], None)
+            yield ('create', source_id, self._pipeline_create,
+                   dataset, delete_id)
+
+        for name, ckan_id in sorted(to_delete.iteritems()):
+            yield ('delete', ckan_id, self._client.delete_dataset, ckan_id)
+
+    def _pipeline_update(self, old_dataset, prepare, source_id):
+        """:return: ``False`` if there was nothing to update"""
+        dataset, changed = self._plan_dataset_update(
+            old_dataset, prepare(source_id))
+        if not changed:
+            return False
+        logger.info('Updating dataset {0}'.format(source_id))
+        self._client.update_dataset(dataset)
+
+    def _pipeline_create(self, dataset, delete_id=None):
+        if delete_id is not None:
+            logger.info('Deleting dataset {0}'.format(delete_id))
+            with self._phase('delete'):
+                self._client.delete_dataset(delete_id)
+            self._report.count('dataset', 'delete')
+        self._force_dataset_operation(self._client.create_dataset, dataset)
+
+    def _sync_shard(self, source_name, ckan_datasets, source_datasets,
+                    groups_map, orgs_map):
+        """
+        Synchronize a shard of datasets.
+
+        :param ckan_datasets:
+            dict mapping source ids to (serialized) Ckan datasets
+        :param source_datasets:
+            dict mapping source ids to source dataset dicts
+        :rtype: :py:class:`SyncReport <.report.SyncReport>`
+        """
+
+        self._start_report(source_name)
+
+        with self._phase('diff'):
+            ckan_datasets = dict(
+                (source_id, CkanDataset(dataset))
+                for source_id, dataset in ckan_datasets.iteritems())
+            prepared, failed_ids = self._prepare_source_datasets(
+                source_name, source_datasets, groups_map, orgs_map)
+            for source_id in failed_ids:
+                ckan_datasets.pop(source_id, None)
+
+            differences = self._compare_collections(
+                ckan_datasets, prepared)
+            # Names were already assigned by the parent process
+            operations = self._plan_dataset_operations(
+                ckan_datasets, prepared, differences, assign_names=False)
+
+        self._run_operations(operations, source_name)
+        return self._finish_report()
+
+    def _plan_dataset_operations(self, ckan_datasets, source_datasets,
+                                 differences, changes=None,
+                                 assign_names=True):
+        """
+        Build the list of operations needed to apply differences.
+
+        Datasets that, once merged with their Ckan counterpart,
+        would not change are left alone.
+
+        :param changes:
+            if specified, a dict that will be filled with the list
+            of changed fields for each dataset to be updated.
+        :param assign_names:
+            if ``False``, don't check names of datasets to be created
+            (see the ``dataset_name_preflight`` option).
+        :return: a list of :py:class:`SyncOperation
+            <.journal.SyncOperation>`
+        """
+
+        operations = []
 
         # We delete first, in order to (possibly) deallocate
         # some already-used names..
-        for source_id in differences['left']:
-            ckan_id = ckan_datasets[source_id].id
-            logger.info('Deleting dataset {0}'.format(ckan_id))
-            self._client.delete_dataset(ckan_id)
+        for source_id in sorted(differences['left']):
+            operations.append(SyncOperation(
+                seq=len(operations), action='delete', source_id=source_id,
+                ckan_id=ckan_datasets[source_id].id, dataset=None))
+
+        # Create missing datasets
+        for source_id in sorted(differences['right']):
+            operations.append(SyncOperation(
+                seq=len(operations), action='create', source_id=source_id,
+                ckan_id=None, dataset=source_datasets[source_id]))
 
-        def force_dataset_operation(operation, dataset, retry=5):
-            # Maximum dataset name length is 100 characters
-            # We trim it down to 80 just to be safe.
+        # Update outdated datasets
+        for source_id in sorted(differences['differing']):
+            old_dataset = ckan_datasets[source_id]
+            dataset, changed = self._plan_dataset_update(
+                old_dataset, source_datasets[source_id])
+            if not changed:
+                continue
+            if changes is not None:
+                changes[source_id] = changed
+            operations.append(SyncOperation(
+                seq=len(operations), action='update', source_id=source_id,
+                ckan_id=old_dataset.id, dataset=dataset))
 
-            # Note: we generally want to preserve the original name
-            #       and there should *never* be problems with that
-            #       when updating..
+        if assign_names and self._conf['dataset_name_preflight']:
+            self._assign_dataset_names(operations, ckan_datasets)
 
-            _orig_name = dataset.name[:80]
-            dataset.name = _orig_name
+        return operations
 
-            while True:
+    def _assign_dataset_names(self, operations, ckan_datasets):
+        """
+        Make sure datasets to be created get names not already in
+        use, renaming them if needed.
+
+        Names of datasets deleted in the same run are considered
+        free, as deletions are performed first. Conflicts not
+        detected here (eg. with deleted datasets, or due to
+        concurrent changes) are still handled by
+        :py:meth:`_force_dataset_operation`.
+        """
+
+        creates = [op for op in operations if op.action == 'create']
+        if not creates:
+            return
+
+        used_names = set(self._client.list_dataset_names())
+
+        by_id = dict((ds.id, ds) for ds in ckan_datasets.itervalues())
+        for op in operations:
+            if op.action == 'delete' and op.ckan_id in by_id:
+                used_names.discard(by_id[op.ckan_id].name)
+            elif op.action == 'update':
+                used_names.add(op.dataset.name)
+
+        for op in creates:
+            self._assign_dataset_name(op.source_id, op.dataset, used_names)
+
+    def _assign_dataset_name(self, source_id, dataset, used_names):
+        """
+        Rename a dataset to be created, if its name is in
+        ``used_names``; the chosen name is then added to the set.
+        """
+        name = self._pick_dataset_name(source_id, dataset.name, used_names)
+        if name != dataset.name:
+            dataset.name = name
+
+    def _assign_source_dataset_names(self, ckan_datasets, source_datasets):
+        """
+        Same as :py:meth:`_assign_dataset_names`, for source dataset
+        dicts that have not been prepared yet.
+
+        :param ckan_datasets:
+            dict mapping source ids to (serialized) Ckan datasets
+        :param source_datasets:
+            dict mapping source ids to source dataset dicts
+        :return: a copy of ``source_datasets``, where datasets to be
+            created are renamed as needed.
+        """
+
+        to_create = sorted(set(source_datasets) - set(ckan_datasets))
+        if not to_create:
+            return source_datasets
+
+        used_names = set(self._client.list_dataset_names())
+        for source_id, dataset in ckan_datasets.iteritems():
+            if source_id not in source_datasets:
+                used_names.discard(dataset['name'])
+            elif not self._conf['dataset_preserve_names']:
+                used_names.add(source_datasets[source_id]['name'])
+
+        source_datasets = dict(source_datasets)
+        for source_id in to_create:
+            dataset = source_datasets[source_id]
+            name = self._pick_dataset_name(
+                source_id, dataset['name'], used_names)
+            if name != dataset['name']:
+                source_datasets[source_id] = dict(dataset, name=name)
+        return source_datasets
+
+    def _pick_dataset_name(self, source_id, name, used_names):
+        """
+        Pick a name not in ``used_names`` for a dataset to be
+        created, starting from ``name``; the chosen name is then
+        added to the set.
+        """
+        orig_name = name[:80]
+        new_name = orig_name
+        while new_name in used_names:
+            new_name = '{0}-{1:06d}'.format(
+                orig_name, random.randint(0, 999999))
+        if new_name != name:
+            logger.debug('Name {0} already in use: renaming dataset '
+                         '{1} to {2}'.format(name, source_id, new_name))
+            self._report.add_rename()
+        used_names.add(new_name)
+        return new_name
+
+    def _run_operations(self, operations, source_name, journal=None,
+                        run_id=None):
+        """
+        Perform the planned operations, keeping track of their
+        progress in the journal (if any).
+        """
+
+        report = self._report
+        failed = False
+
+        for operation in operations:
+            try:
+                with self._phase(operation.action,
+                                 id=operation.source_id):
+                    ckan_id = self._run_operation(
+                        operation, source_name, journal, run_id)
+            except Exception, e:
+                logger.error('Operation {0} on dataset {1} failed: {2!r}'
+                             .format(operation.action,
+                                     operation.source_id, e))
+                report.add_failure(operation.action, operation.source_id, e)
+                if self._conf['fail_fast']:
+                    raise
+                failed = True
+                continue
+
+            report.count('dataset', operation.action)
+            if journal is not None:
+                journal.mark_done(
+                    source_name, run_id, operation.seq, ckan_id=ckan_id)
+
+        # Runs with failed operations are left unfinished, so that
+        # they can be resumed.
+        if journal is not None and not failed:
+            journal.finish_run(source_name, run_id)
+
+        # Make sure verifications running in background are over
+        self._client.wait_verification()
+
+    def _run_operation(self, operation, source_name, journal=None,
+                       run_id=None):
+        """
+        Perform a single dataset operation.
+
+        :return: the Ckan id of the affected dataset
+        """
+
+        dataset = operation.dataset
+        if dataset is not None and not isinstance(dataset, CkanDataset):
+            dataset = CkanDataset(dataset)
+
+        if operation.action == 'delete':
+            logger.info('Deleting dataset {0}'.format(operation.ckan_id))
+            self._client.delete_dataset(operation.ckan_id)
+            return operation.ckan_id
+
+        if operation.action == 'create':
+            logger.info('Creating dataset {0}'.format(operation.source_id))
+            create = self._client.create_dataset
+
+            if journal is not None:
+                # Record the name we are trying to use, so we can
+                # find the dataset in case we die before marking
+                # the operation as done.
+                def create(dataset):
+                    journal.mark_started(source_name, run_id,
+                                         operation.seq, dataset.name)
+                    return self._client.create_dataset(dataset)
+
+            created = self._force_dataset_operation(create, dataset)
+            return created.id
+
+        if operation.action == 'update':
+            logger.info('Updating dataset {0}'.format(operation.source_id))
+            self._client.update_dataset(dataset)  # should never fail!
+            return operation.ckan_id
+
+        raise ValueError("Invalid operation: {0!r}"
+                         .format(operation.action))
+
+    def _resume_run(self, source_name, journal, run_id):
+        """Perform the remaining operations of a journaled run"""
+
+        operations = []
+        states = (STATE_PENDING, STATE_STARTED)
+        for state, name, operation in journal.iter_operations(
+                source_name, run_id, states=states):
+
+            # The dataset might have been created already, if we died
+            # before marking the operation as done.
+            if state == STATE_STARTED and operation.action == 'create':
+                created = self._find_created_dataset(
+                    source_name, operation.source_id, name)
+                if created is not None:
+                    journal.mark_done(source_name, run_id, operation.seq,
+                                      ckan_id=created.id)
+                    continue
+
+            operations.append(operation)
+
+        logger.info('{0} operations left'.format(len(operations)))
+        self._run_operations(operations, source_name, journal, run_id)
+
+    def _find_created_dataset(self, source_name, source_id, name):
+        """
+        Look for a dataset created from the given source id,
+        with the given name.
+
+        :return: the dataset, or ``None`` if not found
+        """
+        if name is None:
+            return None
+        try:
+            dataset = self._client.get_dataset_by_name(name)
+        except HTTPError, e:
+            if e.status_code != 404:
+                raise
+            return None
+        harvest_id = self._join_source_id(source_name, source_id)
+        if dataset.extras.get(HARVEST_SOURCE_ID_FIELD) != harvest_id:
+            return None
+        return dataset
+
+    @traced('sync', arg_name='source_name')
+    def sync_stream(self, source_name, datasets, groups=None,
+                    organizations=None, chunk_size=100, source_ids=None,
+                    concurrency=4, ckan_datasets=None):
+        """
+        Streaming version of :py:meth:`sync`.
+
+        Instead of keeping both the whole source and the whole set of
+        Ckan datasets in memory, only an index mapping source ids to
+        Ckan ids is built (retrieving just these two fields through
+        the search API), while source datasets are processed in
+        chunks of ``chunk_size`` as they are read from ``datasets``.
+        The datasets of a chunk are processed by ``concurrency``
+        threads; the current version of the ones already existing
+        in Ckan is retrieved only then, to be compared.
+
+        Datasets whose creation fails because of a name conflict
+        are retried (renaming them if needed) only after obsolete
+        datasets have been deleted, as that might free some names.
+
+        :param source_name:
+            String identifying the source of the data.
+        :param datasets:
+            iterable of ``(source_id, dataset_dict)`` pairs
+        :param groups:
+            dict mapping group names to group dicts
+        :param organizations:
+            dict mapping organization names to organization dicts
+        :param chunk_size:
+            number of datasets to be processed at once
+        :param source_ids:
+            if specified, the full set of ids in the source. Datasets
+            not in this set will be deleted; this allows passing only
+            a subset of the source datasets in ``datasets`` (for
+            example, only the ones changed since the last run).
+            By default, all the datasets not found in ``datasets``
+            will be deleted. It is only used once ``datasets`` has
+            been exhausted, so it can be filled while iterating.
+        :param concurrency:
+            number of datasets of a chunk processed at once
+        :param ckan_datasets:
+            dict mapping source ids to the datasets of this source
+            currently in Ckan, as returned by :py:meth:`crawl_sources`.
+            If specified, Ckan is not crawled, and datasets are not
+            retrieved again to be compared.
+        :raises: in ``fail_fast`` mode, the first exception raised
+            while processing a chunk, once the whole chunk is done.
+        :rtype: :py:class:`SyncReport <.report.SyncReport>`
+        """
+
+        report = self._start_report(source_name)
+
+        with self._phase('upsert'):
+            groups_map, orgs_map = self._upsert_groups_and_organizations(
+                groups or {}, organizations or {})
+
+        # Index of datasets already in Ckan: {source_id: ckan_id}
+        with self._phase('crawl'):
+            if ckan_datasets is None:
+                ckan_datasets = {}
+                ckan_index = self._index_datasets_by_source(source_name)
+            else:
+                ckan_index = dict(
+                    (source_id, dataset.id)
+                    for source_id, dataset in ckan_datasets.iteritems())
+
+        seen_ids = set()
+        conflicting = []
+
+        # Chunks are processed in other threads: pass the parent
+        # span explicitly
+        parent_span = tracing.current_span()
+
+        def _process(item):
+            source_id, dataset_dict = item
+            action = 'update' if source_id in ckan_index else 'create'
+            with self._phase('diff', parent=parent_span):
+                dataset = self._prepare_source_dataset(
+                    source_name, source_id, dataset_dict,
+                    groups_map, orgs_map)
+            with self._phase(action, parent=parent_span, id=source_id):
+                done = self._stream_dataset(
+                    source_id, dataset, ckan_index.get(source_id),
+                    ckan_datasets.get(source_id))
+            return dataset, done
+
+        for chunk in iter_chunks(datasets, chunk_size):
+            logger.info('Synchronizing {0} datasets ({1} done so far)'
+                        .format(len(chunk), len(seen_ids)))
+            seen_ids.update(source_id for source_id, _ in chunk)
+
+            errors = []
+            for result in iter_parallel(_process, chunk,
+                                        concurrency=concurrency):
+                source_id = result.item[0]
+                action = 'update' if source_id in ckan_index else 'create'
+                if result.error is not None:
+                    report.add_failure(action, source_id, result.error)
+                    errors.append(result.error)
+                    continue
+                dataset, done = result.result
+                if done is None:
+                    continue
+                if done is False:
+                    conflicting.append((source_id, dataset))
+                    continue
+                report.count('dataset', action)
+
+            if errors and self._conf['fail_fast']:
+                raise errors[0]
+
+        if source_ids is None:
+            source_ids = seen_ids
+        elif not isinstance(source_ids, (set, frozenset, dict)):
+            source_ids = set(source_ids)
+
+        for source_id, ckan_id in ckan_index.iteritems():
+            if source_id not in source_ids:
+                logger.info('Deleting dataset {0}'.format(ckan_id))
                 try:
-                    result = operation(dataset)
-                except HTTPError, e:
-                    if e.status_code != 409:
+                    with self._phase('delete'):
+                        self._client.delete_dataset(ckan_id)
+                except Exception, e:
+                    report.add_failure('delete', source_id, e)
+                    if self._conf['fail_fast']:
                         raise
-                    retry -= 1
-                    if retry < 0:
-                        raise
-                    dataset.name = '{0}-{1:06d}'.format(
-                        _orig_name,
-                        random.randint(0, 999999))
-                    logger.debug('Got 409: trying to rename dataset to {0}'
-                                 .format(dataset.name))
-                else:
-                    return result
+                    continue
+                report.count('dataset', 'delete')
 
-        # Create missing datasets
-        for source_id in differences['right']:
+        # Now that names have (possibly) been freed, we can retry
+        # creating datasets that had conflicting names.
+        for source_id, dataset in conflicting:
             logger.info('Creating dataset {0}'.format(source_id))
-            dataset = source_datasets[source_id]
-            force_dataset_operation(self._client.create_dataset, dataset)
+            try:
+                with self._phase('create'):
+                    self._force_dataset_operation(
+                        self._client.create_dataset, dataset)
+            except Exception, e:
+                report.add_failure('create', source_id, e)
+                if self._conf['fail_fast']:
+                    raise
+                continue
+            report.count('dataset', 'create')
 
-        # Update outdated datasets
-        for source_id in differences['differing']:
-            logger.info('Updating dataset {0}'.format(source_id))
-            # dataset = source_datasets[source_id]
-            old_dataset = ckan_datasets[source_id]
-            new_dataset = source_datasets[source_id]
-            dataset = self._merge_datasets(old_dataset, new_dataset)
-            dataset.id = old_dataset.id  # Mandatory!
-            self._client.update_dataset(dataset)  # should never fail!
+        self._client.wait_verification()
+        return self._finish_report()
+
+    def sync_source(self, source_name, source, chunk_size=100,
+                    concurrency=4, ckan_datasets=None):
+        """
+        Synchronize data read from a source reader, such as a
+        :py:class:`SourceArchive <.sources.SourceArchive>`, with
+        :py:meth:`sync_stream`: datasets are read as they are
+        synchronized.
+
+        :param source:
+            a reader from :py:mod:`.sources`, or any object with
+            compatible ``iter_objects()`` and ``load_all()`` methods
+        :param ckan_datasets: see :py:meth:`sync_stream`
+        :rtype: :py:class:`SyncReport <.report.SyncReport>`
+        """
+        datasets = ((key, dataset) for _, key, dataset
+                    in source.iter_objects('dataset'))
+        return self.sync_stream(
+            source_name, datasets,
+            groups=source.load_all('group'),
+            organizations=source.load_all('organization'),
+            chunk_size=chunk_size, concurrency=concurrency,
+            ckan_datasets=ckan_datasets)
+
+    def _stream_dataset(self, source_id, dataset, ckan_id=None,
+                        old_dataset=None):
+        """
+        Create or update a dataset, for :py:meth:`sync_stream`.
+
+        The current version of datasets to be updated is retrieved,
+        unless passed as ``old_dataset``.
+
+        :return: ``True`` if the dataset was written, ``None`` if
+            there was nothing to update, ``False`` if creation was
+            prevented by a name conflict.
+        """
+
+        if ckan_id is None:
+            logger.info('Creating dataset {0}'.format(source_id))
+            try:
+                self._force_dataset_operation(
+                    self._client.create_dataset, dataset, retry=0)
+            except HTTPError, e:
+                if e.status_code != 409:
+                    raise
+                return False
+            return True
+
+        if old_dataset is None:
+            old_dataset = self._client.get_dataset(ckan_id)
+        dataset, changed = self._plan_dataset_update(old_dataset, dataset)
+        if not changed:
+            return None
+        logger.info('Updating dataset {0}'.format(source_id))
+        self._client.update_dataset(dataset)
+        return True
+
+    def _upsert_groups_and_organizations(self, groups, organizations,
+                                         dry_run=False, actions=None):
+        """
+        Upsert groups and organizations from the source.
+
+        :param groups: dict mapping names to group dicts
+        :param organizations: dict mapping names to organization dicts
+        :param dry_run: if ``True``, don't write anything
+        :param actions:
+            if specified, a dict whose ``'group'`` and ``'organization'``
+            keys will be filled with the actions taken
+        :return: a ``(groups_map, orgs_map)`` tuple of
+            :py:class:`IDMap <.utils.IDMap>`
+        """
+        if actions is None:
+            actions = {}
+
+        groups = dict(
+            (key, CkanGroup(val))
+            for key, val in groups.iteritems())
+
+        organizations = dict(
+            (key, CkanOrganization(val))
+            for key, val in organizations.iteritems())
+
+        # Groups and organizations are upserted together,
+        # sharing the same pool.
+        groups_map, orgs_map = IDMap(), IDMap()
+        group_actions = actions.setdefault('group', {})
+        org_actions = actions.setdefault('organization', {})
+        tasks = [('group', groups_map, group_actions, name, group)
+                 for name, group in groups.iteritems()]
+        tasks.extend(
+            ('organization', orgs_map, org_actions, name, org)
+            for name, org in organizations.iteritems())
+        self._run_upserts(tasks, dry_run=dry_run)
+        return groups_map, orgs_map
+
+    def _run_upserts(self, tasks, dry_run=False):
+        """
+        Run group / organization upserts, concurrently (see the
+        ``upsert_concurrency`` option).
+
+        :param tasks:
+            list of ``(obj_type, idmap, actions, name, obj)``
+            tuples. Resulting ids are added to ``idmap``; actions
+            are recorded in ``actions``, if not ``None``.
+        :raises: in ``fail_fast`` mode, the first exception raised
+            by an upsert, once all the others completed.
+        """
+
+        upsert_funcs = {
+            'group': self._upsert_group,
+            'organization': self._upsert_organization,
+        }
+
+        parent_span = tracing.current_span()
+
+        def _upsert(task):
+            obj_type, idmap, actions, name, obj = task
+            with tracing.span('sync.upsert_' + obj_type,
+                              parent=parent_span, name=name):
+                action, ckan_id = upsert_funcs[obj_type](
+                    name, obj, dry_run=dry_run)
+            idmap.add(IDPair(source_id=name, ckan_id=ckan_id))
+            if actions is not None:
+                actions[name] = (action, ckan_id)
+            return action
+
+        errors = []
+        for result in iter_parallel(
+                _upsert, tasks,
+                concurrency=self._conf['upsert_concurrency']):
+            obj_type, name = result.item[0], result.item[3]
+            if result.error is not None:
+                logger.error('Upsert of {0} {1} failed: {2!r}'.format(
+                    obj_type, name, result.error))
+                self._report.add_failure(
+                    '{0}_upsert'.format(obj_type), name, result.error)
+                errors.append(result.error)
+            elif not dry_run:
+                self._report.count(obj_type, result.result)
+        if errors and self._conf['fail_fast']:
+            raise errors[0]
+
+    def _prepare_source_dataset(self, source_name, source_id, dataset_dict,
+                                groups_map, orgs_map):
+        """
+        Build a :py:class:`CkanDataset` from a source dataset dict,
+        mapping groups / organization to Ckan ids and adding the
+        harvest source id.
+        """
+
+        # A shallow copy is enough here: we only replace top-level
+        # keys, while objects make their own copies of mutable
+        # values before changing them.
+        _dataset_dict = dict(dataset_dict)
+
+        # We need to make sure "source" datasets
+        # don't have (otherwise misleading) ids
+        _dataset_dict.pop('id', None)
+
+        # We need to update groups and organizations,
+        # to map their name from the source into a
+        # ckan id
+        _dataset_dict['groups'] = [
+            groups_map.to_ckan(grp_id)
+            for grp_id in _dataset_dict['groups']
+        ]
+        _dataset_dict['owner_org'] = \
+            orgs_map.to_ckan(_dataset_dict['owner_org'])
+
+        dataset = CkanDataset(_dataset_dict)
+
+        # We also want to add the "source id", used for further
+        # synchronizations to find stuff
+        dataset.extras[HARVEST_SOURCE_ID_FIELD] = \
+            self._join_source_id(source_name, source_id)
+
+        return dataset
+
+    def _force_dataset_operation(self, operation, dataset, retry=5):
+        """
+        Run a create / update operation on a dataset, renaming it
+        in case of name conflicts (up to ``retry`` times).
+        """
+
+        # Maximum dataset name length is 100 characters
+        # We trim it down to 80 just to be safe.
+
+        # Note: we generally want to preserve the original name
+        #       and there should *never* be problems with that
+        #       when updating..
+
+        _orig_name = dataset.name[:80]
+        dataset.name = _orig_name
+
+        while True:
+            try:
+                result = operation(dataset)
+            except HTTPError, e:
+                if e.status_code != 409:
+                    raise
+                retry -= 1
+                if retry < 0:
+                    raise
+                self._report.add_retry()
+                self._report.add_rename()
+                dataset.name = '{0}-{1:06d}'.format(
+                    _orig_name,
+                    random.randint(0, 999999))
+                logger.debug('Got 409: trying to rename dataset to {0}'
+                             .format(dataset.name))
+            else:
+                return result
+
+    def _plan_dataset_update(self, old_dataset, new_dataset):
+        """
+        Merge a source dataset into its Ckan counterpart.
+
+        :return: a ``(dataset, changed_fields)`` tuple, where
+            ``dataset`` is the one to be sent to Ckan and
+            ``changed_fields`` the list of fields that differ
+            from the ones of ``old_dataset``.
+        """
+        dataset = self._merge_datasets(old_dataset, new_dataset)
+        dataset.id = old_dataset.id  # Mandatory!
+        with tracing.span('is_equivalent', id=dataset.id):
+            changed = [
+                name for name, field in dataset.iter_fields()
+                if not field.is_key
+                and not field.is_equivalent(dataset, name, old_dataset)]
+        return dataset, changed
 
     def _merge_datasets(self, old, new):
         # Preserve dataset names
@@ -247,146 +1339,206 @@ class SynchronizationClient(object):
 
         return new
 
-    def _upsert_groups(self, groups):
+    def _upsert_group(self, group_name, group, dry_run=False):
         """
-        :param groups:
-            dict mapping ``{org_name : CkanGroup()}``
-        :return: a map of source/ckan ids of groups
-        :rtype: IDMap
-        """
-
-        idmap = IDMap()
-
-        for group_name, group in groups.iteritems():
-            if not isinstance(group, CkanGroup):
-                raise TypeError("Expected CkanGroup, got {0!r}"
-                                .format(type(group)))
-
-            if group.name is None:
-                group.name = group_name
-
-            if group.name != group_name:
-                raise ValueError("Mismatching group name!")
-
-            try:
-                ckan_group = self._client.get_group_by_name(
-                    group_name, allow_deleted=True)
+        Make sure a group exists in Ckan
 
-            except HTTPError, e:
-                if e.status_code != 404:
-                    raise
-
-                # We need to create the group
-                group.id = None
-                group.state = 'active'
-                created_group = self._client.create_group(group)
-                idmap.add(IDPair(source_id=group.name,
-                                 ckan_id=created_group.id))
-
-            else:
-                # The group already exist. It might be logically
-                # deleted, but we don't care -> just update and
-                # make sure it is marked as active.
-
-                # todo: make sure we don't need to preserve users and stuff,
-                # otherwise we need to workaround that in hi-lev client
-
-                group_id = ckan_group.id
-
-                if self._conf['group_merge_strategy'] == 'update':
-                    # If merge strategy is 'update', we should update
-                    # the group.
-                    group.state = 'active'
-                    group.id = ckan_group.id
-                    updated_group = self._client.update_group(group)
-                    group_id = updated_group.id
-
-                elif group.state != 'active':
-                    # We only want to update the **original** group to set it
-                    # as active, but preserving original values.
-                    ckan_group.state = 'active'
-                    updated_group = self._client.update_group(ckan_group)
-                    group_id = updated_group.id
+        :return: a ``(action, ckan_id)`` tuple, where action is one
+            of ``'create'``, ``'update'``, ``'reactivate'`` or
+            ``'none'``.
+        """
 
-                idmap.add(IDPair(source_id=group.name, ckan_id=group_id))
+        if not isinstance(group, CkanGroup):
+            raise TypeError("Expected CkanGroup, got {0!r}"
+                            .format(type(group)))
+
+        if group.name is None:
+            group.name = group_name
+
+        if group.name != group_name:
+            raise ValueError("Mismatching group name!")
+
+        try:
+            ckan_group = self._client.get_group_by_name(
+                group_name, allow_deleted=True)
+
+        except HTTPError, e:
+            if e.status_code != 404:
+                raise
+
+            if dry_run:
+                return 'create', make_placeholder_id('group', group_name)
+
+            # We need to create the group
+            group.id = None
+            group.state = 'active'
+            created_group = self._client.create_group(group)
+            return 'create', created_group.id
+
+        # The group already exist. It might be logically
+        # deleted, but we don't care -> just update and
+        # make sure it is marked as active.
+
+        # todo: make sure we don't need to preserve users and stuff,
+        # otherwise we need to workaround that in hi-lev client
+
+        if self._conf['group_merge_strategy'] == 'update':
+            # If merge strategy is 'update', we should update
+            # the group.
+            if dry_run:
+                return 'update', ckan_group.id
+            group.state = 'active'
+            group.id = ckan_group.id
+            updated_group = self._client.update_group(group)
+            return 'update', updated_group.id
+
+        elif group.state != 'active':
+            # We only want to update the **original** group to set it
+            # as active, but preserving original values.
+            if dry_run:
+                return 'reactivate', ckan_group.id
+            ckan_group.state = 'active'
+            updated_group = self._client.update_group(ckan_group)
+            return 'reactivate', updated_group.id
+
+        return 'none', ckan_group.id
+
+    def _upsert_organization(self, org_name, org, dry_run=False):
+        """
+        Make sure an organization exists in Ckan
 
-        return idmap
+        :return: a ``(action, ckan_id)`` tuple,
+            see :py:meth:`_upsert_group`.
+        """
 
-    def _upsert_organizations(self, orgs):
+        if not isinstance(org, CkanOrganization):
+            raise TypeError("Expected CkanOrganization, got {0!r}"
+                            .format(type(org)))
+
+        if org.name is None:
+            org.name = org_name
+
+        if org.name != org_name:
+            raise ValueError("Mismatching org name!")
+
+        try:
+            ckan_org = self._client.get_organization_by_name(
+                org_name, allow_deleted=True)
+
+        except HTTPError, e:
+            if e.status_code != 404:
+                raise
+
+            if dry_run:
+                return 'create', make_placeholder_id(
+                    'organization', org_name)
+
+            # We need to create the org
+            org.id = None
+            org.state = 'active'
+            created_org = self._client.create_organization(org)
+            return 'create', created_org.id
+
+        # We only want to update if state != 'active'
+
+        if self._conf['organization_merge_strategy'] == 'update':
+            # If merge strategy is 'update', we should update
+            # the group.
+            if dry_run:
+                return 'update', ckan_org.id
+            org.state = 'active'
+            org.id = ckan_org.id
+            updated_org = self._client.update_organization(org)
+            return 'update', updated_org.id
+
+        elif org.state != 'active':
+            # We only want to update the **original** org to set it
+            # as active, but preserving original values.
+            if dry_run:
+                return 'reactivate', ckan_org.id
+            ckan_org.state = 'active'
+            updated_org = self._client.update_organization(ckan_org)
+            return 'reactivate', updated_org.id
+
+        return 'none', ckan_org.id
+
+    def crawl_sources(self, page_size=100):
         """
-        :param orgs:
-            dict mapping ``{org_name : CkanOrganization()}``
-        :return: a map of source/ckan ids of organizations
-        :rtype: IDMap
+        Crawl all the datasets in Ckan at once, fetching them in
+        pages of ``page_size`` through the search API, and partition
+        them by source. Datasets not coming from a source are skipped.
+
+        Pages are requested by ``metadata_modified`` range (see
+        :py:meth:`CkanHighlevelClient.iter_modified_datasets()
+        <.high_level.CkanHighlevelClient.iter_modified_datasets>`):
+        datasets created or deleted during the crawl don't make
+        others shift between pages, to be missed (and then created
+        again).
+
+        :return: dict mapping source names to dicts mapping
+            source ids to :py:class:`CkanDataset
+            <.objects.ckan_dataset.CkanDataset>` objects, suitable
+            for the ``ckan_datasets`` argument of :py:meth:`sync`.
         """
 
-        idmap = IDMap()
-
-        for org_name, org in orgs.iteritems():
-            if not isinstance(org, CkanOrganization):
-                raise TypeError("Expected CkanOrganization, got {0!r}"
-                                .format(type(org)))
-
-            if org.name is None:
-                org.name = org_name
-
-            if org.name != org_name:
-                raise ValueError("Mismatching org name!")
-
-            try:
-                ckan_org = self._client.get_organization_by_name(
-                    org_name, allow_deleted=True)
-
-            except HTTPError, e:
-                if e.status_code != 404:
-                    raise
-
-                # We need to create the org
-                org.id = None
-                org.state = 'active'
-                created_org = self._client.create_organization(org)
-                idmap.add(IDPair(source_id=org.name,
-                                 ckan_id=created_org.id))
-
-            else:
-                # We only want to update if state != 'active'
-                org_id = ckan_org.id
-
-                if self._conf['organization_merge_strategy'] == 'update':
-                    # If merge strategy is 'update', we should update
-                    # the group.
-                    org.state = 'active'
-                    org.id = ckan_org.id
-                    updated_org = self._client.update_organization(org)
-                    org_id = updated_org.id
-
-                elif org.state != 'active':
-                    # We only want to update the **original** org to set it
-                    # as active, but preserving original values.
-                    ckan_org.state = 'active'
-                    updated_org = self._client.update_organization(ckan_org)
-                    org_id = updated_org.id
-
-                idmap.add(IDPair(source_id=org_name,
-                                 ckan_id=org_id))
-
-        return idmap
+        datasets = self._client.iter_modified_datasets(
+            page_size=page_size, include_private=True)
+        sources = {}
+        for dataset in datasets:
+            if HARVEST_SOURCE_ID_FIELD not in dataset.extras:
+                continue
+            source_name, source_id = self._parse_source_id(
+                dataset.extras[HARVEST_SOURCE_ID_FIELD])
+            sources.setdefault(source_name, {})[source_id] = dataset
+        return sources
 
     def _find_datasets_by_source(self, source_name):
         """
         Find all datasets matching the current source.
         Returns a dict mapping source ids with dataset objects.
         """
+        return dict(self._iter_datasets_by_source(source_name))
 
-        results = {}
-        for dataset in self._client.iter_datasets():
+    def _index_datasets_by_source(self, source_name):
+        """
+        Find all datasets matching the current source.
+        Returns a dict mapping source ids with Ckan ids.
+
+        Unless using a snapshot, only the ids and source ids of
+        datasets are retrieved, through the search API.
+        """
+        if self._snapshot is not None:
+            return dict((source_id, dataset.id) for source_id, dataset
+                        in self._iter_datasets_by_source(source_name))
+
+        field = 'extras_' + HARVEST_SOURCE_ID_FIELD
+        index = {}
+        for data in self._client.iter_dataset_fields(['id', field]):
+            if field not in data:
+                continue
+            _name, _id = self._parse_source_id(data[field])
+            if _name == source_name:
+                index[_id] = data['id']
+        return index
+
+    def _iter_datasets_by_source(self, source_name):
+        """
+        Iterate all the Ckan datasets matching the current source,
+        yielding ``(source_id, dataset)`` pairs.
+        """
+        if self._snapshot is not None:
+            self._snapshot.refresh(self._client)
+            datasets = self._snapshot.iter_datasets()
+        else:
+            datasets = self._client.iter_datasets()
+
+        for dataset in datasets:
             if HARVEST_SOURCE_ID_FIELD not in dataset.extras:
                 continue
             source_id = dataset.extras[HARVEST_SOURCE_ID_FIELD]
             _name, _id = self._parse_source_id(source_id)
             if _name == source_name:
-                results[_id] = dataset
-        return results
+                yield _id, dataset
 
     def _parse_source_id(self, source_id):
         splitted = source_id.split(':')
@@ -439,3 +1591,104 @@ class SynchronizationClient(object):
             'right': right_only_keys,
             'differing': differing,
         }
+
+
+def _generate_run_id():
+    """Generate a (unique) id for a synchronization run"""
+    return '{0:%Y%m%d-%H%M%S}-{1}'.format(
+        datetime.datetime.utcnow(), uuid.uuid4().hex[:8])
+
+
+def _get_shard(source_id, shards):
+    """Get the shard a source id belongs to (stable across processes)"""
+    if isinstance(source_id, unicode):
+        source_id = source_id.encode('utf-8')
+    return (binascii.crc32(source_id) & 0xffffffff) % shards
+
+
+# Holds the client used by the current worker (process), see
+# SynchronizationClient.sync_sharded()
+_worker_state = threading.local()
+
+
+def _shard_worker_init(klass, base_url, api_key, conf):
+    _worker_state.client = klass(base_url, api_key, **conf)
+
+
+def _shard_worker_crawl(args):
+    """
+    Retrieve a slice of Ckan datasets, returning a list of
+    ``(source_id, dataset)`` pairs for the ones belonging to the
+    given source, along with a (serialized) report.
+    """
+    source_name, ckan_ids = args
+    client = _worker_state.client
+    report = client._start_report(source_name)
+    result = []
+    start = time.time()
+    for ckan_id in ckan_ids:
+        try:
+            dataset = client._client.get_dataset(ckan_id)
+        except HTTPError, e:
+            if e.status_code != 404:
+                raise
+            continue  # Deleted in the meantime
+        if HARVEST_SOURCE_ID_FIELD not in dataset.extras:
+            continue
+        _name, _id = client._parse_source_id(
+            dataset.extras[HARVEST_SOURCE_ID_FIELD])
+        if _name == source_name:
+            result.append((_id, dataset.serialize()))
+    report.add_timing('crawl', time.time() - start)
+    return result, client._finish_report().to_dict()
+
+
+def _shard_worker_sync(args):
+    """Synchronize a shard, returning its (serialized) report"""
+    shard = args[0]
+    client = _worker_state.client
+    try:
+        report = client._sync_shard(*args[1:])
+    except Exception, e:
+        logger.exception('Synchronization of shard {0} failed'
+                         .format(shard))
+        report = client._report
+        report.add_failure('shard', shard, e)
+    return report.to_dict()
+
+
+def _timed_iter(iterable, report, phase):
+    """
+    Wrap an iterable, adding the time spent producing
+    items to a phase of the report.
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(iterator)
+        finally:
+            report.add_timing(phase, time.time() - start)
+        yield item
+
+
+def _replace_placeholders(dataset, placeholders):
+    """
+    Replace placeholder ids of groups / organization in a
+    (planned) dataset, either a ``CkanDataset`` or a dict.
+    """
+
+    if dataset is None:
+        return None
+
+    if isinstance(dataset, CkanDataset):
+        dataset = dataset.serialize()
+    else:
+        dataset = dict(dataset)
+
+    dataset['groups'] = [
+        placeholders.get(group_id, group_id)
+        for group_id in dataset.get('groups') or []]
+    owner_org = dataset.get('owner_org')
+    dataset['owner_org'] = placeholders.get(owner_org, owner_org)
+    return CkanDataset(dataset)
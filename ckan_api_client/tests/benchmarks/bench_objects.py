@@ -0,0 +1,92 @@
+"""
+Benchmarks for the object model: construction from dicts, attribute
+access, serialization and comparison, on datasets of several shapes.
+
+Run with::
+
+    python -m ckan_api_client.tests.benchmarks.bench_objects
+
+See :py:func:`.runner.main` for the available options.
+"""
+
+import copy
+import sys
+import time
+
+from ckan_api_client.objects import CkanDataset
+from ckan_api_client.tests.benchmarks.runner import BenchmarkSuite, main
+
+
+#: Dataset shapes, as ``(resources, extras, extra_size, tags)``
+SHAPES = {
+    'small': (1, 5, 20, 5),
+    'many_resources': (200, 5, 20, 5),
+    'large_extras': (1, 300, 500, 5),
+    'many_tags': (1, 5, 20, 500),
+}
+
+
+def make_dataset_dict(resources, extras, extra_size, tags):
+    """Build a (deterministic) dataset dict of the given shape"""
+    return {
+        'id': 'dataset-id',
+        'name': 'dataset-name',
+        'title': 'Dataset title',
+        'notes': 'Dataset description ' * 20,
+        'author': 'Author',
+        'author_email': 'author@example.com',
+        'license_id': 'cc-by',
+        'owner_org': 'org-id',
+        'groups': ['group-{0}'.format(i) for i in xrange(5)],
+        'extras': dict(('key-{0:04d}'.format(i), 'x' * extra_size)
+                       for i in xrange(extras)),
+        'tags': ['tag-{0:04d}'.format(i) for i in xrange(tags)],
+        'resources': [
+            {'id': 'resource-{0}'.format(i),
+             'name': 'Resource {0}'.format(i),
+             'url': 'http://example.com/resource/{0}.csv'.format(i),
+             'format': 'CSV',
+             'description': 'Resource description'}
+            for i in xrange(resources)],
+    }
+
+
+def access_fields(dataset):
+    return (dataset.id, dataset.name, dataset.title, dataset.notes,
+            dataset.extras, dataset.groups, dataset.resources,
+            dataset.tags)
+
+
+def make_suite():
+    suite = BenchmarkSuite('objects', timer=time.clock)
+
+    for shape, args in sorted(SHAPES.iteritems()):
+        data = make_dataset_dict(*args)
+        dataset = CkanDataset(data)
+        access_fields(dataset)
+
+        same = CkanDataset(copy.deepcopy(data))
+        changed_data = copy.deepcopy(data)
+        changed_data['title'] = 'Changed title'
+        changed_data['tags'] = changed_data['tags'][1:]
+        changed = CkanDataset(changed_data)
+
+        def add(name, func, shape=shape):
+            suite.add('{0}[{1}]'.format(name, shape), func)
+
+        add('construct', lambda data=data: CkanDataset(data))
+        add('getattr', lambda dataset=dataset: access_fields(dataset))
+        add('getattr_fresh',
+            lambda data=data: access_fields(CkanDataset(data)))
+        add('serialize', dataset.serialize)
+        add('is_equivalent',
+            lambda dataset=dataset, other=same: dataset.is_equivalent(other))
+        add('is_modified', dataset.is_modified)
+        add('compare',
+            lambda dataset=dataset, other=changed: dataset.compare(other))
+
+    return suite
+
+
+if __name__ == '__main__':
+    sys.exit(main(make_suite()))
@@ -0,0 +1,175 @@
+"""
+End-to-end throughput benchmark of the synchronization client,
+running against the in-process :py:mod:`fake Ckan server
+<ckan_api_client.tests.utils.fake_ckan>`.
+
+For each source size, these scenarios are run in sequence:
+
+- ``first_import`` -- import the source into an empty Ckan
+- ``noop_resync`` -- synchronize the same data again
+- ``churn`` -- synchronize the catalog of "day 1", with 10% of
+  the datasets changed (half updated, a quarter deleted, a quarter
+  added)
+- ``rename_collisions`` -- import a second source, whose datasets
+  all have names already in use
+
+Run with::
+
+    python -m ckan_api_client.tests.benchmarks.bench_sync \\
+        --sizes 1000,10000,100000 -o sync-results.json
+
+.. note::
+    Each size runs in a separate process, so that the peak RSS
+    reported is not affected by the previous sizes; within a size,
+    it is the peak up to the end of the scenario. As the fake server
+    runs in the same process, it includes the memory used by the
+    in-memory Ckan store.
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+from ckan_api_client.syncing import SynchronizationClient
+from ckan_api_client.tests.utils.catalog import CatalogGenerator
+from ckan_api_client.tests.utils.fake_ckan import FakeCkanServer
+
+
+SCENARIOS = ('first_import', 'noop_resync', 'churn', 'rename_collisions')
+MODES = ('sync', 'sync_pipelined', 'sync_sharded')
+
+
+def make_catalog(size, seed=0):
+    """
+    :rtype: :py:class:`CatalogGenerator
+        <ckan_api_client.tests.utils.catalog.CatalogGenerator>`
+    """
+    return CatalogGenerator(
+        datasets=size, organizations=max(1, size // 100),
+        groups=max(1, size // 50), seed=seed)
+
+
+def make_colliding_source(data):
+    """Source with a new dataset for each one in ``data``, same name"""
+    other = copy.deepcopy(data)
+    other['dataset'] = dict(
+        ('other-' + key, dataset)
+        for key, dataset in other['dataset'].iteritems())
+    return other
+
+
+def get_peak_rss():
+    """Peak resident set size of this process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def run_scenarios(size, mode='sync', latency=0, seed=0):
+    """
+    Run all the scenarios for a given source size.
+
+    :return: list of dicts, one per scenario
+    """
+
+    results = []
+    catalog = make_catalog(size, seed=seed)
+    data = catalog.get_data()
+
+    with FakeCkanServer(latency=latency, seed=seed) as server:
+        client = SynchronizationClient(server.server_url, server.api_key)
+
+        def run(scenario, source_name, source_data):
+            calls_before = server.request_count
+            start = time.time()
+            report = getattr(client, mode)(source_name, source_data)
+            duration = time.time() - start
+            datasets = len(source_data['dataset'])
+            calls = server.request_count - calls_before
+            results.append({
+                'scenario': scenario,
+                'size': size,
+                'mode': mode,
+                'datasets': datasets,
+                'duration': duration,
+                'datasets_per_second': datasets / duration,
+                'http_calls': calls,
+                'calls_per_dataset': float(calls) / datasets,
+                'peak_rss': get_peak_rss(),
+                'counts': report.counts,
+                'renames': report.renames,
+                'failures': len(report.failures),
+            })
+
+        run('first_import', 'bench-source', data)
+        run('noop_resync', 'bench-source', data)
+        run('churn', 'bench-source', catalog.get_data(day=1))
+        run('rename_collisions', 'other-source', make_colliding_source(data))
+
+    return results
+
+
+def _run_scenarios_worker(args):
+    return run_scenarios(*args)
+
+
+def print_results(results):
+    print('{0:<18} {1:>7} {2:>9} {3:>10} {4:>8} {5:>9} {6:>9}'.format(
+        'scenario', 'size', 'seconds', 'datasets/s', 'calls',
+        'calls/ds', 'peak MB'))
+    for r in results:
+        print('{0:<18} {1:>7} {2:>9.2f} {3:>10.1f} {4:>8} {5:>9.2f} '
+              '{6:>9.1f}'.format(
+                  r['scenario'], r['size'], r['duration'],
+                  r['datasets_per_second'], r['http_calls'],
+                  r['calls_per_dataset'], r['peak_rss'] / 1048576.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark synchronization against a fake Ckan')
+    parser.add_argument('--sizes', default='1000',
+                        help='Comma-separated source sizes '
+                        '(default: 1000)')
+    parser.add_argument('--mode', choices=MODES, default='sync',
+                        help='Synchronization method to use')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Latency added to each request, in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-isolate', dest='isolate',
+                        action='store_false',
+                        help="Don't run each size in a separate process")
+    parser.add_argument('-o', '--output',
+                        help='Write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in [int(x) for x in args.sizes.split(',')]:
+        task = (size, args.mode, args.latency, args.seed)
+        if args.isolate:
+            pool = multiprocessing.Pool(1)
+            try:
+                results.extend(pool.apply(_run_scenarios_worker, (task,)))
+            finally:
+                pool.terminate()
+        else:
+            results.extend(run_scenarios(*task))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'benchmarks': results}, fp, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
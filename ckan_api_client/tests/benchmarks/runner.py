@@ -0,0 +1,247 @@
+"""
+Minimal benchmark runner.
+
+Results are written as JSON, and can be compared against a stored
+baseline to detect regressions (the runner exits with a non-zero
+status if any benchmark got slower than the allowed tolerance).
+
+Along with the benchmarks, a fixed pure-Python workload is timed
+("calibration"): comparisons are made relative to it, so that
+baselines stay meaningful across machines of different speed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import time
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+BASELINES_DIR = os.path.join(HERE, 'baselines')
+
+
+class BenchmarkSuite(object):
+    """
+    Collection of named benchmarks.
+
+    Benchmarks are functions without arguments; they can be
+    registered with :py:meth:`add` or the :py:meth:`benchmark`
+    decorator.
+    """
+
+    def __init__(self, name, timer=time.time):
+        """
+        :param name: name of the suite, used for the baseline file
+        :param timer:
+            function returning the current time. For CPU-bound
+            benchmarks, ``time.clock`` (process time) is much less
+            sensitive to other load on the machine.
+        """
+        self.name = name
+        self.timer = timer
+        self._benchmarks = []
+
+    def add(self, name, func):
+        self._benchmarks.append((name, func))
+
+    def benchmark(self, name):
+        """Decorator registering a benchmark"""
+        def decorator(func):
+            self.add(name, func)
+            return func
+        return decorator
+
+    @property
+    def names(self):
+        return [name for name, _ in self._benchmarks]
+
+    def run(self, rounds=5, min_time=0.05, pattern=None, verbose=False):
+        """
+        Run the benchmarks.
+
+        Each benchmark is first calibrated, to find how many calls
+        are needed to take at least ``min_time`` seconds; then timed
+        for ``rounds`` rounds of that many calls.
+
+        :param pattern: only run benchmarks whose name contains it
+        :return: results, as a JSON-serializable dict
+        """
+
+        results = {}
+        for name, func in self._benchmarks:
+            if pattern is not None and pattern not in name:
+                continue
+            results[name] = measure(func, rounds=rounds,
+                                    min_time=min_time, timer=self.timer)
+            if verbose:
+                print('{0:<50} {1}'.format(
+                    name, format_time(results[name]['min'])))
+
+        return {
+            'suite': self.name,
+            'created': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'calibration': measure(_calibration, rounds=rounds,
+                                   min_time=min_time,
+                                   timer=self.timer)['min'],
+            'benchmarks': results,
+        }
+
+
+def measure(func, rounds=5, min_time=0.05, timer=time.time):
+    """
+    Time a function.
+
+    :return: a dict of per-call ``min``, ``median`` and ``mean``
+        times (in seconds), along with the number of ``rounds``
+        and ``calls`` per round.
+    """
+
+    calls = 1
+    while True:
+        elapsed = _time_calls(func, calls, timer)
+        if elapsed >= min_time or calls >= 1000000:
+            break
+        calls *= 2
+
+    timings = sorted(
+        [elapsed / calls] +
+        [_time_calls(func, calls, timer) / calls
+         for _ in xrange(rounds - 1)])
+    return {
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'mean': sum(timings) / len(timings),
+        'rounds': len(timings),
+        'calls': calls,
+    }
+
+
+def _calibration():
+    data = {}
+    for i in xrange(1000):
+        data['key-{0}'.format(i)] = [i] * 5
+    return sorted(data.iteritems())
+
+
+def _time_calls(func, calls, timer):
+    # Like timeit, keep the garbage collector out of the timings
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timer()
+        for _ in xrange(calls):
+            func()
+        return timer() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def compare(results, baseline, tolerance=0.5, key='min'):
+    """
+    Compare benchmark results against a baseline.
+
+    Benchmarks missing from either side are ignored. If both
+    carry a calibration time, the ratio is scaled by the ratio
+    of the calibration times.
+
+    :param tolerance:
+        allowed slowdown, as a fraction of the baseline time
+    :return: list of ``(name, baseline_time, time, ratio)`` tuples
+        for the benchmarks slower than allowed.
+    """
+
+    scale = 1.0
+    if baseline.get('calibration') and results.get('calibration'):
+        scale = baseline['calibration'] / results['calibration']
+
+    regressions = []
+    old_results = baseline['benchmarks']
+    for name, result in sorted(results['benchmarks'].iteritems()):
+        if name not in old_results or not old_results[name][key]:
+            continue
+        old, new = old_results[name][key], result[key]
+        ratio = new / old * scale
+        if ratio > 1 + tolerance:
+            regressions.append((name, old, new, ratio))
+    return regressions
+
+
+def format_time(seconds):
+    for unit, factor in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * factor >= 1:
+            return '{0:.3f} {1}'.format(seconds * factor, unit)
+    return '{0:.3f} ns'.format(seconds * 1e9)
+
+
+def get_baseline_path(suite):
+    return os.path.join(BASELINES_DIR, '{0}.json'.format(suite.name))
+
+
+def main(suite, argv=None):
+    """
+    Command-line entry point for a benchmark suite.
+
+    :return: the exit status: ``1`` if regressions were found
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Run the {0} benchmarks'.format(suite.name))
+    parser.add_argument('-k', dest='pattern',
+                        help='Only run benchmarks whose name contains '
+                        'this string')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='Minimum duration of a round, in seconds')
+    parser.add_argument('-o', '--output',
+                        help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=get_baseline_path(suite),
+                        help='Baseline to compare results against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Allowed slowdown (default: 0.5 = 50%%); '
+                        'timings on shared machines vary a lot')
+    args = parser.parse_args(argv)
+
+    results = suite.run(rounds=args.rounds, min_time=args.min_time,
+                        pattern=args.pattern, verbose=True)
+
+    if args.output:
+        _write_json(args.output, results)
+
+    if args.save_baseline:
+        _write_json(args.baseline, results)
+        print('Baseline saved to {0}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found at {0}'.format(args.baseline))
+        return 0
+
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    for name, old, new, ratio in regressions:
+        print('REGRESSION {0}: {1} -> {2} ({3:+.0%})'.format(
+            name, format_time(old), format_time(new), ratio - 1))
+    if regressions:
+        return 1
+    print('No regressions (tolerance: {0:.0%})'.format(args.tolerance))
+    return 0
+
+
+def _write_json(filename, data):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(filename, 'w') as fp:
+        json.dump(data, fp, indent=2, sort_keys=True)
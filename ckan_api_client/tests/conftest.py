@@ -710,6 +710,20 @@ def ckan_url(request, ckan_instance):
     return get_ckan_url
 
 
+@pytest.fixture
+def fake_ckan(request):
+    """
+    An in-process fake Ckan server, not requiring a Ckan installation.
+
+    :rtype: :py:class:`ckan_api_client.tests.utils.fake_ckan.FakeCkanServer`
+    """
+    from ckan_api_client.tests.utils.fake_ckan import FakeCkanServer
+    server = FakeCkanServer()
+    request.addfinalizer(server.stop)
+    server.start()
+    return server
+
+
 @pytest.fixture
 def data_dir():
     """
@@ -0,0 +1,169 @@
+"""Tests for the batch save methods of the high-level client"""
+
+import itertools
+import threading
+import time
+
+from ckan_api_client.exceptions import HTTPError
+from ckan_api_client.high_level import CkanHighlevelClient
+from ckan_api_client.objects import CkanDataset, CkanOrganization, CkanGroup
+from ckan_api_client.verification import VerificationPolicy
+
+
+def _make_client(fake_ckan, **kwargs):
+    return CkanHighlevelClient(fake_ckan.server_url, fake_ckan.api_key,
+                               **kwargs)
+
+
+def test_save_datasets(fake_ckan):
+    client = _make_client(fake_ckan)
+    existing = client.create_dataset(CkanDataset({'name': 'dataset-0'}))
+    existing.title = 'Updated title'
+
+    datasets = [existing] + [
+        CkanDataset({'name': 'dataset-{0}'.format(i)})
+        for i in xrange(1, 6)]
+    results = sorted(client.save_datasets(datasets, concurrency=3))
+
+    assert [r.index for r in results] == range(6)
+    assert all(r.ok for r in results)
+    assert all(r.item is datasets[r.index] for r in results)
+
+    # Datasets with an id are updated, the others created
+    assert results[0].result.id == existing.id
+    assert results[0].result.title == 'Updated title'
+    assert all(r.result.id is not None for r in results[1:])
+    assert len(set(r.result.id for r in results)) == 6
+    assert sorted(client.list_dataset_names()) == [
+        'dataset-{0}'.format(i) for i in xrange(6)]
+
+
+def test_save_datasets_errors(fake_ckan):
+    client = _make_client(fake_ckan)
+    client.create_dataset(CkanDataset({'name': 'taken-name'}))
+
+    datasets = [
+        CkanDataset({'name': 'dataset-1'}),
+        CkanDataset({'name': 'taken-name'}),
+        CkanDataset({'id': 'does-not-exist', 'name': 'dataset-2'}),
+        'not a dataset',
+        CkanDataset({'name': 'dataset-3'}),
+    ]
+    results = sorted(client.save_datasets(datasets, concurrency=2))
+
+    # Errors are reported per item, without stopping the batch
+    assert [r.ok for r in results] == [True, False, False, False, True]
+    assert isinstance(results[1].error, HTTPError)
+    assert results[1].error.status_code == 409
+    assert isinstance(results[2].error, HTTPError)
+    assert results[2].error.status_code == 404
+    assert isinstance(results[3].error, TypeError)
+    assert all(r.result is None for r in results if not r.ok)
+    assert sorted(client.list_dataset_names()) == [
+        'dataset-1', 'dataset-3', 'taken-name']
+
+
+def test_save_datasets_completion_order(fake_ckan, monkeypatch):
+    client = _make_client(fake_ckan)
+    original_create = client.create_dataset
+
+    def create_dataset(dataset, verify=None):
+        if dataset.name == 'slow-dataset':
+            time.sleep(0.5)
+        return original_create(dataset, verify=verify)
+
+    monkeypatch.setattr(client, 'create_dataset', create_dataset)
+    datasets = [CkanDataset({'name': 'slow-dataset'})] + [
+        CkanDataset({'name': 'dataset-{0}'.format(i)}) for i in xrange(4)]
+    results = list(client.save_datasets(datasets, concurrency=2))
+
+    # Results are yielded as soon as they are available
+    assert all(r.ok for r in results)
+    assert results[-1].index == 0
+    assert sorted(r.index for r in results) == range(5)
+
+
+def test_save_datasets_backpressure(fake_ckan):
+    client = _make_client(fake_ckan)
+    consumed = []
+    lock = threading.Lock()
+
+    def source():
+        for i in itertools.count():
+            with lock:
+                consumed.append(i)
+            yield CkanDataset({'name': 'dataset-{0}'.format(i)})
+
+    results = client.save_datasets(source(), concurrency=2)
+    for _ in xrange(3):
+        assert next(results).ok
+    results.close()
+
+    # Input is consumed only up to twice the concurrency ahead
+    assert len(consumed) <= 3 + 2 * 2
+    assert len(client.list_dataset_names()) == len(consumed)
+
+
+def test_save_datasets_verify(fake_ckan, monkeypatch):
+    client = _make_client(fake_ckan, verification='off')
+    checked = []
+    original_check = VerificationPolicy.check
+
+    def check(policy, expected, actual):
+        checked.append(actual.name)
+        return original_check(policy, expected, actual)
+
+    monkeypatch.setattr(VerificationPolicy, 'check', check)
+
+    datasets = [CkanDataset({'name': 'dataset-{0}'.format(i)})
+                for i in xrange(3)]
+    assert all(r.ok for r in client.save_datasets(datasets[:1]))
+    assert checked == []
+
+    assert all(r.ok for r in client.save_datasets(datasets[1:],
+                                                  verify='full'))
+    assert sorted(checked) == ['dataset-1', 'dataset-2']
+
+
+def test_save_organizations(fake_ckan):
+    client = _make_client(fake_ckan)
+    existing = client.create_organization(CkanOrganization({'name': 'org-0'}))
+    existing.title = 'Updated title'
+
+    organizations = [existing] + [
+        CkanOrganization({'name': 'org-{0}'.format(i)}) for i in xrange(1, 4)]
+    organizations.append(CkanOrganization({'name': 'org-1'}))
+    results = sorted(client.save_organizations(organizations, concurrency=2))
+
+    assert [r.ok for r in results] == [True, True, True, True, False]
+    assert results[0].result.id == existing.id
+    assert results[0].result.title == 'Updated title'
+    assert isinstance(results[4].error, HTTPError)
+    assert sorted(client.list_organization_names()) == [
+        'org-0', 'org-1', 'org-2', 'org-3']
+
+
+def test_save_groups(fake_ckan, monkeypatch):
+    client = _make_client(fake_ckan, verification='off')
+    checked = []
+    monkeypatch.setattr(VerificationPolicy, 'check',
+                        lambda policy, expected, actual:
+                        checked.append(actual.name) or True)
+
+    existing = client.create_group(CkanGroup({'name': 'group-0'}))
+    existing.title = 'Updated title'
+
+    groups = [existing] + [
+        CkanGroup({'name': 'group-{0}'.format(i)}) for i in xrange(1, 4)]
+    groups.append(CkanGroup({'id': 'does-not-exist', 'name': 'group-9'}))
+    results = sorted(client.save_groups(groups, concurrency=2,
+                                        verify='full'))
+
+    assert [r.ok for r in results] == [True, True, True, True, False]
+    assert results[0].result.id == existing.id
+    assert results[0].result.title == 'Updated title'
+    assert isinstance(results[4].error, HTTPError)
+    assert sorted(checked) == ['group-0', 'group-1', 'group-2', 'group-3']
+    assert sorted(client.get_group(r.result.id).name
+                  for r in results if r.ok) == [
+        'group-0', 'group-1', 'group-2', 'group-3']
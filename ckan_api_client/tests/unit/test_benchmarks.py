@@ -0,0 +1,53 @@
+"""Tests for the benchmark runner"""
+
+import json
+
+from ckan_api_client.tests.benchmarks import bench_objects, bench_sync, runner
+
+
+def test_benchmark_compare():
+    baseline = {'calibration': 1.0, 'benchmarks': {
+        'a': {'min': 1.0}, 'b': {'min': 1.0}, 'c': {'min': 1.0}}}
+    results = {'calibration': 1.0, 'benchmarks': {
+        'a': {'min': 1.1}, 'b': {'min': 2.0}, 'd': {'min': 5.0}}}
+    assert runner.compare(results, baseline, tolerance=0.25) == [
+        ('b', 1.0, 2.0, 2.0)]
+
+    # Results are scaled by the calibration time
+    results['calibration'] = 2.0
+    assert runner.compare(results, baseline, tolerance=0.25) == []
+
+
+def test_benchmark_objects_suite(tmpdir):
+    suite = bench_objects.make_suite()
+    assert 'compare[many_tags]' in suite.names
+
+    output = str(tmpdir.join('results.json'))
+    baseline = str(tmpdir.join('baseline.json'))
+    args = ['-k', '[small]', '--rounds', '1', '--min-time', '0',
+            '--baseline', baseline]
+    assert runner.main(suite, args + ['--save-baseline']) == 0
+    assert runner.main(suite, args + ['-o', output,
+                                      '--tolerance', '1000']) == 0
+
+    with open(output) as fp:
+        results = json.load(fp)
+    assert results['suite'] == 'objects'
+    assert sorted(results['benchmarks']) == sorted(
+        name for name in suite.names if name.endswith('[small]'))
+
+
+def test_benchmark_sync_scenarios():
+    results = dict((r['scenario'], r) for r in
+                   bench_sync.run_scenarios(40))
+    assert sorted(results) == sorted(bench_sync.SCENARIOS)
+    assert all(r['failures'] == 0 for r in results.itervalues())
+    assert all(r['http_calls'] > 0 for r in results.itervalues())
+
+    assert results['first_import']['counts']['dataset'] == {'create': 40}
+    assert 'dataset' not in results['noop_resync']['counts']
+    assert results['churn']['counts']['dataset'] == {
+        'update': 2, 'delete': 1, 'create': 1}
+    assert results['rename_collisions']['counts']['dataset'] == {
+        'create': 40}
+    assert results['rename_collisions']['renames'] == 40
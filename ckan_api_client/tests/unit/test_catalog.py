@@ -0,0 +1,79 @@
+"""Tests for the synthetic catalog generator"""
+
+import json
+import sqlite3
+
+from ckan_api_client.commands.syncing import ImportDirectory, ImportSQLite
+from ckan_api_client.tests.utils.catalog import CatalogGenerator
+
+
+def test_catalog_shape():
+    catalog = CatalogGenerator(datasets=50, organizations=3, groups=4,
+                               resources=(2, 2), extras=(3, 3),
+                               extra_size=10, tags=(1, 5),
+                               groups_per_dataset=(1, 2))
+    data = catalog.get_data()
+    assert len(data['dataset']) == 50
+    assert sorted(data['organization']) == ['org-0000', 'org-0001',
+                                            'org-0002']
+    assert len(data['group']) == 4
+
+    for key, dataset in data['dataset'].iteritems():
+        assert dataset['id'] == key
+        assert len(dataset['resources']) == 2
+        assert len(dataset['extras']) == 3
+        assert all(len(v) == 10 for v in dataset['extras'].itervalues())
+        assert 1 <= len(dataset['tags']) <= 5
+        assert 1 <= len(dataset['groups']) <= 2
+        assert set(dataset['groups']) <= set(data['group'])
+        assert dataset['owner_org'] in data['organization']
+
+
+def test_catalog_is_deterministic():
+    assert CatalogGenerator(datasets=20, seed=1).get_data(day=2) == \
+        CatalogGenerator(datasets=20, seed=1).get_data(day=2)
+    assert CatalogGenerator(datasets=20, seed=1).get_data() != \
+        CatalogGenerator(datasets=20, seed=2).get_data()
+
+
+def test_catalog_days():
+    catalog = CatalogGenerator(datasets=200)
+    day0 = catalog.get_data(day=0)['dataset']
+    day1 = catalog.get_data(day=1)['dataset']
+    changes = catalog.get_changes(1)
+
+    assert len(changes['updated']) == 10
+    assert len(changes['deleted']) == 5
+    assert len(changes['created']) == 5
+
+    assert set(day1) == (set(day0) - set(changes['deleted'])
+                         | set(changes['created']))
+    for key in day1:
+        if key in changes['updated']:
+            assert day1[key] != day0[key]
+        elif key not in changes['created']:
+            assert day1[key] == day0[key]
+
+    # Changes of following days only affect existing datasets
+    changes2 = catalog.get_changes(2)
+    assert not set(changes2['deleted']) - set(day1)
+    assert not set(changes2['updated']) - set(day1)
+    assert not set(changes2['created']) & set(day1)
+
+
+def test_catalog_output(tmpdir):
+    catalog = CatalogGenerator(datasets=20)
+    expected = catalog.get_data(day=1)
+
+    directory = str(tmpdir.join('catalog'))
+    catalog.write_directory(directory, day=1)
+    assert ImportDirectory(None, None)._load_data(directory) == expected
+
+    filename = str(tmpdir.join('catalog.sqlite'))
+    catalog.write_sqlite(filename, day=1)
+    db = sqlite3.connect(filename)
+    db.row_factory = sqlite3.Row
+    command = ImportSQLite(None, None)
+    for obj_type in ('dataset', 'group', 'organization'):
+        assert command._load_from_table(db, obj_type) == \
+            json.loads(json.dumps(expected[obj_type]))
@@ -0,0 +1,61 @@
+import gzip
+import json
+import operator
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.client_hilev import ExportDatasets
+from ckan_api_client.high_level import CkanHighlevelClient
+
+
+def _populate(ckan, count):
+    group = ckan.create_group({'name': 'group-1'})
+    for i in xrange(count):
+        ckan.create_dataset({
+            'name': 'dataset-{0:02d}'.format(i),
+            'extras': {'key': 'value-{0}'.format(i)},
+            'groups': [group['id']],
+            'tags': ['tag-a', 'tag-b'],
+            'resources': [{'url': 'http://example.com/{0}'.format(i)}],
+        })
+    return group
+
+
+def test_iter_datasets_bulk(fake_ckan):
+    group = _populate(fake_ckan.ckan, 10)
+    client = CkanHighlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+
+    datasets = list(client.iter_datasets_bulk(page_size=3, concurrency=2))
+    assert sorted(d.name for d in datasets) == [
+        'dataset-{0:02d}'.format(i) for i in xrange(10)]
+    assert fake_ckan.count_requests(
+        'GET', '/api/3/action/package_search') == 4
+
+    # Datasets are converted to the same format as get_dataset()
+    for dataset in datasets:
+        assert dataset.is_equivalent(client.get_dataset(dataset.id))
+        assert dataset.groups == set([group['id']])
+        assert dataset.tags == set(['tag-a', 'tag-b'])
+        index = int(dataset.name.split('-')[1])
+        assert dataset.extras == {'key': 'value-{0}'.format(index)}
+
+
+def test_cli_export_datasets(fake_ckan, tmpdir, capsys):
+    _populate(fake_ckan.ckan, 5)
+    app = CkanClientApp()
+    app.command_manager.add_command('export_datasets', ExportDatasets)
+    args = ['--url', fake_ckan.server_url, '--api-key', fake_ckan.api_key,
+            '--page-size', '2']
+
+    assert app.run(['export_datasets'] + args) == 0
+    out, _ = capsys.readouterr()
+    lines = [json.loads(line) for line in out.splitlines()]
+    assert sorted(d['name'] for d in lines) == [
+        'dataset-{0:02d}'.format(i) for i in xrange(5)]
+
+    # Compression is enabled by the file extension
+    filename = str(tmpdir.join('datasets.jsonl.gz'))
+    assert app.run(['export_datasets', '-o', filename] + args) == 0
+    with gzip.open(filename) as fp:
+        exported = [json.loads(line) for line in fp]
+    assert (sorted(exported, key=operator.itemgetter('name')) ==
+            sorted(lines, key=operator.itemgetter('name')))
@@ -0,0 +1,196 @@
+"""Tests for the in-process fake Ckan server"""
+
+import time
+
+import pytest
+import requests
+
+from ckan_api_client.exceptions import HTTPError
+from ckan_api_client.high_level import CkanHighlevelClient
+from ckan_api_client.low_level import CkanLowlevelClient
+from ckan_api_client.objects import CkanDataset, CkanGroup, CkanOrganization
+from ckan_api_client.syncing import SynchronizationClient
+from ckan_api_client.tests.unit.test_syncing import make_data
+from ckan_api_client.tests.utils.fake_ckan import (
+    FakeCkan, FakeCkanError, FakeCkanServer)
+
+
+def test_fake_ckan_crud(fake_ckan):
+    client = CkanHighlevelClient(fake_ckan.server_url, fake_ckan.api_key,
+                                 fail_on_inconsistency=True)
+
+    org = client.create_organization(CkanOrganization(
+        {'name': 'org-1', 'title': 'Org 1', 'extras': {'a': '1'}}))
+    assert client.list_organization_names() == ['org-1']
+    assert client.get_organization_by_name('org-1').extras == {'a': '1'}
+
+    group = client.create_group(CkanGroup({'name': 'group-1'}))
+    assert client.list_groups() == [group.id]
+
+    dataset = client.create_dataset(CkanDataset({
+        'name': 'dataset-1', 'title': 'Dataset 1',
+        'owner_org': org.id, 'groups': [group.id],
+        'extras': {'foo': 'bar', 'spam': 'eggs'},
+        'resources': [{'url': 'http://example.com/1'}]}))
+    assert dataset.resources[0].id is not None
+    assert client.list_datasets() == [dataset.id]
+    assert client.list_dataset_names() == ['dataset-1']
+
+    dataset.title = 'Updated title'
+    del dataset.extras['spam']
+    updated = client.update_dataset(dataset)
+    assert updated.extras == {'foo': 'bar'}
+    assert client.get_dataset(dataset.id).title == 'Updated title'
+
+    with pytest.raises(HTTPError) as excinfo:
+        client.create_dataset(CkanDataset({'name': 'dataset-1'}))
+    assert excinfo.value.status_code == 409
+
+    client.delete_dataset(dataset.id)
+    assert client.list_datasets() == []
+    assert client.get_dataset(dataset.id, allow_deleted=True).state == \
+        'deleted'
+
+
+def test_fake_ckan_names():
+    ckan = FakeCkan()
+    dataset = ckan.create_dataset({'name': 'dataset-1'})
+    assert ckan.show_dataset('dataset-1')['id'] == dataset['id']
+
+    # Renaming frees the old name
+    ckan.update_dataset(dataset['id'], {'name': 'dataset-2'})
+    assert ckan.show_dataset('dataset-2')['id'] == dataset['id']
+    with pytest.raises(FakeCkanError):
+        ckan.show_dataset('dataset-1')
+    other = ckan.create_dataset({'name': 'dataset-1'})
+    assert ckan.show_dataset('dataset-1')['id'] == other['id']
+    with pytest.raises(FakeCkanError):
+        ckan.update_dataset(other['id'], {'name': 'dataset-2'})
+
+    # Deleted objects keep their name, purged ones don't
+    ckan.delete_dataset('dataset-2')
+    with pytest.raises(FakeCkanError):
+        ckan.create_dataset({'name': 'dataset-2'})
+    ckan.create_organization({'name': 'org-1'})
+    with pytest.raises(FakeCkanError):
+        ckan.create_group({'name': 'org-1'})
+    ckan.purge_group('org-1', organization=True)
+    assert ckan.create_group({'name': 'org-1'})['name'] == 'org-1'
+
+
+def test_fake_ckan_modified_ids(fake_ckan):
+    client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+    ids = [client.post_dataset({'name': 'dataset-{0}'.format(i)})['id']
+           for i in xrange(5)]
+    modified = list(client.iter_modified_dataset_ids(page_size=2))
+    assert [id for id, _ in modified] == ids
+
+    since = modified[2][1]
+    assert [id for id, _ in client.iter_modified_dataset_ids(since)] == \
+        ids[2:]
+
+
+def test_fake_ckan_modified_ids_concurrent_changes(fake_ckan):
+    client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+    ids = [client.post_dataset({'name': 'dataset-{0}'.format(i)})['id']
+           for i in xrange(6)]
+
+    # Datasets modified while iterating move to the end of the list,
+    # without making others shift to pages already returned
+    iterator = client.iter_modified_dataset_ids(page_size=2)
+    seen = [next(iterator)[0], next(iterator)[0]]
+    client.put_dataset({'id': ids[0], 'title': 'Changed'})
+    seen.extend(id for id, _ in iterator)
+    assert seen == ids[:2] + ids[2:] + ids[:1]
+
+    # Datasets modified at the same time are all returned
+    timestamp = '2014-01-01T00:00:00.000000'
+    for dataset in fake_ckan.ckan.datasets.itervalues():
+        dataset['metadata_modified'] = timestamp
+    calls = fake_ckan.count_requests('GET', '/api/3/action/package_search')
+    modified = list(client.iter_modified_dataset_ids(page_size=4))
+    assert [id for id, _ in modified] == sorted(ids)
+    assert fake_ckan.count_requests(
+        'GET', '/api/3/action/package_search') == calls + 2
+
+
+def test_fake_ckan_authorization(fake_ckan):
+    client = CkanLowlevelClient(fake_ckan.server_url)
+    assert client.list_datasets() == []
+    with pytest.raises(HTTPError) as excinfo:
+        client.post_dataset({'name': 'dataset-1'})
+    assert excinfo.value.status_code == 403
+
+
+def test_fake_ckan_sync(fake_ckan):
+    client = SynchronizationClient(fake_ckan.server_url, fake_ckan.api_key)
+    data = make_data(10)
+    report = client.sync('test-source', data)
+    assert report.ok
+    assert report.get_count('dataset', 'create') == 10
+    assert len(fake_ckan.ckan.datasets) == 10
+
+    del data['dataset']['ds-0']
+    data['dataset']['ds-3']['title'] = 'Updated title'
+    report = client.sync('test-source', data)
+    assert report.get_count('dataset', 'delete') == 1
+    assert report.get_count('dataset', 'update') == 1
+    assert fake_ckan.count_requests('PUT', '/api/2/rest/dataset/{id}') == 1
+
+
+def test_fake_ckan_sync_stream(fake_ckan):
+    client = SynchronizationClient(fake_ckan.server_url, fake_ckan.api_key)
+    data = make_data(10)
+    client.sync('test-source', data)
+
+    # Only the datasets passed are retrieved to be compared (and
+    # once more by update_dataset()); the others are only found
+    # by the id crawl
+    changed = {'ds-3': dict(data['dataset']['ds-3'], title='Changed'),
+               'ds-4': data['dataset']['ds-4']}
+    gets = fake_ckan.count_requests('GET', '/api/2/rest/dataset/{id}')
+    report = client.sync_stream(
+        'test-source', changed.iteritems(),
+        groups=data['group'], organizations=data['organization'],
+        source_ids=set(data['dataset']))
+    assert report.ok
+    assert report.get_count('dataset', 'update') == 1
+    assert fake_ckan.count_requests(
+        'GET', '/api/2/rest/dataset/{id}') == gets + 3
+    assert fake_ckan.ckan.datasets[
+        client._index_datasets_by_source('test-source')['ds-3']][
+            'title'] == 'Changed'
+
+
+def test_fake_ckan_error_injection(fake_ckan):
+    client = CkanLowlevelClient(fake_ckan.server_url, max_retries=2,
+                                retry_delay=0)
+    fake_ckan.fail_next(2)
+    assert client.list_datasets() == []
+    assert fake_ckan.request_count == 3
+
+    fake_ckan.fail_next(1, status=500)
+    with pytest.raises(HTTPError) as excinfo:
+        client.list_datasets()
+    assert excinfo.value.status_code == 500
+
+
+def test_fake_ckan_error_rate():
+    with FakeCkanServer(error_rate=0.5, seed=1) as server:
+        url = server.server_url + '/api/2/rest/dataset'
+        statuses = [requests.get(url).status_code for _ in xrange(20)]
+    assert 0 < statuses.count(503) < 20
+    assert statuses.count(200) == 20 - statuses.count(503)
+
+
+def test_fake_ckan_latency_and_throttling():
+    with FakeCkanServer(latency=0.05) as server:
+        start = time.time()
+        requests.get(server.server_url + '/api/2/rest/dataset')
+        assert time.time() - start >= 0.05
+
+    with FakeCkanServer(rate_limit=5) as server:
+        url = server.server_url + '/api/2/rest/dataset'
+        statuses = [requests.get(url).status_code for _ in xrange(10)]
+    assert statuses[:5] == [200] * 5
+    assert 503 in statuses[5:]
@@ -0,0 +1,201 @@
+"""Tests for request hooks"""
+
+import json
+import logging
+
+import pytest
+import requests
+
+from ckan_api_client.exceptions import HTTPError
+from ckan_api_client.hooks import (
+    RequestHook, MetricsHook, MetricsRegistry, LoggingHook,
+    get_path_template)
+from ckan_api_client.low_level import CkanLowlevelClient
+
+
+class RecordingHook(RequestHook):
+    def __init__(self):
+        self.events = []
+
+    def before_request(self, event):
+        self.events.append(('before', event.to_dict()))
+
+    def after_response(self, event):
+        self.events.append(('after', event.to_dict()))
+
+    def on_error(self, event):
+        self.events.append(('error', event.to_dict()))
+
+
+def make_response(status_code, data):
+    response = requests.models.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data)
+    return response
+
+
+@pytest.fixture
+def fake_requests(monkeypatch):
+    """Replace Session.request, returning queued responses"""
+    responses = []
+    calls = []
+
+    def fake_request(session, method, url, **kwargs):
+        calls.append((method, url))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(requests.Session, 'request', fake_request)
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    return responses, calls
+
+
+def test_get_path_template():
+    assert get_path_template('/api/2/rest/dataset/abc-123') \
+        == '/api/2/rest/dataset/{id}'
+    assert get_path_template('/api/2/rest/dataset') == '/api/2/rest/dataset'
+    assert get_path_template('/api/3/action/organization_show?id=abc') \
+        == '/api/3/action/organization_show'
+
+
+def test_request_hooks(fake_requests):
+    responses, calls = fake_requests
+    hook = RecordingHook()
+    client = CkanLowlevelClient('http://127.0.0.1:5000', hooks=[hook])
+
+    responses.append(make_response(200, {'id': 'abc', 'name': 'foo'}))
+    client.get_dataset('abc')
+
+    assert [e[0] for e in hook.events] == ['before', 'after']
+    event = hook.events[1][1]
+    assert event['method'] == 'GET'
+    assert event['path_template'] == '/api/2/rest/dataset/{id}'
+    assert event['status'] == 200
+    assert event['latency'] >= 0
+    assert event['response_size'] == len(
+        json.dumps({'id': 'abc', 'name': 'foo'}))
+    assert event['retries'] == 0
+
+    del hook.events[:]
+    responses.append(make_response(404, {}))
+    with pytest.raises(HTTPError):
+        client.get_dataset('missing')
+    assert [e[0] for e in hook.events] == ['before', 'after', 'error']
+    assert hook.events[2][1]['status'] == 404
+
+    stats = client.get_request_stats()
+    assert stats['calls'] == 2
+    assert stats['errors'] == 1
+
+
+def test_request_retries(fake_requests):
+    responses, calls = fake_requests
+    hook = RecordingHook()
+    client = CkanLowlevelClient('http://127.0.0.1:5000', hooks=[hook],
+                                max_retries=2)
+
+    responses.extend([
+        requests.ConnectionError('Connection refused'),
+        make_response(503, {}),
+        make_response(200, {'id': 'abc', 'name': 'foo'}),
+    ])
+    assert client.get_dataset('abc')['id'] == 'abc'
+    assert len(calls) == 3
+    before = [e[1]['retries'] for e in hook.events if e[0] == 'before']
+    assert before == [0, 1, 2]
+    assert client.get_request_stats()['retries'] == 2
+
+    # POST requests are not retried
+    responses.append(make_response(503, {}))
+    with pytest.raises(HTTPError):
+        client.post_dataset({'name': 'foo'})
+    assert len(calls) == 4
+
+
+def test_anonymous_client(fake_requests):
+    responses, calls = fake_requests
+    hook = RecordingHook()
+    client = CkanLowlevelClient('http://127.0.0.1:5000', api_key='key',
+                                hooks=[hook], max_retries=1)
+    anonymous = client.anonymous
+    assert anonymous.api_key is None
+    assert anonymous.session is client.session
+    assert anonymous.max_retries == 1
+
+    # Requests are seen by the hooks and counted in the stats
+    responses.extend([
+        make_response(503, {}),
+        make_response(200, {'id': 'abc', 'name': 'foo'}),
+    ])
+    assert anonymous.get_dataset('abc')['id'] == 'abc'
+    assert len(calls) == 2
+    assert [e[0] for e in hook.events] == [
+        'before', 'after', 'error', 'before', 'after']
+    assert client.get_request_stats()['calls'] == 2
+    assert client.get_request_stats()['retries'] == 1
+
+
+def test_metrics_hook(fake_requests):
+    responses, calls = fake_requests
+    registry = MetricsRegistry()
+    client = CkanLowlevelClient('http://127.0.0.1:5000',
+                                hooks=[MetricsHook(registry)])
+
+    for i in xrange(3):
+        responses.append(make_response(200, {'id': str(i), 'name': 'x'}))
+        client.get_dataset(str(i))
+    responses.append(make_response(404, {}))
+    with pytest.raises(HTTPError):
+        client.get_dataset('missing')
+
+    labels = {'method': 'GET', 'path': '/api/2/rest/dataset/{id}'}
+    assert registry.get_value(
+        'ckan_requests_total', dict(labels, status='200')) == 3
+    assert registry.get_value(
+        'ckan_request_errors_total', dict(labels, status='404')) == 1
+    assert registry.get_value('ckan_request_duration_seconds', labels) == 4
+
+    text = registry.render()
+    assert '# TYPE ckan_requests_total counter' in text
+    assert ('ckan_requests_total{method="GET",'
+            'path="/api/2/rest/dataset/{id}",status="200"} 3') in text
+    assert ('ckan_request_duration_seconds_bucket{method="GET",'
+            'path="/api/2/rest/dataset/{id}",le="+Inf"} 4') in text
+
+
+def test_logging_hook(fake_requests):
+    responses, calls = fake_requests
+
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    logger = logging.getLogger('test_logging_hook')
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(Handler())
+
+    client = CkanLowlevelClient('http://127.0.0.1:5000',
+                                hooks=[LoggingHook(logger)])
+    responses.append(make_response(200, {'id': 'abc', 'name': 'foo'}))
+    client.get_dataset('abc')
+
+    assert len(records) == 1
+    assert records[0].ckan_request['status'] == 200
+    assert records[0].ckan_request['path'] == '/api/2/rest/dataset/abc'
+
+
+def test_failing_hook_is_ignored(fake_requests):
+    responses, calls = fake_requests
+
+    class FailingHook(RequestHook):
+        def before_request(self, event):
+            raise RuntimeError('Oops')
+
+    client = CkanLowlevelClient('http://127.0.0.1:5000',
+                                hooks=[FailingHook()])
+    responses.append(make_response(200, {'id': 'abc', 'name': 'foo'}))
+    assert client.get_dataset('abc')['id'] == 'abc'
@@ -0,0 +1,81 @@
+"""Tests for the identity map of the high-level client"""
+
+import pytest
+
+from ckan_api_client.exceptions import HTTPError
+from ckan_api_client.high_level import CkanHighlevelClient
+from ckan_api_client.objects import CkanGroup
+from ckan_api_client.utils import IdentityMap
+
+
+class StubLowlevelClient(object):
+    """Fake low-level client, keeping groups in memory"""
+
+    def __init__(self):
+        self.groups = {}
+        self.calls = []
+
+    def get_group(self, id_or_name):
+        self.calls.append(('get_group', id_or_name))
+        for group in self.groups.itervalues():
+            if id_or_name in (group['id'], group['name']):
+                return dict(group)
+        raise HTTPError(404, 'Not found')
+
+    def put_group(self, group):
+        self.calls.append(('put_group', group['id']))
+        self.groups[group['id']] = dict(group)
+        return dict(group)
+
+    def delete_group(self, group_id):
+        self.calls.append(('delete_group', group_id))
+        self.groups[group_id]['state'] = 'deleted'
+
+
+def test_identity_map():
+    idmap = IdentityMap()
+    group = CkanGroup({'id': 'group-id', 'name': 'group-name'})
+    idmap.add(group)
+
+    assert idmap.get_by_id('group-id') is group
+    assert idmap.get_by_name('group-name') is group
+    assert len(idmap) == 1
+
+    # Replacing an object with a new name drops the old name
+    renamed = CkanGroup({'id': 'group-id', 'name': 'new-name'})
+    idmap.add(renamed)
+    assert idmap.get_by_id('group-id') is renamed
+    assert idmap.get_by_name('new-name') is renamed
+    assert idmap.get_by_name('group-name') is None
+
+    idmap.discard(name='new-name')
+    assert idmap.get_by_id('group-id') is None
+    assert len(idmap) == 0
+
+
+def test_highlevel_client_identity_map():
+    client = CkanHighlevelClient('http://127.0.0.1:5000',
+                                 identity_map=True)
+    client._client = lowlev = StubLowlevelClient()
+    lowlev.groups['group-1'] = {
+        'id': 'group-1', 'name': 'my-group', 'title': 'My Group',
+        'state': 'active'}
+
+    group = client.get_group_by_name('my-group')
+    assert client.get_group_by_name('my-group') is group
+    assert client.get_group('group-1') is group
+    assert lowlev.calls == [('get_group', 'my-group')]
+
+    # Updates replace the cached object
+    group.title = 'My Updated Group'
+    updated = client.update_group(group)
+    assert client.get_group('group-1') is updated
+    assert client.get_group_by_name('my-group').title == 'My Updated Group'
+    assert len(lowlev.calls) == 2
+
+    # Deletes evict the object
+    client.delete_group('group-1')
+    with pytest.raises(HTTPError):
+        client.get_group('group-1')
+    assert client.get_group('group-1', allow_deleted=True).state == 'deleted'
+    assert lowlev.calls[-1] == ('get_group', 'group-1')
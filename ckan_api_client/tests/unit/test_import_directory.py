@@ -0,0 +1,74 @@
+import json
+import os
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.syncing import ImportDirectory
+from ckan_api_client.sources import DirectorySource
+from ckan_api_client.tests.utils.catalog import CatalogGenerator
+
+
+def test_directory_source(tmpdir):
+    catalog = CatalogGenerator(datasets=20, organizations=2, groups=3)
+    path = str(tmpdir.join('source'))
+    catalog.write_directory(path)
+    tmpdir.join('source', 'dataset', '.hidden').write('')
+
+    source = DirectorySource(path, concurrency=3)
+    files = source.list_files('dataset')
+    assert sorted(files) == sorted(key for key, _ in catalog.iter_datasets())
+    assert all(size > 0 for _, size in files.itervalues())
+
+    loaded = list(source.iter_objects('dataset', ['ds-0000003']))
+    assert loaded == [('ds-0000003', 'ds-0000003', catalog.get_dataset(3))]
+    assert source.load_all('group') == json.loads(
+        json.dumps(dict(catalog.iter_groups())))
+
+
+def test_import_directory_manifest(fake_ckan, tmpdir, monkeypatch):
+    catalog = CatalogGenerator(datasets=10, organizations=2, groups=3)
+    path = str(tmpdir.join('source'))
+    catalog.write_directory(path)
+    manifest = str(tmpdir.join('manifest.json'))
+
+    loaded = []
+    load = DirectorySource.load
+
+    def counting_load(self, obj_type, name):
+        loaded.append((obj_type, name))
+        return load(self, obj_type, name)
+
+    monkeypatch.setattr(DirectorySource, 'load', counting_load)
+
+    def run_import():
+        del loaded[:]
+        app = CkanClientApp()
+        app.command_manager.add_command('import_directory', ImportDirectory)
+        assert app.run([
+            'import_directory', 'test-source', path, '--manifest', manifest,
+            '--url', fake_ckan.server_url,
+            '--api-key', fake_ckan.api_key]) == 0
+        return sorted(name for obj_type, name in loaded
+                      if obj_type == 'dataset')
+
+    def get_titles():
+        return sorted(d['title'] for d in fake_ckan.ckan.datasets.values()
+                      if d['state'] == 'active')
+
+    assert len(run_import()) == 10
+    assert len(get_titles()) == 10
+
+    # Nothing changed: no dataset file is read
+    assert run_import() == []
+
+    # Only the changed file is read; the removed one is deleted
+    dataset = catalog.get_dataset(1)
+    dataset['title'] = 'Changed'
+    with open(os.path.join(path, 'dataset', 'ds-0000001'), 'w') as fp:
+        json.dump(dataset, fp)
+    os.unlink(os.path.join(path, 'dataset', 'ds-0000002'))
+
+    assert run_import() == ['ds-0000001']
+    titles = get_titles()
+    assert len(titles) == 9
+    assert 'Changed' in titles
+    assert 'Dataset 2' not in titles
@@ -0,0 +1,64 @@
+import json
+import sqlite3
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.syncing import ImportSQLite
+
+
+def _write_source(filename, datasets):
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE IF NOT EXISTS dataset '
+               '(id TEXT PRIMARY KEY, json_data TEXT, modified INTEGER)')
+    db.execute('CREATE INDEX IF NOT EXISTS dataset_modified '
+               'ON dataset (modified)')
+    for table in ('"group"', 'organization'):
+        db.execute('CREATE TABLE IF NOT EXISTS {0} '
+                   '(id TEXT PRIMARY KEY, json_data TEXT)'.format(table))
+    db.execute('INSERT OR REPLACE INTO organization (id, json_data) '
+               'VALUES (?, ?)', ('org-1', json.dumps({'name': 'org-1'})))
+    db.execute('DELETE FROM dataset')
+    db.executemany(
+        'INSERT INTO dataset (id, json_data, modified) VALUES (?, ?, ?)',
+        [(key, json.dumps(dataset), modified)
+         for key, (dataset, modified) in datasets.iteritems()])
+    db.commit()
+    db.close()
+
+
+def _get_titles(ckan):
+    return dict((d['name'], d['title']) for d in ckan.datasets.itervalues()
+                if d['state'] == 'active')
+
+
+def test_import_sqlite_stream_incremental(fake_ckan, tmpdir):
+    filename = str(tmpdir.join('source.sqlite'))
+    datasets = dict(
+        ('ds-{0}'.format(i),
+         ({'name': 'dataset-{0}'.format(i), 'title': 'Dataset',
+           'owner_org': 'org-1', 'groups': [], 'extras': {},
+           'resources': []}, 1))
+        for i in xrange(5))
+    _write_source(filename, datasets)
+
+    app = CkanClientApp()
+    app.command_manager.add_command('import_sqlite', ImportSQLite)
+    args = ['import_sqlite', 'test-source', filename,
+            '--url', fake_ckan.server_url, '--api-key', fake_ckan.api_key,
+            '--batch-size', '2']
+
+    assert app.run(args + ['--stream']) == 0
+    assert _get_titles(fake_ckan.ckan) == dict(
+        ('dataset-{0}'.format(i), 'Dataset') for i in xrange(5))
+
+    # Rows not marked as modified are not read at all, but
+    # rows removed from the table are deleted anyway
+    datasets['ds-0'] = (dict(datasets['ds-0'][0], title='Changed'), 2)
+    datasets['ds-1'] = (dict(datasets['ds-1'][0], title='Ignored'), 1)
+    del datasets['ds-2']
+    _write_source(filename, datasets)
+
+    assert app.run(args + ['--modified-column', 'modified',
+                           '--modified-since', '2']) == 0
+    assert _get_titles(fake_ckan.ckan) == {
+        'dataset-0': 'Changed', 'dataset-1': 'Dataset',
+        'dataset-3': 'Dataset', 'dataset-4': 'Dataset'}
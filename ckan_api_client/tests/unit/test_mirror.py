@@ -0,0 +1,199 @@
+import json
+import os
+import sqlite3
+import tarfile
+
+import pytest
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.mirror import Mirror
+from ckan_api_client.commands.syncing import ImportDirectory
+from ckan_api_client.low_level import CkanLowlevelClient
+from ckan_api_client.mirror import CatalogMirror, open_store
+from ckan_api_client.tests.utils.fake_ckan import FakeCkanServer
+
+
+def _populate(ckan, count):
+    ckan.create_group({'name': 'group-1'})
+    ckan.create_organization({'name': 'org-1'})
+    return [ckan.create_dataset({'name': 'dataset-{0:02d}'.format(i)})
+            for i in xrange(count)]
+
+
+def _read_sqlite(filename, table):
+    db = sqlite3.connect(filename)
+    try:
+        return dict((id, json.loads(data)) for id, data in db.execute(
+            'SELECT id, json_data FROM "{0}"'.format(table)))
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_mirror_directory(fake_ckan, tmpdir, bulk):
+    datasets = _populate(fake_ckan.ckan, 5)
+    client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+    path = str(tmpdir.join('mirror'))
+
+    counts = CatalogMirror(client, open_store(path), page_size=2,
+                           bulk=bulk).run()
+    assert counts['dataset'] == {'written': 5, 'deleted': 0}
+    assert counts['group']['written'] == 1
+    assert counts['organization']['written'] == 1
+
+    assert sorted(os.listdir(os.path.join(path, 'dataset'))) == sorted(
+        d['id'] for d in datasets)
+    with open(os.path.join(path, 'dataset', datasets[0]['id'])) as fp:
+        assert json.load(fp)['name'] == 'dataset-00'
+
+
+def test_mirror_sqlite_incremental(fake_ckan, tmpdir):
+    ckan = fake_ckan.ckan
+    datasets = _populate(ckan, 10)
+    filename = str(tmpdir.join('mirror.sqlite'))
+
+    def run_mirror():
+        client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+        return CatalogMirror(client, open_store(filename),
+                             page_size=3).run(incremental=True)
+
+    assert run_mirror()['dataset'] == {'written': 10, 'deleted': 0}
+
+    ckan.update_dataset(datasets[0]['id'], {'title': 'Changed'})
+    ckan.delete_dataset(datasets[1]['id'])
+    ckan.create_dataset({'name': 'dataset-new'})
+
+    # Only the modified datasets are fetched again (plus the last
+    # one of the previous run, as the lower bound is inclusive)
+    counts = run_mirror()['dataset']
+    assert 2 <= counts['written'] <= 3
+    assert counts['deleted'] == 1
+
+    data = _read_sqlite(filename, 'dataset')
+    assert len(data) == 10
+    assert data[datasets[0]['id']]['title'] == 'Changed'
+    assert datasets[1]['id'] not in data
+
+    # Nothing changed: only the boundary dataset is fetched
+    assert run_mirror()['dataset']['written'] <= 1
+
+
+def test_mirror_incremental_concurrent_changes(fake_ckan, tmpdir):
+    ckan = fake_ckan.ckan
+    datasets = _populate(ckan, 6)
+    filename = str(tmpdir.join('mirror.sqlite'))
+
+    def run_mirror(on_write=None):
+        client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+        store = open_store(filename)
+        if on_write is not None:
+            original_write = store.write
+
+            def write(obj_type, key, obj):
+                original_write(obj_type, key, obj)
+                if obj_type == 'dataset':
+                    on_write(obj)
+
+            store.write = write
+        return CatalogMirror(client, store, page_size=2).run(
+            incremental=True)
+
+    run_mirror()
+    for dataset in datasets:
+        ckan.update_dataset(dataset['id'], {'title': 'Version 2'})
+
+    # A dataset modified while mirroring must not make the
+    # following ones shift to pages already fetched
+    def on_write(dataset):
+        if dataset['id'] == datasets[0]['id'] and \
+                dataset['title'] == 'Version 2':
+            ckan.update_dataset(dataset['id'], {'title': 'Version 3'})
+
+    run_mirror(on_write)
+    data = _read_sqlite(filename, 'dataset')
+    assert sorted((id, d['title']) for id, d in data.iteritems()) == sorted(
+        [(datasets[0]['id'], 'Version 3')] +
+        [(d['id'], 'Version 2') for d in datasets[1:]])
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_mirror_private_datasets(fake_ckan, tmpdir, bulk):
+    ckan = fake_ckan.ckan
+    _populate(ckan, 2)
+    private = ckan.create_dataset({'name': 'private-dataset',
+                                   'private': True})
+    filename = str(tmpdir.join('mirror.sqlite'))
+
+    def run_mirror(bulk, incremental=False):
+        client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+        return CatalogMirror(client, open_store(filename), page_size=2,
+                             bulk=bulk).run(incremental=incremental)
+
+    assert run_mirror(bulk)['dataset'] == {'written': 3, 'deleted': 0}
+
+    # Private datasets mirrored by a run are not deleted by others
+    assert run_mirror(not bulk)['dataset'] == {'written': 3, 'deleted': 0}
+
+    ckan.update_dataset(private['id'], {'title': 'Changed'})
+    assert run_mirror(bulk, incremental=True)['dataset']['deleted'] == 0
+    data = _read_sqlite(filename, 'dataset')
+    assert len(data) == 3
+    assert data[private['id']]['title'] == 'Changed'
+
+
+def test_cli_mirror_archive(fake_ckan, tmpdir):
+    datasets = _populate(fake_ckan.ckan, 3)
+    filename = str(tmpdir.join('mirror.tar.gz'))
+
+    app = CkanClientApp()
+    app.command_manager.add_command('mirror', Mirror)
+    assert app.run(['mirror', filename, '--url', fake_ckan.server_url,
+                    '--api-key', fake_ckan.api_key]) == 0
+
+    with tarfile.open(filename) as tar:
+        names = tar.getnames()
+        assert sorted(n for n in names if n.startswith('dataset/')) == \
+            sorted('dataset/' + d['id'] for d in datasets)
+        assert len(names) == 5
+
+
+def test_cli_mirror_archive_incremental(fake_ckan, tmpdir):
+    filename = str(tmpdir.join('mirror.tar.gz'))
+    app = CkanClientApp()
+    app.command_manager.add_command('mirror', Mirror)
+    assert app.run(['mirror', filename, '--incremental',
+                    '--url', fake_ckan.server_url]) != 0
+    assert not os.path.exists(filename)
+
+
+def test_mirror_import_directory(fake_ckan, tmpdir):
+    ckan = fake_ckan.ckan
+    group = ckan.create_group({'name': 'group-1'})
+    org = ckan.create_organization({'name': 'org-1'})
+    ckan.create_dataset({'name': 'dataset-1', 'groups': [group['id']],
+                         'owner_org': org['id']})
+    path = str(tmpdir.join('mirror'))
+
+    client = CkanLowlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+    CatalogMirror(client, open_store(path)).run()
+
+    # Groups and organizations are referenced by name
+    assert os.listdir(os.path.join(path, 'group')) == ['group-1']
+    assert os.listdir(os.path.join(path, 'organization')) == ['org-1']
+    dataset_file = os.listdir(os.path.join(path, 'dataset'))[0]
+    with open(os.path.join(path, 'dataset', dataset_file)) as fp:
+        dataset = json.load(fp)
+    assert dataset['groups'] == ['group-1']
+    assert dataset['owner_org'] == 'org-1'
+
+    # ..so that the mirror can be imported into another catalog
+    with FakeCkanServer() as target:
+        app = CkanClientApp()
+        app.command_manager.add_command('import_directory', ImportDirectory)
+        assert app.run(['import_directory', 'mirror', path,
+                        '--url', target.server_url,
+                        '--api-key', target.api_key]) == 0
+        imported = target.ckan.datasets.values()
+        assert [d['name'] for d in imported] == ['dataset-1']
+        target_group = target.ckan.show_group('group-1')
+        assert imported[0]['groups'] == [target_group['id']]
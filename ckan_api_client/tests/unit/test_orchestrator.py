@@ -0,0 +1,172 @@
+import json
+import time
+
+import pytest
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.syncing import SyncSources
+from ckan_api_client.hooks import RateLimitHook
+from ckan_api_client.orchestrator import MultiSourceSync, load_manifest
+from ckan_api_client.sources import DirectorySource
+from ckan_api_client.syncing import SynchronizationClient
+from ckan_api_client.tests.unit.test_syncing import make_data
+from ckan_api_client.tests.utils.catalog import CatalogGenerator
+
+
+def _write_sources(tmpdir, count):
+    sources = []
+    for i in xrange(count):
+        catalog = CatalogGenerator(datasets=5, organizations=1, groups=0,
+                                   seed=i)
+        # Sources need their own organizations and dataset names
+        data = catalog.get_data()
+        org = 'org-source-{0}'.format(i)
+        data['organization'] = {org: {'name': org, 'title': org}}
+        for dataset in data['dataset'].itervalues():
+            dataset['name'] = 'source-{0}-{1}'.format(i, dataset['name'])
+            dataset['owner_org'] = org
+        path = tmpdir.join('source-{0}'.format(i))
+        for obj_type, objects in data.iteritems():
+            for key, obj in objects.iteritems():
+                path.join(obj_type, key).write(json.dumps(obj), ensure=True)
+        path.join('group').ensure(dir=True)
+        sources.append({'name': 'source-{0}'.format(i),
+                        'path': path.basename})
+    manifest = tmpdir.join('manifest.json')
+    manifest.write(json.dumps({'sources': sources}))
+    return str(manifest)
+
+
+def test_load_manifest(tmpdir):
+    manifest = tmpdir.join('manifest.json')
+    manifest.write(json.dumps({'sources': [
+        {'name': 'a', 'path': 'a.sqlite'}, {'name': 'b', 'path': '/b'}]}))
+    assert load_manifest(str(manifest)) == [
+        ('a', str(tmpdir.join('a.sqlite'))), ('b', '/b')]
+
+    manifest.write(json.dumps({'sources': [
+        {'name': 'a', 'path': 'a'}, {'name': 'a', 'path': 'b'}]}))
+    with pytest.raises(ValueError):
+        load_manifest(str(manifest))
+
+
+def test_rate_limit_hook():
+    hook = RateLimitHook(100, burst=2)
+    start = time.time()
+    for _ in xrange(7):
+        hook.before_request(None)
+    # 2 requests at once, then one every 10 ms
+    assert 0.04 <= time.time() - start < 0.2
+
+
+def test_multi_source_sync(fake_ckan, tmpdir):
+    manifest = _write_sources(tmpdir, 3)
+    syncer = MultiSourceSync(fake_ckan.server_url, fake_ckan.api_key,
+                             workers=3)
+
+    reports = syncer.run(load_manifest(manifest))
+    assert sorted(reports) == ['source-0', 'source-1', 'source-2']
+    for report in reports.itervalues():
+        assert report.ok
+        assert report.get_count('dataset', 'create') == 5
+    assert len(fake_ckan.ckan.list_datasets()) == 15
+
+    # Ckan is crawled only once, for all the sources, in pages;
+    # crawled datasets are not retrieved again
+    searches = fake_ckan.count_requests(
+        'GET', '/api/3/action/package_search')
+    gets = fake_ckan.count_requests('GET', '/api/2/rest/dataset/{id}')
+    reports = syncer.run(load_manifest(manifest))
+    assert fake_ckan.count_requests(
+        'GET', '/api/3/action/package_search') == searches + 1
+    assert fake_ckan.count_requests(
+        'GET', '/api/2/rest/dataset/{id}') == gets
+    for report in reports.itervalues():
+        assert report.ok
+        assert report.get_count('dataset', 'create') == 0
+        assert report.get_count('dataset', 'update') == 0
+
+
+def test_multi_source_sync_streaming(fake_ckan, tmpdir, monkeypatch):
+    manifest = _write_sources(tmpdir, 2)
+    syncer = MultiSourceSync(fake_ckan.server_url, fake_ckan.api_key,
+                             workers=2)
+    syncer.run(load_manifest(manifest))
+
+    # Datasets are streamed, never loaded all at once
+    load_all = DirectorySource.load_all
+
+    def checked_load_all(self, obj_type):
+        assert obj_type != 'dataset'
+        return load_all(self, obj_type)
+
+    monkeypatch.setattr(DirectorySource, 'load_all', checked_load_all)
+
+    dataset_file = sorted(tmpdir.join('source-1', 'dataset').listdir())[0]
+    dataset = json.loads(dataset_file.read())
+    dataset['title'] = 'Changed title'
+    dataset_file.write(json.dumps(dataset))
+
+    # The crawled version is compared: the only dataset retrieved
+    # is the updated one, by update_dataset()
+    gets = fake_ckan.count_requests('GET', '/api/2/rest/dataset/{id}')
+    reports = syncer.run(load_manifest(manifest))
+    assert reports['source-1'].get_count('dataset', 'update') == 1
+    assert reports['source-0'].get_count('dataset', 'update') == 0
+    assert fake_ckan.count_requests(
+        'GET', '/api/2/rest/dataset/{id}') == gets + 1
+
+
+def test_multi_source_sync_concurrency(fake_ckan, tmpdir, monkeypatch):
+    manifest = _write_sources(tmpdir, 2)
+    syncer = MultiSourceSync(fake_ckan.server_url, fake_ckan.api_key,
+                             workers=2, concurrency=3, upsert_concurrency=1)
+
+    concurrency = []
+    sync_source = SynchronizationClient.sync_source
+
+    def checked_sync_source(self, *args, **kwargs):
+        concurrency.append(kwargs['concurrency'])
+        assert self._conf['upsert_concurrency'] == 1
+        return sync_source(self, *args, **kwargs)
+
+    monkeypatch.setattr(SynchronizationClient, 'sync_source',
+                        checked_sync_source)
+    reports = syncer.run(load_manifest(manifest))
+    assert all(report.ok for report in reports.itervalues())
+    assert concurrency == [3, 3]
+
+
+def test_crawl_sources_concurrent_deletes(fake_ckan, monkeypatch):
+    client = SynchronizationClient(fake_ckan.server_url, fake_ckan.api_key)
+    client.sync('test-source', make_data(6))
+    ckan = fake_ckan.ckan
+
+    # Delete the first dataset returned, once the first page is served
+    search_datasets = ckan.search_datasets
+    deleted = []
+
+    def concurrent_search(params):
+        result = search_datasets(params)
+        if not deleted:
+            deleted.append(result['results'][0]['id'])
+            ckan.delete_dataset(deleted[0])
+        return result
+
+    monkeypatch.setattr(ckan, 'search_datasets', concurrent_search)
+    crawled = client.crawl_sources(page_size=2)
+
+    # Datasets following the deleted one are not missed
+    assert len(deleted) == 1
+    assert sorted(crawled['test-source']) == sorted(make_data(6)['dataset'])
+
+
+def test_cli_sync_sources(fake_ckan, tmpdir):
+    manifest = _write_sources(tmpdir, 2)
+    app = CkanClientApp()
+    app.command_manager.add_command('sync_sources', SyncSources)
+    assert app.run(['sync_sources', manifest, '--rate-limit', '1000',
+                    '--concurrency', '2',
+                    '--url', fake_ckan.server_url,
+                    '--api-key', fake_ckan.api_key]) == 0
+    assert len(fake_ckan.ckan.list_datasets()) == 10
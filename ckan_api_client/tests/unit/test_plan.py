@@ -0,0 +1,108 @@
+"""Tests for synchronization plans (dry-run mode)"""
+
+from ckan_api_client.plan import SyncPlan, make_placeholder_id
+from ckan_api_client.tests.unit.test_syncing import (
+    make_client, make_data, get_source_ids)
+
+
+WRITE_CALLS = ('create_dataset', 'update_dataset', 'delete_dataset',
+               'create_group', 'update_group',
+               'create_organization', 'update_organization')
+
+
+def count_writes(stub):
+    return len([c for c in stub.calls if c[0] in WRITE_CALLS])
+
+
+def test_plan_first_import():
+    client = make_client()
+    stub = client._client
+    data = make_data(5)
+
+    plan = client.plan('test-source', data)
+    assert count_writes(stub) == 0
+
+    assert plan.datasets_to_create == sorted(data['dataset'])
+    assert plan.datasets_to_delete == []
+    assert plan.datasets_to_update == []
+    assert [g['action'] for g in plan.groups] == ['create', 'create']
+    assert plan.organizations[0]['ckan_id'] == \
+        make_placeholder_id('organization', 'org-1')
+
+    cost = plan.estimate_cost()
+    # GET + POST for each group / org, one POST per dataset
+    assert cost['http_calls'] == 3 * 2 + 5
+    assert cost['by_action']['create']['count'] == 5
+    assert cost['bytes_sent'] > 0
+
+    # Plans survive a round-trip through JSON
+    plan = SyncPlan.from_json(plan.to_json())
+
+    client.apply(plan)
+    assert get_source_ids(client) == sorted(data['dataset'])
+    org_id = stub.organizations.keys()[0]
+    for dataset in stub.datasets.itervalues():
+        assert dataset['owner_org'] == org_id
+        assert len(dataset['groups']) == 1
+        assert dataset['groups'][0] in stub.groups
+
+
+def test_plan_changes():
+    client = make_client()
+    stub = client._client
+    data = make_data(5)
+    client.sync('test-source', data)
+
+    # Nothing to do on re-sync
+    plan = client.plan('test-source', data)
+    assert plan.operations == []
+    assert all(g['action'] == 'none' for g in plan.groups)
+
+    del data['dataset']['ds-0']
+    data['dataset']['ds-1']['title'] = 'Changed title'
+    data['dataset']['ds-new'] = dict(data['dataset']['ds-2'],
+                                     name='dataset-new')
+
+    del stub.calls[:]
+    plan = client.plan('test-source', data)
+    assert count_writes(stub) == 0
+    assert plan.datasets_to_delete == ['ds-0']
+    assert plan.datasets_to_create == ['ds-new']
+    assert plan.datasets_to_update == ['ds-1']
+    assert plan.changes == {'ds-1': ['title']}
+
+    cost = plan.estimate_cost()
+    assert cost['by_action']['update']['http_calls'] == 2
+    assert cost['by_action']['delete']['http_calls'] == 1
+
+    client.apply(plan)
+    assert get_source_ids(client) == sorted(data['dataset'])
+    titles = set(ds['title'] for ds in stub.datasets.itervalues())
+    assert 'Changed title' in titles
+
+
+def test_plan_failures():
+    client = make_client()
+    client._conf['fail_fast'] = False
+    data = make_data(5)
+    report = client.sync('test-source', data)
+    report_data = report.to_json()
+
+    # Dataset referencing a missing group, and a broken group
+    data['dataset']['ds-1']['title'] = 'Changed title'
+    data['dataset']['ds-2']['groups'] = ['missing-group']
+    data['group']['group-3'] = {'name': 'mismatching-name'}
+
+    plan = client.plan('test-source', data)
+    assert sorted((f['action'], f['id']) for f in plan.failures) == [
+        ('group_upsert', 'group-3'), ('prepare', 'ds-2')]
+    assert plan.datasets_to_update == ['ds-1']
+    assert plan.datasets_to_delete == []
+    assert [g['name'] for g in plan.groups] == ['group-1', 'group-2']
+
+    # The report of the last run is left untouched
+    assert report.to_json() == report_data
+    assert client._report is report
+
+    plan = SyncPlan.from_json(plan.to_json())
+    assert len(plan.failures) == 2
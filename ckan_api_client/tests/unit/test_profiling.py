@@ -0,0 +1,51 @@
+"""Tests for the profiler and the --profile CLI option"""
+
+import pstats
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.client_hilev import ListDatasets
+from ckan_api_client.high_level import CkanHighlevelClient
+from ckan_api_client.objects import CkanDataset
+from ckan_api_client.profiling import Profiler
+from ckan_api_client.utils import iter_parallel
+
+
+def test_profiler_summary(fake_ckan):
+    client = CkanHighlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+
+    def create_datasets():
+        datasets = [CkanDataset({'name': 'dataset-{0}'.format(i)})
+                    for i in xrange(10)]
+        for result in iter_parallel(client.create_dataset, datasets, 2):
+            assert result.ok
+        return client.list_datasets()
+
+    profiler = Profiler()
+    assert len(profiler.runcall(create_datasets)) == 10
+
+    summary = profiler.get_summary()
+    assert summary['http'] > 0
+    assert summary['json'] > 0
+    assert summary['objects'] > 0
+    assert summary['total'] > 0
+    assert 'Object model' in profiler.format_summary()
+
+    # Functions running in the pool threads have been profiled too
+    functions = set(func for _, _, func in profiler.get_stats().stats)
+    assert 'create_dataset' in functions
+
+
+def test_cli_profile(fake_ckan, tmpdir, capsys):
+    filename = str(tmpdir.join('out.prof'))
+    fake_ckan.ckan.create_dataset({'name': 'dataset-1'})
+
+    app = CkanClientApp()
+    app.command_manager.add_command('list_datasets', ListDatasets)
+    assert app.run(['--profile', filename, 'list_datasets',
+                    '--url', fake_ckan.server_url,
+                    '--api-key', fake_ckan.api_key]) == 0
+
+    out, err = capsys.readouterr()
+    assert 'Profile written to {0}'.format(filename) in err
+    assert 'HTTP' in err
+    assert pstats.Stats(filename).total_calls > 0
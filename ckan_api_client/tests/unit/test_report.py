@@ -0,0 +1,113 @@
+"""Tests for synchronization reports"""
+
+import json
+
+from ckan_api_client.objects import CkanDataset
+from ckan_api_client.report import SyncReport
+from ckan_api_client.syncing import SynchronizationClient
+from ckan_api_client.tests.unit.test_syncing import (
+    make_client, make_data, get_source_ids)
+
+
+def test_sync_report():
+    client = make_client()
+    stub = client._client
+    data = make_data(10)
+
+    report = client.sync('test-source', data)
+    assert report.ok
+    assert report.counts == {
+        'dataset': {'create': 10},
+        'group': {'create': 2},
+        'organization': {'create': 1},
+    }
+    assert report.http['calls'] == len(stub.calls)
+    assert report.duration >= 0
+    assert all(report.timings[phase] >= 0 for phase in (
+        'upsert', 'crawl', 'diff', 'delete', 'create', 'update'))
+
+    # Make sure it can be serialized
+    data_out = json.loads(report.to_json())
+    assert data_out['counts']['dataset']['create'] == 10
+    assert SyncReport.from_dict(data_out).counts == report.counts
+
+    del data['dataset']['ds-0']
+    data['dataset']['ds-3']['title'] = 'Updated title'
+    report = client.sync('test-source', data)
+    assert report.counts == {
+        'dataset': {'delete': 1, 'update': 1},
+        'group': {'none': 2},
+        'organization': {'none': 1},
+    }
+
+
+def test_sync_report_renames():
+    client = make_client()
+    client._conf['dataset_name_preflight'] = False
+    stub = client._client
+    stub.create_dataset(CkanDataset({'name': 'dataset-1'}))
+
+    report = client.sync('test-source', make_data(3))
+    assert report.retries == 1
+    assert report.renames == 1
+
+
+def test_sync_report_http_retries(fake_ckan):
+    client = SynchronizationClient(fake_ckan.server_url, fake_ckan.api_key,
+                                   max_retries=2)
+    client._client._client.retry_delay = 0
+
+    # Requests failed with a 503 are retried by the low-level client
+    fake_ckan.fail_next(2)
+    report = client.sync('test-source', make_data(3))
+    assert report.ok
+    assert report.retries == 2
+    assert report.renames == 0
+
+
+def test_sync_report_failures():
+    client = make_client()
+    client._conf['fail_fast'] = False
+    stub = client._client
+    data = make_data(10)
+    client.sync('test-source', data)
+
+    original_update = stub.update_dataset
+
+    def failing_update(dataset, verify=None):
+        if dataset.title == 'Fail':
+            raise RuntimeError('Failed!')
+        return original_update(dataset, verify=verify)
+
+    stub.update_dataset = failing_update
+
+    data['dataset']['ds-2']['title'] = 'Fail'
+    data['dataset']['ds-3']['title'] = 'Updated title'
+    # Dataset referencing a missing group: must be left alone
+    data['dataset']['ds-4']['groups'] = ['missing-group']
+
+    report = client.sync('test-source', data)
+    assert not report.ok
+    assert sorted((f['action'], f['id']) for f in report.failures) == [
+        ('prepare', 'ds-4'), ('update', 'ds-2')]
+    assert report.failures[0]['error']
+    assert report.counts['dataset'] == {'update': 1}
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+
+def test_report_merge():
+    report = SyncReport('test-source')
+    other = SyncReport('test-source')
+    report.count('dataset', 'create', 3)
+    other.count('dataset', 'create', 2)
+    other.count('dataset', 'update')
+    other.add_timing('create', 1.5)
+    other.add_http_stats({'calls': 4, 'bytes_sent': 100})
+    other.add_failure('delete', 'ds-1', ValueError('Oops'))
+
+    report.merge(other)
+    assert report.counts == {'dataset': {'create': 5, 'update': 1}}
+    assert report.timings['create'] == 1.5
+    assert report.http['calls'] == 4
+    assert report.failures == [{'action': 'delete', 'id': 'ds-1',
+                                'error': 'ValueError: Oops'}]
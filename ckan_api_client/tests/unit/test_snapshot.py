@@ -0,0 +1,61 @@
+"""Tests for incremental crawling, using a local snapshot"""
+
+from ckan_api_client.snapshot import DatasetSnapshot
+from ckan_api_client.tests.unit.test_syncing import (
+    make_client, make_data, get_source_ids)
+
+
+def test_snapshot_refresh(tmpdir):
+    client = make_client()
+    stub = client._client
+    client.sync('test-source', make_data(10))
+
+    snapshot = DatasetSnapshot(str(tmpdir.join('snapshot.sqlite')))
+    assert snapshot.watermark is None
+    assert snapshot.refresh(stub) == (10, 0)
+    assert len(snapshot.list_ids()) == 10
+    assert snapshot.watermark == max(stub.modified.itervalues())
+
+    # Nothing changed: nothing fetched
+    del stub.calls[:]
+    assert snapshot.refresh(stub) == (0, 0)
+    assert stub.count_calls('get_dataset') == 0
+
+    # Change a dataset, delete another
+    ids = sorted(stub.datasets)
+    dataset = stub.get_dataset(ids[0])
+    dataset.title = 'Changed'
+    stub.update_dataset(dataset)
+    stub.delete_dataset(ids[1])
+
+    del stub.calls[:]
+    assert snapshot.refresh(stub) == (1, 1)
+    assert stub.count_calls('get_dataset') == 1
+    assert snapshot.get_dataset(ids[0]).title == 'Changed'
+    assert snapshot.get_dataset(ids[1]) is None
+
+
+def test_sync_with_snapshot(tmpdir):
+    client = make_client()
+    stub = client._client
+    client._snapshot = DatasetSnapshot(str(tmpdir.join('snapshot.sqlite')))
+
+    data = make_data(10)
+    client.sync('test-source', data)
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+    del data['dataset']['ds-0']
+    data['dataset']['ds-3']['title'] = 'Updated title'
+    del stub.calls[:]
+    client.sync('test-source', data)
+
+    # Only the datasets written in the previous run are fetched
+    assert stub.count_calls('get_dataset') == 10
+    assert stub.count_calls('update_dataset') == 1
+    assert stub.count_calls('delete_dataset') == 1
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+    del stub.calls[:]
+    client.sync('test-source', data)
+    assert stub.count_calls('get_dataset') == 1
+    assert stub.count_calls('update_dataset') == 0
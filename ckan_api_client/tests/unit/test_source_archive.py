@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from ckan_api_client.cli import CkanClientApp
+from ckan_api_client.commands.sources import ArchiveCreate, ArchiveExtract
+from ckan_api_client.commands.syncing import ImportArchive
+from ckan_api_client.sources import (
+    SourceArchive, SourceArchiveWriter, extract_archive, open_source)
+from ckan_api_client.tests.utils.catalog import CatalogGenerator
+
+
+def test_source_archive(tmpdir):
+    filename = str(tmpdir.join('source.ckanarc'))
+    with SourceArchiveWriter(filename) as writer:
+        writer.write('dataset', 'ds-1', {'name': 'dataset-1'})
+        writer.write('dataset', 'ds-2', {'name': 'dataset-2'})
+        writer.write('group', 'group-1', '{"name": "group-1"}')
+
+    with SourceArchive(filename) as archive:
+        assert sorted(archive.keys('dataset')) == ['ds-1', 'ds-2']
+        assert archive.get('dataset', 'ds-2') == {'name': 'dataset-2'}
+        assert str(archive.get_raw('group', 'group-1')) == \
+            '{"name": "group-1"}'
+        assert [key for key, _ in archive.iter_raw('dataset')] == \
+            ['ds-1', 'ds-2']
+        assert archive.load_all('organization') == {}
+        with pytest.raises(KeyError):
+            archive.get('dataset', 'ds-3')
+
+    # Appending supersedes existing objects
+    with SourceArchiveWriter(filename, append=True) as writer:
+        writer.write('dataset', 'ds-1', {'name': 'dataset-1-changed'})
+        writer.write('dataset', 'ds-3', {'name': 'dataset-3'})
+        writer.delete('dataset', 'ds-2')
+
+    with SourceArchive(filename) as archive:
+        assert archive.load_all('dataset') == {
+            'ds-1': {'name': 'dataset-1-changed'},
+            'ds-3': {'name': 'dataset-3'}}
+        assert archive.get('group', 'group-1') == {'name': 'group-1'}
+
+
+def test_source_archive_unicode(tmpdir):
+    filename = str(tmpdir.join('source.ckanarc'))
+    with SourceArchiveWriter(filename) as writer:
+        writer.write('dataset', 'ds-1', u'{"title": "Citt\xe0"}')
+        writer.write('dataset', 'ds-2', {'title': u'Citt\xe0'})
+
+    with SourceArchive(filename) as archive:
+        assert archive.get('dataset', 'ds-1') == {'title': u'Citt\xe0'}
+        assert archive.get('dataset', 'ds-2') == {'title': u'Citt\xe0'}
+
+
+@pytest.mark.parametrize('key', [
+    '../escaped', '/tmp/escaped', 'sub/dir', '..', ''])
+def test_extract_archive_unsafe_keys(tmpdir, key):
+    filename = str(tmpdir.join('source.ckanarc'))
+    with SourceArchiveWriter(filename) as writer:
+        writer.write('group', 'group-1', {'name': 'group-1'})
+        writer.write('dataset', key, {'name': 'dataset-1'})
+
+    destination = tmpdir.join('extracted')
+    with SourceArchive(filename) as archive:
+        with pytest.raises(ValueError):
+            extract_archive(archive, str(destination))
+    assert not destination.check()
+    assert not tmpdir.join('escaped').check()
+
+
+def test_source_archive_invalid(tmpdir):
+    for content in ('', 'something else', 'CKANSRC1 truncated'):
+        tmpdir.join('invalid').write(content)
+        with pytest.raises(ValueError):
+            SourceArchive(str(tmpdir.join('invalid')))
+
+
+def test_archive_commands(fake_ckan, tmpdir):
+    catalog = CatalogGenerator(datasets=10, organizations=2, groups=3)
+    directory = str(tmpdir.join('source'))
+    catalog.write_directory(directory)
+    expected = json.loads(json.dumps(catalog.get_data()))
+
+    app = CkanClientApp()
+    app.command_manager.add_command('archive_create', ArchiveCreate)
+    app.command_manager.add_command('archive_extract', ArchiveExtract)
+    app.command_manager.add_command('import_archive', ImportArchive)
+
+    # directory -> archive -> SQLite -> archive -> directory
+    archive = str(tmpdir.join('source.ckanarc'))
+    database = str(tmpdir.join('source.sqlite'))
+    archive2 = str(tmpdir.join('source2.ckanarc'))
+    directory2 = str(tmpdir.join('source2'))
+    assert app.run(['archive_create', directory, archive]) == 0
+    assert app.run(['archive_extract', archive, database]) == 0
+    assert app.run(['archive_create', database, archive2]) == 0
+    assert app.run(['archive_extract', archive2, directory2]) == 0
+
+    for path in (archive, database, archive2, directory2):
+        source = open_source(path)
+        for obj_type in ('dataset', 'group', 'organization'):
+            assert source.load_all(obj_type) == expected[obj_type]
+        source.close()
+
+    assert app.run(['import_archive', 'test-source', archive,
+                    '--url', fake_ckan.server_url,
+                    '--api-key', fake_ckan.api_key]) == 0
+    assert sorted(d['name'] for d in fake_ckan.ckan.datasets.values()) == \
+        sorted(d['name'] for d in expected['dataset'].values())
@@ -0,0 +1,429 @@
+"""Tests for the synchronization client, against an in-memory client"""
+
+from ckan_api_client.syncing import SynchronizationClient
+from ckan_api_client.tests.utils.stub_client import StubHighlevelClient
+
+
+def make_data(dataset_count=10):
+    data = {
+        'group': {
+            'group-1': {'name': 'group-1', 'title': 'Group 1'},
+            'group-2': {'name': 'group-2', 'title': 'Group 2'},
+        },
+        'organization': {
+            'org-1': {'name': 'org-1', 'title': 'Organization 1'},
+        },
+        'dataset': {},
+    }
+    for i in xrange(dataset_count):
+        data['dataset']['ds-{0}'.format(i)] = {
+            'name': 'dataset-{0}'.format(i),
+            'title': 'Dataset {0}'.format(i),
+            'groups': ['group-{0}'.format(i % 2 + 1)],
+            'owner_org': 'org-1',
+            'extras': {'index': str(i)},
+            'resources': [{'url': 'http://example.com/{0}'.format(i)}],
+        }
+    return data
+
+
+def make_client():
+    client = SynchronizationClient('http://127.0.0.1:5000')
+    client._client = StubHighlevelClient()
+    return client
+
+
+def get_source_ids(client):
+    return sorted(
+        ds['extras']['_harvest_source'].split(':')[1]
+        for ds in client._client.datasets.itervalues()
+        if '_harvest_source' in ds['extras'])
+
+
+def test_sync():
+    client = make_client()
+    data = make_data(10)
+    client.sync('test-source', data)
+
+    stub = client._client
+    assert len(stub.datasets) == 10
+    assert len(stub.groups) == 2
+    assert len(stub.organizations) == 1
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+    del data['dataset']['ds-0']
+    data['dataset']['ds-3']['title'] = 'Updated title'
+    client.sync('test-source', data)
+    assert len(stub.datasets) == 9
+    titles = set(ds['title'] for ds in stub.datasets.itervalues())
+    assert 'Updated title' in titles
+
+
+def test_sync_stream():
+    client = make_client()
+    data = make_data(25)
+    stub = client._client
+
+    client.sync_stream(
+        'test-source', data['dataset'].iteritems(),
+        groups=data['group'], organizations=data['organization'],
+        chunk_size=10)
+    assert len(stub.datasets) == 25
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+    # Remove some datasets, rename another so that it takes
+    # the name of a deleted one
+    del data['dataset']['ds-0']
+    del data['dataset']['ds-1']
+    data['dataset']['ds-new'] = dict(data['dataset']['ds-2'],
+                                     name='dataset-1')
+    client.sync_stream(
+        'test-source', data['dataset'].iteritems(),
+        groups=data['group'], organizations=data['organization'],
+        chunk_size=10)
+
+    assert get_source_ids(client) == sorted(data['dataset'])
+    names = sorted(ds['name'] for ds in stub.datasets.itervalues())
+    # The conflicting dataset was created after the deletion
+    assert 'dataset-1' in names
+    assert 'dataset-0' not in names
+
+
+def test_sync_stream_partial():
+    client = make_client()
+    data = make_data(10)
+    stub = client._client
+    client.sync('test-source', data)
+
+    # Only pass changed datasets, along with the full list of ids
+    changed = {'ds-5': dict(data['dataset']['ds-5'], title='Changed')}
+    source_ids = set(data['dataset']) - set(['ds-9'])
+    del stub.calls[:]
+    client.sync_stream(
+        'test-source', changed.iteritems(),
+        groups=data['group'], organizations=data['organization'],
+        source_ids=source_ids)
+
+    assert stub.count_calls('update_dataset') == 1
+    assert stub.count_calls('delete_dataset') == 1
+    assert stub.count_calls('create_dataset') == 0
+    assert get_source_ids(client) == sorted(source_ids)
+
+
+def test_sync_resume_from_journal(tmpdir):
+    from ckan_api_client.journal import SyncJournal
+
+    client = make_client()
+    stub = client._client
+    journal = SyncJournal(str(tmpdir.join('journal.sqlite')))
+    data = make_data(10)
+
+    # Make the client "crash" after creating 4 datasets
+    original_create = stub.create_dataset
+
+    def failing_create(dataset, verify=None):
+        if stub.count_calls('create_dataset') >= 4:
+            raise RuntimeError('Crashed!')
+        return original_create(dataset, verify=verify)
+
+    stub.create_dataset = failing_create
+
+    try:
+        client.sync('test-source', data, journal=journal, run_id='run-1')
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("Synchronization should have failed")
+
+    assert len(stub.datasets) == 4
+    assert journal.find_unfinished_run('test-source') == 'run-1'
+
+    # Resume the run: no crawling / diffing, only remaining creates
+    stub.create_dataset = original_create
+    del stub.calls[:]
+    client.sync('test-source', data, journal=journal, resume=True)
+
+    assert stub.count_calls('list_datasets') == 0
+    assert stub.count_calls('get_group_by_name') == 0
+    # The dataset being created when crashing is looked up by name
+    assert stub.count_calls('get_dataset_by_name') == 1
+    assert stub.count_calls('create_dataset') == 6
+    assert len(stub.datasets) == 10
+    assert get_source_ids(client) == sorted(data['dataset'])
+    assert journal.find_unfinished_run('test-source') is None
+
+    # A new run is planned from scratch
+    del stub.calls[:]
+    client.sync('test-source', data, journal=journal)
+    assert stub.count_calls('list_datasets') == 1
+    assert stub.count_calls('create_dataset') == 0
+
+
+def test_sync_after_failed_journaled_run(tmpdir):
+    from ckan_api_client.journal import SyncJournal
+
+    client = make_client()
+    client._conf['fail_fast'] = False
+    stub = client._client
+    journal = SyncJournal(str(tmpdir.join('journal.sqlite')))
+    data = make_data(5)
+
+    # A dataset that can never be created
+    original_create = stub.create_dataset
+
+    def failing_create(dataset, verify=None):
+        if dataset.name == 'dataset-3':
+            raise RuntimeError('Bad dataset')
+        return original_create(dataset, verify=verify)
+
+    stub.create_dataset = failing_create
+
+    report = client.sync('test-source', data, journal=journal)
+    assert not report.ok
+    assert journal.find_unfinished_run('test-source') is not None
+
+    # The next run sees the new data, instead of resuming
+    # the failed one
+    data['dataset']['ds-1']['title'] = 'Changed title'
+    data['dataset']['ds-5'] = dict(data['dataset']['ds-4'],
+                                   name='dataset-5')
+    report = client.sync('test-source', data, journal=journal)
+    assert report.get_count('dataset', 'update') == 1
+    assert report.get_count('dataset', 'create') == 1
+    assert len(report.failures) == 1
+    assert get_source_ids(client) == [
+        'ds-0', 'ds-1', 'ds-2', 'ds-4', 'ds-5']
+    titles = set(ds['title'] for ds in stub.datasets.itervalues())
+    assert 'Changed title' in titles
+
+    # Failed runs are abandoned when planning a new one
+    stub.create_dataset = original_create
+    report = client.sync('test-source', data, journal=journal)
+    assert report.ok
+    assert report.get_count('dataset', 'create') == 1
+    assert journal.find_unfinished_run('test-source') is None
+
+
+def test_sync_name_preflight():
+    from ckan_api_client.objects import CkanDataset
+
+    client = make_client()
+    stub = client._client
+
+    # Some names are already taken by datasets from elsewhere
+    for name in ('dataset-1', 'dataset-3'):
+        stub.create_dataset(CkanDataset({'name': name}))
+    data = make_data(5)
+
+    del stub.calls[:]
+    client.sync('test-source', data)
+
+    # Names were assigned beforehand: no conflicting requests
+    assert stub.count_calls('list_dataset_names') == 1
+    assert stub.count_calls('create_dataset') == 5
+    assert get_source_ids(client) == sorted(data['dataset'])
+    names = [ds['name'] for ds in stub.datasets.itervalues()]
+    assert len(set(names)) == len(names) == 7
+    assert names.count('dataset-0') == 1
+
+    # Without the pre-flight check, conflicts are resolved by retrying
+    client = make_client()
+    client._conf['dataset_name_preflight'] = False
+    stub = client._client
+    for name in ('dataset-1', 'dataset-3'):
+        stub.create_dataset(CkanDataset({'name': name}))
+
+    del stub.calls[:]
+    client.sync('test-source', data)
+    assert stub.count_calls('list_dataset_names') == 0
+    assert stub.count_calls('create_dataset') == 7
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+
+def test_get_shard():
+    from ckan_api_client.syncing import _get_shard
+
+    shards = [_get_shard('ds-{0}'.format(i), 4) for i in xrange(100)]
+    assert set(shards) == set([0, 1, 2, 3])
+    assert _get_shard(u'ds-1', 4) == _get_shard('ds-1', 4)
+
+
+def test_sync_sharded(monkeypatch):
+    from multiprocessing.pool import ThreadPool
+    from ckan_api_client import syncing
+
+    # Workers share the in-memory client, so we need threads
+    monkeypatch.setattr(syncing, 'Pool', ThreadPool)
+
+    client = make_client()
+    stub = client._client
+
+    def worker_init(klass, base_url, api_key, conf):
+        assert klass is SynchronizationClient
+        syncing._worker_state.client = make_client()
+        syncing._worker_state.client._client = stub
+
+    monkeypatch.setattr(syncing, '_shard_worker_init', worker_init)
+
+    data = make_data(20)
+    report = client.sync_sharded('test-source', data, workers=3)
+    assert report.counts['dataset'] == {'create': 20}
+    assert report.counts['group'] == {'create': 2}
+    assert report.ok
+    assert get_source_ids(client) == sorted(data['dataset'])
+    assert stub.count_calls('create_group') == 2
+
+    del data['dataset']['ds-0']
+    data['dataset']['ds-3']['title'] = 'Updated title'
+    report = client.sync_sharded('test-source', data, workers=3)
+    assert report.counts['dataset'] == {'delete': 1, 'update': 1}
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+    # New datasets with the same name, landing in different shards,
+    # are given distinct names by the parent process
+    for i in xrange(6):
+        data['dataset']['ds-new-{0}'.format(i)] = dict(
+            data['dataset']['ds-1'], name='dataset-1')
+    del stub.calls[:]
+    report = client.sync_sharded('test-source', data, workers=3)
+    assert report.counts['dataset'] == {'create': 6}
+    assert report.renames == 6
+    assert stub.count_calls('list_dataset_names') == 1
+    names = [ds['name'] for ds in stub.datasets.itervalues()]
+    assert len(set(names)) == len(names)
+
+
+def test_sync_sharded_deleted_while_crawling(monkeypatch):
+    from multiprocessing.pool import ThreadPool
+    from ckan_api_client import syncing
+
+    monkeypatch.setattr(syncing, 'Pool', ThreadPool)
+
+    client = make_client()
+    stub = client._client
+    data = make_data(10)
+    client.sync('test-source', data)
+
+    def worker_init(klass, base_url, api_key, conf):
+        syncing._worker_state.client = make_client()
+        syncing._worker_state.client._client = stub
+
+    monkeypatch.setattr(syncing, '_shard_worker_init', worker_init)
+
+    # A dataset is deleted right after the ids are listed
+    original_list = stub.list_datasets
+
+    def list_datasets():
+        ids = original_list()
+        stub.delete_dataset(ids[0])
+        return ids
+
+    stub.list_datasets = list_datasets
+    del data['dataset']['ds-2']
+    report = client.sync_sharded('test-source', data, workers=3)
+    assert report.ok
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+
+def test_upsert_groups_and_organizations_parallel():
+    import threading
+    import time
+
+    client = make_client()
+    stub = client._client
+    client._conf['upsert_concurrency'] = 5
+
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    original_get = stub.get_group_by_name
+
+    def slow_get(name, allow_deleted=False):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(.02)
+        with lock:
+            running[0] -= 1
+        return original_get(name, allow_deleted=allow_deleted)
+
+    stub.get_group_by_name = slow_get
+
+    groups = dict(('group-{0}'.format(i), {'title': 'Group {0}'.format(i)})
+                  for i in xrange(20))
+    orgs = dict(('org-{0}'.format(i), {'title': 'Org {0}'.format(i)})
+                for i in xrange(10))
+    groups_map, orgs_map = client._upsert_groups_and_organizations(
+        groups, orgs)
+
+    assert max_running[0] > 1
+    assert len(stub.groups) == 20
+    assert len(stub.organizations) == 10
+    for group_id, group in stub.groups.iteritems():
+        assert groups_map.to_ckan(group['name']) == group_id
+    for org_id, org in stub.organizations.iteritems():
+        assert orgs_map.to_ckan(org['name']) == org_id
+
+
+def test_upsert_failure():
+    import pytest
+
+    client = make_client()
+    stub = client._client
+
+    def failing_create(group, verify=None):
+        if group.name == 'group-3':
+            raise RuntimeError('Failed!')
+        return StubHighlevelClient.create_group(stub, group)
+
+    stub.create_group = failing_create
+    groups = dict(('group-{0}'.format(i), {}) for i in xrange(6))
+
+    with pytest.raises(RuntimeError):
+        client._upsert_groups_and_organizations(groups, {})
+
+    # Other upserts were completed anyways
+    assert len(stub.groups) == 5
+
+
+def test_sync_pipelined():
+    import time
+
+    client = make_client()
+    stub = client._client
+    data = make_data(20)
+
+    client.sync_pipelined('test-source', data)
+    assert get_source_ids(client) == sorted(data['dataset'])
+
+    # Slow down the crawl, to make sure updates happen meanwhile
+    original_get = stub.get_dataset
+
+    def slow_get(id, allow_deleted=False):
+        time.sleep(.01)
+        return original_get(id, allow_deleted=allow_deleted)
+
+    stub.get_dataset = slow_get
+
+    for i in xrange(5, 20):
+        data['dataset']['ds-{0}'.format(i)]['title'] = 'Changed'
+    del data['dataset']['ds-0']
+    del data['dataset']['ds-1']
+    data['dataset']['ds-new'] = dict(data['dataset']['ds-2'],
+                                     name='dataset-1')
+
+    del stub.calls[:]
+    client.sync_pipelined('test-source', data)
+
+    assert get_source_ids(client) == sorted(data['dataset'])
+    assert stub.count_calls('update_dataset') == 15
+    assert stub.count_calls('delete_dataset') == 2
+    # The name of the deleted dataset was reused
+    assert stub.count_calls('create_dataset') == 1
+    names = sorted(ds['name'] for ds in stub.datasets.itervalues())
+    assert 'dataset-1' in names
+
+    calls = [c[0] for c in stub.calls]
+    first_update = calls.index('update_dataset')
+    last_get = len(calls) - calls[::-1].index('get_dataset')
+    assert first_update < last_get
@@ -0,0 +1,103 @@
+"""Tests for tracing spans"""
+
+import json
+from StringIO import StringIO
+
+import pytest
+
+from ckan_api_client import tracing
+from ckan_api_client.objects import CkanDataset
+from ckan_api_client.tests.unit.test_syncing import make_client, make_data
+
+
+@pytest.fixture
+def collector(request):
+    collector = tracing.enable()
+    request.addfinalizer(tracing.disable)
+    return collector
+
+
+def test_span_nesting(collector):
+    with tracing.span('outer', foo='bar') as outer:
+        assert tracing.current_span() is outer
+        with tracing.span('inner') as inner:
+            inner.set('answer', 42)
+        with pytest.raises(ValueError):
+            with tracing.span('failing'):
+                raise ValueError('Oops')
+    assert tracing.current_span() is None
+
+    spans = dict((span.name, span) for span in collector.spans)
+    assert [span.name for span in collector.spans] == [
+        'inner', 'failing', 'outer']
+    assert spans['outer'].parent_id is None
+    assert spans['outer'].attributes == {'foo': 'bar'}
+    assert spans['inner'].parent_id == outer.span_id
+    assert spans['inner'].trace_id == outer.trace_id
+    assert spans['inner'].attributes == {'answer': 42}
+    assert spans['failing'].error == 'ValueError: Oops'
+    assert all(span.duration >= 0 for span in collector.spans)
+
+
+def test_traced_decorator(collector):
+    class Client(object):
+        @tracing.traced('get')
+        def get(self, id):
+            return id
+
+        @tracing.traced('create')
+        def create(self, obj):
+            return obj
+
+    client = Client()
+    assert client.get('id-1') == 'id-1'
+    client.create(CkanDataset({'id': 'id-2', 'name': 'dataset-2'}))
+    get_span, create_span = collector.spans
+    assert get_span.attributes == {'id': 'id-1'}
+    assert create_span.attributes == {'id': 'id-2', 'name': 'dataset-2'}
+
+
+def test_tracing_disabled():
+    assert not tracing.is_enabled()
+    with tracing.span('something') as span:
+        span.set('key', 'value')
+        assert span is tracing.NULL_SPAN
+    assert tracing.current_span() is None
+
+
+def test_sync_spans(collector):
+    client = make_client()
+    data = make_data(5)
+    client.sync('test-source', data)
+
+    spans = collector.spans
+    by_id = dict((span.span_id, span) for span in spans)
+    root, = [span for span in spans if span.name == 'sync']
+    assert root.parent_id is None
+    assert root.attributes == {'source_name': 'test-source'}
+    assert all(span.trace_id == root.trace_id for span in spans)
+
+    creates = [span for span in spans if span.name == 'sync.create']
+    assert len(creates) == 5
+    assert all(by_id[span.parent_id] is root for span in creates)
+    upserts = [span for span in spans
+               if span.name.startswith('sync.upsert_')]
+    assert len(upserts) == 3
+
+    collector.clear()
+    data['dataset']['ds-2']['title'] = 'Updated title'
+    client.sync('test-source', data)
+    spans = collector.spans
+    by_id = dict((span.span_id, span) for span in spans)
+    comparisons = [span for span in spans if span.name == 'is_equivalent']
+    assert len(comparisons) == 5
+    assert all(by_id[span.parent_id].name == 'sync.diff'
+               for span in comparisons)
+    updates = [span for span in spans if span.name == 'sync.update']
+    assert len(updates) == 1
+
+    out = StringIO()
+    collector.dump_jsonl(out)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == len(spans)
+    assert all(json.loads(line)['trace_id'] for line in lines)
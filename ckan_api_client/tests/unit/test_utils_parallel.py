@@ -0,0 +1,73 @@
+"""Tests for the parallel execution utilities"""
+
+import itertools
+import threading
+import time
+
+from ckan_api_client.utils import iter_parallel
+
+
+def test_iter_parallel():
+    def square(x):
+        time.sleep(0.01)
+        return x * x
+
+    results = list(iter_parallel(square, xrange(20), concurrency=4))
+    assert len(results) == 20
+    assert all(r.ok for r in results)
+    assert sorted(r.index for r in results) == range(20)
+    assert all(r.result == r.item ** 2 for r in results)
+
+
+def test_iter_parallel_errors():
+    def func(x):
+        if x % 3 == 0:
+            raise ValueError("Bad item {0}".format(x))
+        return x
+
+    results = sorted(iter_parallel(func, xrange(10), concurrency=3))
+    failed = [r for r in results if not r.ok]
+    assert [r.item for r in failed] == [0, 3, 6, 9]
+    assert all(isinstance(r.error, ValueError) for r in failed)
+    assert all(r.result is None for r in failed)
+    assert [r.result for r in results if r.ok] == [1, 2, 4, 5, 7, 8]
+
+
+def test_iter_parallel_backpressure():
+    consumed = []
+    lock = threading.Lock()
+
+    def source():
+        for i in itertools.count():
+            with lock:
+                consumed.append(i)
+            yield i
+
+    gen = iter_parallel(lambda x: x, source(), concurrency=2,
+                        max_pending=4)
+    for _ in xrange(3):
+        next(gen)
+    gen.close()
+
+    # Items are taken from the input only as results are consumed
+    assert len(consumed) <= 3 + 4
+
+
+def test_idmap_concurrent_add():
+    import pickle
+    from ckan_api_client.utils import IDMap, IDPair
+
+    idmap = IDMap()
+    pairs = [IDPair(source_id='src-{0}'.format(i),
+                    ckan_id='ckan-{0}'.format(i))
+             for i in xrange(200)]
+    results = list(iter_parallel(idmap.add, pairs, concurrency=8))
+    assert all(r.ok for r in results)
+    for pair in pairs:
+        assert idmap.to_ckan(pair.source_id) == pair.ckan_id
+        assert idmap.to_source(pair.ckan_id) == pair.source_id
+
+    # Id maps need to be passed to worker processes
+    copied = pickle.loads(pickle.dumps(idmap))
+    assert copied.to_ckan('src-10') == 'ckan-10'
+    copied.add(IDPair(source_id='src-new', ckan_id='ckan-new'))
@@ -0,0 +1,107 @@
+"""Tests for the verification policies"""
+
+import pytest
+
+from ckan_api_client.exceptions import OperationFailure
+from ckan_api_client.high_level import CkanHighlevelClient
+from ckan_api_client.objects import CkanDataset
+from ckan_api_client.verification import (
+    VerificationPolicy, BackgroundVerifier, object_fingerprint)
+
+
+def test_verification_policy_modes():
+    assert VerificationPolicy.get(None).mode == 'full'
+    assert VerificationPolicy.get('off').mode == 'off'
+
+    policy = VerificationPolicy('fingerprint')
+    assert VerificationPolicy.get(policy) is policy
+
+    with pytest.raises(ValueError):
+        VerificationPolicy('something')
+
+    assert all(VerificationPolicy('full').should_verify()
+               for _ in xrange(10))
+    assert not any(VerificationPolicy('off').should_verify()
+                   for _ in xrange(10))
+
+
+def test_verification_policy_sampled():
+    policy = VerificationPolicy('sampled', sample_rate=5)
+    results = [policy.should_verify() for _ in xrange(20)]
+    assert results.count(True) == 4
+    assert results[0] is True
+    assert results[5] is True
+
+
+def test_object_fingerprint():
+    dataset1 = CkanDataset({
+        'id': 'dataset-1',
+        'name': 'my-dataset',
+        'extras': {'one': 'A', 'two': None},
+        'resources': [{'url': 'http://example.com/1'}],
+    })
+    dataset2 = CkanDataset({
+        'id': 'dataset-2',
+        'name': 'my-dataset',
+        'extras': {'one': 'B'},
+        'resources': [{'url': 'http://example.com/2'}],
+    })
+
+    # Keys are ignored, containers are compared by size only
+    assert object_fingerprint(dataset1) == object_fingerprint(dataset2)
+
+    dataset2.name = 'another-dataset'
+    assert object_fingerprint(dataset1) != object_fingerprint(dataset2)
+
+    policy = VerificationPolicy('fingerprint')
+    assert not policy.check(dataset1, dataset2)
+    del dataset2.name
+    assert policy.check(dataset1, dataset2)
+    assert not VerificationPolicy('full').check(dataset1, dataset2)
+
+
+def test_background_verifier():
+    mismatches = []
+
+    def on_mismatch(message, expected, actual):
+        mismatches.append((message, expected, actual))
+        raise OperationFailure(message)
+
+    verifier = BackgroundVerifier(on_mismatch)
+    policy = VerificationPolicy('full', background=True)
+
+    verifier.submit(policy, 'should match',
+                    (CkanDataset, {'name': 'dataset-1'}),
+                    (CkanDataset, {'id': 'id-1', 'name': 'dataset-1'}))
+    verifier.submit(policy, 'should not match',
+                    (CkanDataset, {'name': 'dataset-2'}),
+                    (CkanDataset, {'id': 'id-2', 'name': 'dataset-X'}))
+
+    with pytest.raises(OperationFailure):
+        verifier.wait()
+
+    assert len(mismatches) == 1
+    assert mismatches[0][0] == 'should not match'
+    assert isinstance(mismatches[0][2], CkanDataset)
+    assert mismatches[0][2].name == 'dataset-X'
+
+    # Failures are reported only once
+    verifier.wait()
+
+
+def test_sampled_verification_across_calls(fake_ckan, monkeypatch):
+    client = CkanHighlevelClient(fake_ckan.server_url, fake_ckan.api_key)
+    checked = []
+    original_check = VerificationPolicy.check
+
+    def check(policy, expected, actual):
+        checked.append(actual.name)
+        return original_check(policy, expected, actual)
+
+    monkeypatch.setattr(VerificationPolicy, 'check', check)
+    for i in xrange(20):
+        client.save_dataset(CkanDataset({'name': 'dataset-{0}'.format(i)}),
+                            verify='sampled')
+
+    # The default sample rate is one write every 10
+    assert checked == ['dataset-0', 'dataset-10']
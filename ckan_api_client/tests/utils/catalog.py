@@ -0,0 +1,306 @@
+"""
+Generator of large synthetic catalogs, for load testing.
+
+Unlike :py:mod:`.generate`, the output is deterministic (given
+a seed), datasets are generated one at a time (so even huge catalogs
+can be streamed to disk), and the catalog can "evolve" day by day,
+with a fixed share of datasets updated, deleted and created each day::
+
+    catalog = CatalogGenerator(datasets=100000, seed=42)
+    catalog.write_directory('/tmp/catalog-day-00')
+    catalog.write_sqlite('/tmp/catalog-day-01.sqlite', day=1)
+    catalog.get_changes(1)  # {'created': [..], 'updated': .., ..}
+
+Output can be imported with the ``import_directory`` and
+``import_sqlite`` commands.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+
+
+class CatalogGenerator(object):
+    """
+    Deterministic generator of a synthetic catalog.
+
+    Ranges are ``(min, max)`` tuples (inclusive), values being
+    picked uniformly at random for each dataset.
+    """
+
+    def __init__(self, datasets=1000, organizations=10, groups=20,
+                 resources=(1, 5), extras=(0, 20), extra_size=30,
+                 tags=(0, 10), tag_cardinality=200,
+                 groups_per_dataset=(0, 3), update_rate=0.05,
+                 delete_rate=0.025, create_rate=0.025, seed=0):
+        """
+        :param datasets: number of datasets on day 0
+        :param organizations: number of organizations
+        :param groups: number of groups
+        :param resources: range of resources per dataset
+        :param extras: range of extras per dataset
+        :param extra_size: length of extras values
+        :param tags: range of tags per dataset
+        :param tag_cardinality: number of distinct tags
+        :param groups_per_dataset: range of groups per dataset
+        :param update_rate:
+            fraction of the datasets updated each day
+        :param delete_rate:
+            fraction of the datasets deleted each day
+        :param create_rate:
+            number of datasets created each day, as a fraction
+            of the initial ones
+        :param seed: random seed
+        """
+
+        self.datasets = datasets
+        self.organizations = organizations
+        self.groups = groups
+        self.resources = resources
+        self.extras = extras
+        self.extra_size = extra_size
+        self.tags = tags
+        self.tag_cardinality = tag_cardinality
+        self.groups_per_dataset = groups_per_dataset
+        self.update_rate = update_rate
+        self.delete_rate = delete_rate
+        self.create_rate = create_rate
+        self.seed = seed
+
+        # Changes for each day (index 0 is the initial state)
+        self._days = [{'created': (0, datasets),
+                       'updated': frozenset(),
+                       'deleted': frozenset()}]
+        self._alive = set(xrange(datasets))
+
+    def _random(self, *args):
+        # Not seeding with strings, as they're hashed with hash()
+        key = '-'.join(str(x) for x in (self.seed,) + args)
+        return random.Random(int(hashlib.md5(key).hexdigest(), 16))
+
+    # ------------------------------------------------------------
+    # Groups and organizations
+
+    def iter_organizations(self):
+        """Generate ``(name, organization)`` tuples"""
+        for i in xrange(self.organizations):
+            name = 'org-{0:04d}'.format(i)
+            yield name, {
+                'name': name,
+                'title': 'Organization {0}'.format(i),
+                'description': 'Description of organization {0}'.format(i),
+            }
+
+    def iter_groups(self):
+        """Generate ``(name, group)`` tuples"""
+        for i in xrange(self.groups):
+            name = 'group-{0:04d}'.format(i)
+            yield name, {
+                'name': name,
+                'title': 'Group {0}'.format(i),
+                'description': 'Description of group {0}'.format(i),
+            }
+
+    # ------------------------------------------------------------
+    # Datasets
+
+    def _compute_days(self, day):
+        """Compute the changes up to a given day"""
+        while len(self._days) <= day:
+            current = len(self._days)
+            rnd = self._random('day', current)
+            alive = sorted(self._alive)
+
+            deleted = frozenset(rnd.sample(
+                alive, int(len(alive) * self.delete_rate)))
+            remaining = [i for i in alive if i not in deleted]
+            updated = frozenset(rnd.sample(
+                remaining, int(len(alive) * self.update_rate)))
+
+            first_new = self._days[-1]['created'][1]
+            created = (first_new,
+                       first_new + int(self.datasets * self.create_rate))
+
+            self._days.append({'created': created, 'updated': updated,
+                               'deleted': deleted})
+            self._alive -= deleted
+            self._alive.update(xrange(*created))
+
+    def _iter_alive(self, day):
+        self._compute_days(day)
+        last_created = self._days[day]['created'][1]
+        deleted = set()
+        for changes in self._days[1:day + 1]:
+            deleted.update(changes['deleted'])
+        for index in xrange(last_created):
+            if index not in deleted:
+                yield index
+
+    def get_key(self, index):
+        """Source id of the dataset with the given index"""
+        return 'ds-{0:07d}'.format(index)
+
+    def get_dataset(self, index, day=0):
+        """
+        Generate a dataset, as it is on a given day.
+
+        Each update changes the title, an extra and the URL
+        of one of the resources.
+        """
+
+        self._compute_days(day)
+        rnd = self._random('dataset', index)
+        key = self.get_key(index)
+        tags = set(
+            'tag-{0:04d}'.format(rnd.randrange(self.tag_cardinality))
+            for _ in xrange(rnd.randint(*self.tags)))
+        group_count = min(self.groups, rnd.randint(*self.groups_per_dataset))
+
+        dataset = {
+            'id': key,
+            'name': 'dataset-{0:07d}'.format(index),
+            'title': 'Dataset {0}'.format(index),
+            'notes': 'Description of **dataset** {0}'.format(index),
+            'url': 'http://example.com/dataset/{0}'.format(index),
+            'author': 'Author {0}'.format(index),
+            'author_email': 'author-{0}@example.com'.format(index),
+            'license_id': rnd.choice(('cc-by', 'cc-zero', 'odc-odbl')),
+            'owner_org': 'org-{0:04d}'.format(
+                rnd.randrange(self.organizations)),
+            'groups': ['group-{0:04d}'.format(i) for i in
+                       sorted(rnd.sample(xrange(self.groups), group_count))],
+            'tags': sorted(tags),
+            'extras': dict(
+                ('key-{0:03d}'.format(i), '{0:0{1}x}'.format(
+                    rnd.getrandbits(4 * self.extra_size), self.extra_size))
+                for i in xrange(rnd.randint(*self.extras))),
+            'resources': [
+                {'name': 'Resource {0}'.format(i),
+                 'description': 'Resource {0} of dataset {1}'.format(
+                     i, index),
+                 'format': rnd.choice(('CSV', 'JSON', 'XML')),
+                 'url': 'http://example.com/dataset/{0}/{1}'.format(
+                     index, i)}
+                for i in xrange(rnd.randint(*self.resources))],
+        }
+
+        revision = sum(1 for changes in self._days[1:day + 1]
+                       if index in changes['updated'])
+        if revision:
+            dataset['title'] += ' (revision {0})'.format(revision)
+            dataset['extras']['revision'] = str(revision)
+            if dataset['resources']:
+                dataset['resources'][0]['url'] += '?rev={0}'.format(revision)
+
+        return dataset
+
+    def iter_datasets(self, day=0):
+        """Generate ``(key, dataset)`` tuples for a given day"""
+        for index in self._iter_alive(day):
+            yield self.get_key(index), self.get_dataset(index, day)
+
+    def get_changes(self, day):
+        """
+        Get the changes made on a given day (``day >= 1``).
+
+        :return: a dict with lists of the ``created``, ``updated``
+            and ``deleted`` dataset keys.
+        """
+
+        self._compute_days(day)
+        changes = self._days[day]
+        return {
+            'created': [self.get_key(i) for i in xrange(*changes['created'])],
+            'updated': [self.get_key(i) for i in sorted(changes['updated'])],
+            'deleted': [self.get_key(i) for i in sorted(changes['deleted'])],
+        }
+
+    # ------------------------------------------------------------
+    # Output
+
+    def get_data(self, day=0):
+        """
+        Return the whole catalog in the format accepted by
+        :py:meth:`SynchronizationClient.sync()
+        <ckan_api_client.syncing.SynchronizationClient.sync>`.
+        """
+        return {
+            'dataset': dict(self.iter_datasets(day)),
+            'group': dict(self.iter_groups()),
+            'organization': dict(self.iter_organizations()),
+        }
+
+    def _iter_all(self, day):
+        for key, obj in self.iter_datasets(day):
+            yield 'dataset', key, obj
+        for key, obj in self.iter_groups():
+            yield 'group', key, obj
+        for key, obj in self.iter_organizations():
+            yield 'organization', key, obj
+
+    def write_directory(self, path, day=0):
+        """
+        Write the catalog to a directory, in the layout read
+        by the ``import_directory`` command.
+        """
+        for obj_type in ('dataset', 'group', 'organization'):
+            dirname = os.path.join(path, obj_type)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+        for obj_type, key, obj in self._iter_all(day):
+            with open(os.path.join(path, obj_type, key), 'w') as fp:
+                json.dump(obj, fp, sort_keys=True)
+
+    def write_sqlite(self, filename, day=0):
+        """
+        Write the catalog to a SQLite database, in the format
+        read by the ``import_sqlite`` command. Existing tables
+        are replaced.
+        """
+        db = sqlite3.connect(filename)
+        try:
+            for obj_type in ('dataset', 'group', 'organization'):
+                db.execute('DROP TABLE IF EXISTS "{0}"'.format(obj_type))
+                db.execute('CREATE TABLE "{0}" (id TEXT PRIMARY KEY, '
+                           'json_data TEXT)'.format(obj_type))
+            for obj_type, key, obj in self._iter_all(day):
+                db.execute(
+                    'INSERT INTO "{0}" (id, json_data) VALUES (?, ?)'
+                    .format(obj_type), (key, json.dumps(obj)))
+            db.commit()
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic catalog')
+    parser.add_argument('output',
+                        help='Output directory (or SQLite file)')
+    parser.add_argument('--format', choices=('directory', 'sqlite'),
+                        default='directory')
+    parser.add_argument('--datasets', type=int, default=1000)
+    parser.add_argument('--organizations', type=int, default=10)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--day', type=int, default=0,
+                        help='Generate the catalog as of this day')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--changes', action='store_true',
+                        help='Also print the changes of the day, as JSON')
+    args = parser.parse_args()
+
+    catalog = CatalogGenerator(
+        datasets=args.datasets, organizations=args.organizations,
+        groups=args.groups, seed=args.seed)
+    if args.format == 'sqlite':
+        catalog.write_sqlite(args.output, day=args.day)
+    else:
+        catalog.write_directory(args.output, day=args.day)
+    if args.changes and args.day > 0:
+        print(json.dumps(catalog.get_changes(args.day), indent=2))
@@ -0,0 +1,757 @@
+"""
+Lightweight, in-process stand-in for a Ckan instance, used to run
+the clients (and benchmark them) without a real Ckan installation.
+
+It implements the subset of the API v2 REST and API v3 action
+endpoints used by :py:class:`CkanLowlevelClient
+<ckan_api_client.low_level.CkanLowlevelClient>`, keeping objects
+in memory, and can simulate latency, failures and throttling::
+
+    server = FakeCkanServer(latency=0.01, error_rate=0.05, seed=42)
+    server.start()
+    client = CkanHighlevelClient(server.server_url, server.api_key)
+    ...
+    server.stop()
+
+.. note::
+    Only the behavior the clients rely upon is reproduced;
+    validation, authorization and search are extremely simplified.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import copy
+import datetime
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urlparse
+import uuid
+
+from ckan_api_client.hooks import get_path_template
+
+
+logger = logging.getLogger(__name__)
+
+
+NAME_RE = re.compile(r'^[a-z0-9_-]{2,100}$')
+MODIFIED_FQ_RE = re.compile(
+    r'^metadata_modified:\[(?P<since>\S+) TO \*\]$')
+
+DATASET_DEFAULTS = {
+    'author': '',
+    'author_email': '',
+    'license_id': '',
+    'maintainer': '',
+    'maintainer_email': '',
+    'notes': '',
+    'owner_org': '',
+    'private': False,
+    'state': 'active',
+    'title': '',
+    'type': 'dataset',
+    'url': '',
+}
+
+RESOURCE_DEFAULTS = {
+    'description': '',
+    'format': '',
+    'mimetype': None,
+    'mimetype_inner': None,
+    'name': '',
+    'resource_type': '',
+    'size': None,
+    'url': '',
+    'url_type': None,
+}
+
+GROUP_DEFAULTS = {
+    'approval_status': 'approved',
+    'description': '',
+    'image_url': '',
+    'state': 'active',
+    'title': '',
+}
+
+LICENSES = [
+    {'id': 'cc-by', 'title': 'Creative Commons Attribution'},
+    {'id': 'cc-zero', 'title': 'Creative Commons CCZero'},
+    {'id': 'odc-odbl', 'title': 'Open Data Commons Open Database License'},
+    {'id': 'other-closed', 'title': 'Other (Not Open)'},
+]
+
+# API v3 actions requiring authorization
+WRITE_ACTIONS = ('_create', '_update', '_delete', '_purge')
+
+
+class FakeCkanError(Exception):
+    """Error to be returned as an API error response"""
+
+    def __init__(self, status, type, message):
+        super(FakeCkanError, self).__init__(status, type, message)
+        self.status = status
+        self.type = type
+        self.message = message
+
+    def to_dict(self):
+        return {'__type': self.type, 'message': self.message}
+
+
+def _not_found():
+    return FakeCkanError(404, 'Not Found Error', 'Not found')
+
+
+def _validation_error(message):
+    return FakeCkanError(409, 'Validation Error', message)
+
+
+def _select_fields(dataset, fields):
+    """Pick search index fields from a dataset, like Solr ``fl``"""
+    result = {}
+    for field in fields:
+        if field.startswith('extras_'):
+            value = dataset['extras'].get(field[len('extras_'):])
+        else:
+            value = dataset.get(field)
+        if value is not None:
+            result[field] = value
+    return result
+
+
+class FakeCkan(object):
+    """
+    In-memory Ckan "database", with API request dispatching.
+
+    Groups and organizations share the same store, as they
+    do in Ckan (and so their names must be unique together).
+    Deleting objects only marks them as deleted, except for
+    the ``*_purge`` actions.
+    """
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self.datasets = {}
+        self.groups = {}
+        # Name -> id indexes of the two stores above
+        self._dataset_names = {}
+        self._group_names = {}
+        self._lock = threading.RLock()
+        self._last_modified = None
+
+    # ------------------------------------------------------------
+    # Request dispatching
+
+    def handle(self, method, path, headers=None, body=''):
+        """
+        Handle an API request.
+
+        :param method: HTTP method
+        :param path: request path, including the query string
+        :param headers: dict-like of request headers
+        :param body: request body
+        :return: a ``(status, response_data)`` tuple
+        """
+
+        headers = headers or {}
+        method = method.upper()
+        path, _, query = path.partition('?')
+        parts = [p for p in path.split('/') if p]
+
+        is_v3 = parts[:3] == ['api', '3', 'action']
+        try:
+            data = self._parse_body(body)
+            if parts[:3] == ['api', '2', 'rest'] and len(parts) in (4, 5):
+                self._check_auth(method not in ('GET', 'HEAD'), headers)
+                return 200, self._handle_rest(method, parts[3:], data)
+            if is_v3 and len(parts) == 4:
+                params = dict(urlparse.parse_qsl(query))
+                if isinstance(data, dict):
+                    params.update(data)
+                self._check_auth(parts[3].endswith(WRITE_ACTIONS), headers)
+                result = self._handle_action(parts[3], params)
+                return 200, {'help': '', 'success': True, 'result': result}
+            raise _not_found()
+
+        except FakeCkanError, e:
+            if is_v3:
+                return e.status, {'help': '', 'success': False,
+                                  'error': e.to_dict()}
+            return e.status, {'error': e.to_dict()}
+
+    def _parse_body(self, body):
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise FakeCkanError(400, 'Bad Request', 'Invalid JSON body')
+
+    def _check_auth(self, is_write, headers):
+        if not is_write or self.api_key is None:
+            return
+        if headers.get('Authorization') != self.api_key:
+            raise FakeCkanError(403, 'Authorization Error',
+                                'Access denied')
+
+    def _handle_rest(self, method, parts, data):
+        obj_type = parts[0]
+        obj_id = parts[1] if len(parts) > 1 else None
+
+        if obj_type == 'licenses' and obj_id is None and method == 'GET':
+            return copy.deepcopy(LICENSES)
+
+        if obj_type == 'dataset':
+            if obj_id is None:
+                if method == 'GET':
+                    return self.list_datasets()
+                if method == 'POST':
+                    return self.create_dataset(data or {})
+            else:
+                if method == 'GET':
+                    return self.show_dataset(obj_id)
+                if method == 'PUT':
+                    return self.update_dataset(obj_id, data or {})
+                if method == 'DELETE':
+                    return self.delete_dataset(obj_id)
+
+        if obj_type == 'group':
+            if obj_id is None:
+                if method == 'GET':
+                    return self.list_groups()
+                if method == 'POST':
+                    return self.create_group(data or {})
+            else:
+                if method == 'GET':
+                    return self.show_group(obj_id)
+                if method == 'PUT':
+                    return self.update_group(obj_id, data or {})
+                if method == 'DELETE':
+                    return self.delete_group(obj_id)
+
+        raise _not_found()
+
+    def _handle_action(self, action, params):
+        if action == 'package_list':
+            return self.list_dataset_names()
+        if action == 'package_show':
+            return self.show_dataset(params.get('id'))
+        if action == 'package_search':
+            return self.search_datasets(params)
+        if action == 'organization_list':
+            return self.list_organizations()
+        if action == 'organization_show':
+            return self.show_organization(params.get('id'))
+        if action == 'organization_create':
+            return self.create_organization(params)
+        if action == 'organization_update':
+            return self.update_organization(params)
+        if action == 'organization_delete':
+            return self.delete_group(params.get('id'), organization=True)
+        if action in ('organization_purge', 'group_purge'):
+            return self.purge_group(params.get('id'),
+                                    organization=action.startswith('org'))
+        raise FakeCkanError(400, 'Bad Request',
+                            'Unknown action: {0}'.format(action))
+
+    # ------------------------------------------------------------
+    # Helpers
+
+    def _now(self):
+        """Current time, as a strictly increasing ISO 8601 string"""
+        now = datetime.datetime.utcnow()
+        if self._last_modified is not None and now <= self._last_modified:
+            now = self._last_modified + datetime.timedelta(microseconds=1)
+        self._last_modified = now
+        return now.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+    def _get_names(self, store):
+        """Get the name -> id index of a store"""
+        if store is self.datasets:
+            return self._dataset_names
+        return self._group_names
+
+    def _store(self, store, obj):
+        """Add / replace an object, keeping the name index up to date"""
+        names = self._get_names(store)
+        old = store.get(obj['id'])
+        if old is not None and names.get(old['name']) == obj['id']:
+            del names[old['name']]
+        store[obj['id']] = obj
+        names[obj['name']] = obj['id']
+
+    def _purge(self, store, obj_id):
+        """Remove an object, keeping the name index up to date"""
+        obj = store.pop(obj_id)
+        names = self._get_names(store)
+        if names.get(obj['name']) == obj_id:
+            del names[obj['name']]
+
+    def _check_name(self, store, name, obj_id=None):
+        if not isinstance(name, basestring) or not NAME_RE.match(name):
+            raise _validation_error('Invalid name: {0!r}'.format(name))
+        if self._get_names(store).get(name, obj_id) != obj_id:
+            raise _validation_error('That URL is already in use.')
+
+    def _find(self, store, key, organization=None):
+        obj = store.get(key)
+        if obj is None:
+            obj_id = self._get_names(store).get(key)
+            if obj_id is not None:
+                obj = store[obj_id]
+        if obj is None:
+            raise _not_found()
+        if (organization is not None
+                and obj['is_organization'] != organization):
+            raise _not_found()
+        return obj
+
+    def _resolve_group_id(self, key, organization):
+        try:
+            return self._find(self.groups, key, organization)['id']
+        except FakeCkanError:
+            raise _validation_error(
+                '{0} not found: {1}'.format(
+                    'Organization' if organization else 'Group', key))
+
+    def _iter_active_datasets(self):
+        for dataset in self.datasets.itervalues():
+            if dataset['state'] == 'active':
+                yield dataset
+
+    # ------------------------------------------------------------
+    # Datasets
+
+    def list_datasets(self):
+        with self._lock:
+            return sorted(d['id'] for d in self._iter_active_datasets())
+
+    def list_dataset_names(self):
+        with self._lock:
+            return sorted(d['name'] for d in self._iter_active_datasets())
+
+    def show_dataset(self, key):
+        with self._lock:
+            return copy.deepcopy(self._find(self.datasets, key))
+
+    def create_dataset(self, data):
+        with self._lock:
+            if data.get('id'):
+                raise _validation_error('Cannot specify an id')
+            dataset = dict(DATASET_DEFAULTS)
+            dataset.update({'extras': {}, 'groups': [], 'resources': [],
+                            'tags': []})
+            dataset['id'] = str(uuid.uuid4())
+            dataset['metadata_created'] = self._now()
+            self._update_dataset(dataset, data)
+            self._store(self.datasets, dataset)
+            return copy.deepcopy(dataset)
+
+    def update_dataset(self, key, data):
+        with self._lock:
+            dataset = copy.deepcopy(self._find(self.datasets, key))
+            if data.get('id') not in (None, dataset['id']):
+                raise _validation_error('Cannot change the dataset id')
+            self._update_dataset(dataset, data)
+            self._store(self.datasets, dataset)
+            return copy.deepcopy(dataset)
+
+    def _update_dataset(self, dataset, data):
+        """Apply API v2 updates to a dataset (validating them)"""
+
+        self._check_name(self.datasets, data.get('name', dataset.get('name')),
+                         dataset['id'])
+
+        for key, value in data.iteritems():
+            if key in ('id', 'metadata_created', 'metadata_modified'):
+                continue
+
+            if key == 'extras':
+                # Extras are merged; keys set to None are removed
+                for extra_key, extra_value in (value or {}).iteritems():
+                    if extra_value is None:
+                        dataset['extras'].pop(extra_key, None)
+                    else:
+                        dataset['extras'][extra_key] = extra_value
+
+            elif key == 'groups':
+                dataset['groups'] = [
+                    self._resolve_group_id(g, False) for g in value or []]
+
+            elif key == 'owner_org':
+                dataset['owner_org'] = (
+                    self._resolve_group_id(value, True) if value else value)
+
+            elif key == 'resources':
+                dataset['resources'] = self._make_resources(
+                    dataset, value or [])
+
+            else:
+                dataset[key] = value
+
+        dataset['metadata_modified'] = self._now()
+
+    def _make_resources(self, dataset, resources):
+        known_ids = set(r['id'] for r in dataset['resources'])
+        result = []
+        for position, data in enumerate(resources):
+            resource = dict(RESOURCE_DEFAULTS)
+            resource.update(data)
+            if resource.get('id') not in known_ids:
+                resource['id'] = str(uuid.uuid4())
+            resource['position'] = position
+            result.append(resource)
+        return result
+
+    def delete_dataset(self, key):
+        with self._lock:
+            dataset = self._find(self.datasets, key)
+            dataset['state'] = 'deleted'
+            dataset['metadata_modified'] = self._now()
+            return None
+
+    def search_datasets(self, params):
+        """Simplified ``package_search``: supports paging, sorting,
+        filtering by ``metadata_modified`` and selecting fields
+        (``id``, ``name``, ``metadata_modified``, ``extras_*``) only.
+        Private datasets are returned only with ``include_private``."""
+
+        try:
+            rows = int(params.get('rows', 10))
+            start = int(params.get('start', 0))
+        except ValueError:
+            raise _validation_error('Invalid paging parameters')
+
+        since = None
+        fq = params.get('fq')
+        if fq:
+            match = MODIFIED_FQ_RE.match(fq)
+            if match is None:
+                raise _validation_error('Unsupported filter: {0}'.format(fq))
+            since = match.group('since').rstrip('Z')
+
+        fields = None
+        if params.get('fl'):
+            fields = params['fl'].split(',')
+
+        sort = params.get('sort') or 'metadata_modified asc'
+        sort = [item.split() for item in sort.split(',')]
+        include_private = params.get('include_private') == 'true'
+
+        with self._lock:
+            results = [
+                d for d in self._iter_active_datasets()
+                if (since is None or d['metadata_modified'] >= since)
+                and (include_private or not d.get('private'))]
+            # Sorting is stable: sort by the last key first
+            for item in reversed(sort):
+                results.sort(key=lambda d: d.get(item[0]),
+                             reverse=(item[1:] == ['desc']))
+            count = len(results)
+            results = results[start:start + rows]
+            if fields is None:
+                results = [self._dataset_to_v3(d) for d in results]
+            else:
+                results = [_select_fields(d, fields) for d in results]
+
+        return {'count': count, 'results': results}
+
+    # ------------------------------------------------------------
+    # Groups and organizations
+
+    def list_groups(self):
+        with self._lock:
+            return sorted(g['id'] for g in self.groups.itervalues()
+                          if g['state'] == 'active'
+                          and not g['is_organization'])
+
+    def list_organizations(self):
+        with self._lock:
+            return sorted(g['name'] for g in self.groups.itervalues()
+                          if g['state'] == 'active' and g['is_organization'])
+
+    def show_group(self, key):
+        with self._lock:
+            return copy.deepcopy(self._find(self.groups, key, False))
+
+    def show_organization(self, key):
+        with self._lock:
+            return self._to_v3(self._find(self.groups, key, True))
+
+    def create_group(self, data, organization=False):
+        with self._lock:
+            if data.get('id'):
+                raise _validation_error('Cannot specify an id')
+            group = dict(GROUP_DEFAULTS)
+            group.update({'extras': {}, 'groups': [], 'tags': [],
+                          'id': str(uuid.uuid4()),
+                          'is_organization': organization,
+                          'type': 'organization' if organization else 'group',
+                          'created': self._now()})
+            self._update_group(group, data)
+            self._store(self.groups, group)
+            return copy.deepcopy(group)
+
+    def update_group(self, key, data, organization=False):
+        with self._lock:
+            group = copy.deepcopy(self._find(self.groups, key, organization))
+            if data.get('id') not in (None, group['id']):
+                raise _validation_error('Cannot change the group id')
+            self._update_group(group, data)
+            self._store(self.groups, group)
+            return copy.deepcopy(group)
+
+    def _update_group(self, group, data):
+        self._check_name(self.groups, data.get('name', group.get('name')),
+                         group['id'])
+        for key, value in data.iteritems():
+            if key in ('id', 'is_organization', 'type', 'created'):
+                continue
+            if key == 'extras':
+                for extra_key, extra_value in (value or {}).iteritems():
+                    if extra_value is None:
+                        group['extras'].pop(extra_key, None)
+                    else:
+                        group['extras'][extra_key] = extra_value
+            elif key == 'groups':
+                group['groups'] = [
+                    self._resolve_group_id(g, False) for g in value or []]
+            else:
+                group[key] = value
+
+    def create_organization(self, data):
+        return self._to_v3(self.create_group(self._from_v3(data), True))
+
+    def update_organization(self, data):
+        key = data.get('id') or data.get('name')
+        return self._to_v3(self.update_group(key, self._from_v3(data), True))
+
+    def delete_group(self, key, organization=False):
+        with self._lock:
+            self._find(self.groups, key, organization)['state'] = 'deleted'
+            return None
+
+    def purge_group(self, key, organization=False):
+        with self._lock:
+            self._purge(self.groups,
+                        self._find(self.groups, key, organization)['id'])
+            return None
+
+    def _from_v3(self, data):
+        """Convert API v3 extras (list of key/value dicts) to a dict"""
+        data = dict(data)
+        if 'extras' in data:
+            extras = {}
+            for item in data['extras'] or []:
+                extras[item['key']] = item['value']
+            data['extras'] = extras
+        return data
+
+    def _dataset_to_v3(self, dataset):
+        data = copy.deepcopy(dataset)
+        data['extras'] = [{'key': key, 'value': value}
+                          for key, value in sorted(dataset['extras'].items())]
+        data['groups'] = [
+            {'id': gid, 'name': self.groups[gid]['name']}
+            for gid in dataset['groups'] if gid in self.groups]
+        data['tags'] = [{'name': tag} for tag in dataset['tags']]
+        organization = self.groups.get(dataset.get('owner_org'))
+        data['organization'] = (
+            None if organization is None else
+            {'id': organization['id'], 'name': organization['name']})
+        return data
+
+    def _to_v3(self, group):
+        data = copy.deepcopy(group)
+        data['extras'] = [{'key': key, 'value': value}
+                          for key, value in sorted(group['extras'].items())]
+        data['groups'] = [
+            {'id': gid, 'name': self.groups[gid]['name']}
+            for gid in group['groups'] if gid in self.groups]
+        return data
+
+
+class FakeCkanServer(object):
+    """
+    HTTP server exposing a :py:class:`FakeCkan`, running in a
+    background thread.
+
+    Requests are served by separate threads, so the server can be
+    used to measure the effect of client-side concurrency.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, api_key='fake-api-key',
+                 latency=0, error_rate=0, error_status=503,
+                 rate_limit=None, workers=None, seed=None):
+        """
+        :param host: address to listen on
+        :param port: port to listen on (by default, a free one)
+        :param api_key:
+            API key required for write requests (``None`` to
+            disable authorization)
+        :param latency:
+            delay added to each request, in seconds. Can also be a
+            ``(min, max)`` tuple, to pick random values in a range.
+        :param error_rate:
+            fraction of the requests (0 to 1) to be failed with
+            ``error_status``, before being processed
+        :param error_status: HTTP status code for injected errors
+        :param rate_limit:
+            maximum number of requests per second; requests over
+            the limit are rejected with a ``503`` status.
+        :param workers:
+            maximum number of requests to be processed at once;
+            other requests wait for a free worker.
+        :param seed: seed for the random latency / errors
+        """
+
+        self.ckan = FakeCkan(api_key=api_key)
+        self.api_key = api_key
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.request_count = 0
+        self.counts = {}
+        self._random = random.Random(seed)
+        self._injected = []
+        self._lock = threading.Lock()
+        self._workers = (threading.Semaphore(workers)
+                         if workers else None)
+        self._tokens = float(rate_limit or 0)
+        self._tokens_updated = time.time()
+
+        self._httpd = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.fake_server = self
+        self._thread = None
+
+    @property
+    def server_url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        name='fake-ckan-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def fail_next(self, count=1, status=None):
+        """Fail the next ``count`` requests with the given status"""
+        with self._lock:
+            self._injected.extend(
+                [status or self.error_status] * count)
+
+    def count_requests(self, method, path_template):
+        """Number of requests received for a path template (see
+        :py:func:`get_path_template
+        <ckan_api_client.hooks.get_path_template>`)"""
+        return self.counts.get((method, path_template), 0)
+
+    def handle_request(self, method, path, headers, body):
+        """
+        Process a request, applying the simulated conditions.
+
+        :return: a ``(status, extra_headers, response_data)`` tuple
+        """
+
+        with self._lock:
+            self.request_count += 1
+            key = (method, get_path_template(path))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            delay = self._get_delay()
+            if self._injected:
+                error_status = self._injected.pop(0)
+            elif self.error_rate and self._random.random() < self.error_rate:
+                error_status = self.error_status
+            else:
+                error_status = None
+            throttled = not self._take_token()
+
+        if throttled:
+            return 503, [('Retry-After', '1')], {
+                'error': {'__type': 'Throttled',
+                          'message': 'Rate limit exceeded'}}
+
+        if self._workers is not None:
+            self._workers.acquire()
+        try:
+            if delay:
+                time.sleep(delay)
+            if error_status is not None:
+                return error_status, [], {
+                    'error': {'__type': 'Injected Error',
+                              'message': 'Simulated failure'}}
+            status, data = self.ckan.handle(method, path, headers, body)
+            return status, [], data
+        finally:
+            if self._workers is not None:
+                self._workers.release()
+
+    def _get_delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            return self._random.uniform(*self.latency)
+        return self.latency
+
+    def _take_token(self):
+        """Token bucket, allowing bursts of up to ``rate_limit``"""
+        if not self.rate_limit:
+            return True
+        now = time.time()
+        self._tokens = min(
+            float(self.rate_limit),
+            self._tokens + (now - self._tokens_updated) * self.rate_limit)
+        self._tokens_updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # With persistent connections, sending responses in small
+    # unbuffered writes would hit the Nagle / delayed ACK stall
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        status, headers, data = self.server.fake_server.handle_request(
+            self.command, self.path, self.headers, body)
+        payload = '' if data is None else json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
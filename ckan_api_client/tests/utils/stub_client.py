@@ -0,0 +1,170 @@
+"""
+In-memory stand-in for the high-level client, used to test
+the synchronization logic without a running Ckan.
+"""
+
+import copy
+import uuid
+
+from ckan_api_client.exceptions import HTTPError
+from ckan_api_client.objects import CkanDataset, CkanGroup, CkanOrganization
+
+
+class StubHighlevelClient(object):
+    """
+    Implements the subset of :py:class:`CkanHighlevelClient
+    <ckan_api_client.high_level.CkanHighlevelClient>` used by the
+    synchronization client, keeping objects in dictionaries.
+
+    Each call is recorded in :py:attr:`calls` as a
+    ``(method_name, argument)`` tuple.
+
+    Lookups iterate over copies of the stores, as objects can be
+    added concurrently by other threads.
+    """
+
+    def __init__(self):
+        self.datasets = {}
+        self.groups = {}
+        self.organizations = {}
+        self.calls = []
+        # {id: metadata_modified}, updated on each write
+        self.modified = {}
+        self._clock = 0
+
+    def count_calls(self, name):
+        return len([c for c in self.calls if c[0] == name])
+
+    # ------------------------------------------------------------
+    # Datasets
+
+    def list_datasets(self):
+        self.calls.append(('list_datasets', None))
+        return sorted(self.datasets)
+
+    def list_dataset_names(self):
+        self.calls.append(('list_dataset_names', None))
+        return sorted(data['name'] for data in self.datasets.itervalues())
+
+    def _touch(self, id):
+        self._clock += 1
+        self.modified[id] = '2014-01-01T00:00:{0:09.6f}'.format(
+            self._clock / 1000.0)
+
+    def iter_modified_dataset_ids(self, since=None, page_size=100):
+        self.calls.append(('iter_modified_dataset_ids', since))
+        for modified, id in sorted(
+                (m, i) for i, m in self.modified.iteritems()
+                if i in self.datasets):
+            if since is None or modified >= since:
+                yield id, modified
+
+    def iter_datasets(self):
+        for id in self.list_datasets():
+            yield self.get_dataset(id)
+
+    def iter_dataset_fields(self, fields, page_size=1000, concurrency=4):
+        self.calls.append(('iter_dataset_fields', tuple(fields)))
+        for data in self.datasets.values():
+            result = {}
+            for field in fields:
+                if field.startswith('extras_'):
+                    value = data['extras'].get(field[len('extras_'):])
+                else:
+                    value = data.get(field)
+                if value is not None:
+                    result[field] = value
+            yield result
+
+    def get_dataset(self, id, allow_deleted=False):
+        self.calls.append(('get_dataset', id))
+        if id not in self.datasets:
+            raise HTTPError(404, 'Not found')
+        return CkanDataset(copy.deepcopy(self.datasets[id]))
+
+    def get_dataset_by_name(self, name, allow_deleted=False):
+        self.calls.append(('get_dataset_by_name', name))
+        for data in self.datasets.values():
+            if data['name'] == name:
+                return CkanDataset(copy.deepcopy(data))
+        raise HTTPError(404, 'Not found')
+
+    def _check_name(self, obj_id, name):
+        for other in self.datasets.values():
+            if other['name'] == name and other['id'] != obj_id:
+                raise HTTPError(409, 'Name already in use')
+
+    def create_dataset(self, dataset, verify=None):
+        self.calls.append(('create_dataset', dataset.name))
+        data = dataset.serialize()
+        self._check_name(None, data['name'])
+        data['id'] = str(uuid.uuid4())
+        for resource in data['resources']:
+            resource['id'] = str(uuid.uuid4())
+        self.datasets[data['id']] = data
+        self._touch(data['id'])
+        return CkanDataset(copy.deepcopy(data))
+
+    def update_dataset(self, dataset, verify=None):
+        self.calls.append(('update_dataset', dataset.id))
+        data = dataset.serialize()
+        if data['id'] not in self.datasets:
+            raise HTTPError(404, 'Not found')
+        self._check_name(data['id'], data['name'])
+        self.datasets[data['id']] = data
+        self._touch(data['id'])
+        return CkanDataset(copy.deepcopy(data))
+
+    def delete_dataset(self, id):
+        self.calls.append(('delete_dataset', id))
+        self.datasets.pop(id, None)
+
+    # ------------------------------------------------------------
+    # Groups and organizations
+
+    def _get_by_name(self, store, klass, name):
+        for data in store.values():
+            if data['name'] == name:
+                return klass(copy.deepcopy(data))
+        raise HTTPError(404, 'Not found')
+
+    def _save(self, store, klass, obj):
+        data = obj.serialize()
+        if data.get('id') is None:
+            data['id'] = str(uuid.uuid4())
+        store[data['id']] = data
+        return klass(copy.deepcopy(data))
+
+    def get_group_by_name(self, name, allow_deleted=False):
+        self.calls.append(('get_group_by_name', name))
+        return self._get_by_name(self.groups, CkanGroup, name)
+
+    def create_group(self, group, verify=None):
+        self.calls.append(('create_group', group.name))
+        return self._save(self.groups, CkanGroup, group)
+
+    def update_group(self, group, verify=None):
+        self.calls.append(('update_group', group.name))
+        return self._save(self.groups, CkanGroup, group)
+
+    def get_organization_by_name(self, name, allow_deleted=False):
+        self.calls.append(('get_organization_by_name', name))
+        return self._get_by_name(
+            self.organizations, CkanOrganization, name)
+
+    def create_organization(self, organization, verify=None):
+        self.calls.append(('create_organization', organization.name))
+        return self._save(
+            self.organizations, CkanOrganization, organization)
+
+    def update_organization(self, organization, verify=None):
+        self.calls.append(('update_organization', organization.name))
+        return self._save(
+            self.organizations, CkanOrganization, organization)
+
+    def get_request_stats(self):
+        return {'calls': len(self.calls), 'errors': 0,
+                'bytes_sent': 0, 'bytes_received': 0}
+
+    def wait_verification(self):
+        pass
@@ -0,0 +1,258 @@
+"""
+Optional tracing of nested operations (synchronization phases,
+high-level client calls, HTTP requests, ..), collected in-process.
+
+Tracing is disabled by default, and costs (almost) nothing until
+enabled by calling :py:func:`enable`::
+
+    from ckan_api_client import tracing
+
+    collector = tracing.enable()
+    client.sync('my-source', data)
+    tracing.disable()
+
+    with open('trace.jsonl', 'w') as fp:
+        collector.dump_jsonl(fp)
+
+Each span records its name, start time, duration, attributes and
+the id of its parent span. Nesting is tracked per-thread; spans
+started in other threads (eg. by thread pools) need their parent
+to be passed explicitly.
+"""
+
+import functools
+import json
+import random
+import threading
+import time
+
+from .objects.base import BaseObject
+
+
+class Span(object):
+    """
+    A traced operation, to be used as a context manager.
+
+    .. attribute:: attributes
+
+        Dict of extra information about the operation,
+        that can be extended by calling :py:meth:`set`.
+    """
+
+    def __init__(self, tracer, name, trace_id, span_id, parent_id=None,
+                 attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.thread = None
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def set(self, key, value):
+        """Set an attribute of the span"""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.thread = threading.current_thread().name
+        self.tracer._push(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.time() - self.start
+        if exc_type is not None:
+            self.error = '{0}: {1}'.format(exc_type.__name__, exc_value)
+        self.tracer._pop(self)
+        self.tracer.collector.add(self)
+        return False
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'thread': self.thread,
+            'start': self.start,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return '<Span {0} {1}>'.format(self.name, self.span_id)
+
+
+class _NullSpan(object):
+    """Span doing nothing, used when tracing is disabled"""
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class SpanCollector(object):
+    """Thread-safe in-memory collector of completed spans"""
+
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    @property
+    def spans(self):
+        """List of collected spans, in order of completion"""
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            del self._spans[:]
+
+    def __len__(self):
+        return len(self._spans)
+
+    def dump_jsonl(self, fp):
+        """Write collected spans to a file object, one JSON per line"""
+        for span in self.spans:
+            fp.write(json.dumps(span.to_dict()))
+            fp.write('\n')
+
+
+class Tracer(object):
+    """Creates spans, keeping track of the current one in each thread"""
+
+    def __init__(self, collector=None):
+        if collector is None:
+            collector = SpanCollector()
+        self.collector = collector
+        self._local = threading.local()
+
+    def _get_stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _push(self, span):
+        self._get_stack().append(span)
+
+    def _pop(self, span):
+        stack = self._get_stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+
+    def current_span(self):
+        """The innermost active span in this thread, or ``None``"""
+        stack = self._get_stack()
+        if stack:
+            return stack[-1]
+        return None
+
+    def span(self, span_name, parent=None, **attributes):
+        """
+        Create a new span, child of ``parent`` (by default, the
+        current span of this thread).
+        """
+        if parent is None:
+            parent = self.current_span()
+        if parent is None:
+            trace_id, parent_id = _new_id(), None
+        else:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        return Span(self, span_name, trace_id, _new_id(), parent_id,
+                    attributes)
+
+
+_tracer = None
+
+
+def enable(collector=None):
+    """
+    Enable tracing.
+
+    :param collector: the :py:class:`SpanCollector` to be used
+        (a new one is created by default)
+    :return: the collector
+    """
+    global _tracer
+    _tracer = Tracer(collector)
+    return _tracer.collector
+
+
+def disable():
+    """Disable tracing"""
+    global _tracer
+    _tracer = None
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(span_name, parent=None, **attributes):
+    """
+    Start a span, if tracing is enabled. To be used as a context
+    manager; returns a dummy span when tracing is disabled.
+    """
+    if _tracer is None:
+        return NULL_SPAN
+    return _tracer.span(span_name, parent=parent, **attributes)
+
+
+def current_span():
+    """The current span in this thread, or ``None``"""
+    if _tracer is None:
+        return None
+    return _tracer.current_span()
+
+
+def traced(name, arg_name='id'):
+    """
+    Decorator tracing calls to a method.
+
+    The first argument (after ``self``) is recorded in the span
+    attributes as ``arg_name``; for Ckan objects, their ``id``
+    and ``name`` are recorded instead.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if _tracer is None:
+                return func(self, *args, **kwargs)
+            attributes = {}
+            if args:
+                arg = args[0]
+                if isinstance(arg, BaseObject):
+                    attributes['id'] = getattr(arg, 'id', None)
+                    attributes['name'] = getattr(arg, 'name', None)
+                elif isinstance(arg, basestring):
+                    attributes[arg_name] = arg
+            with _tracer.span(name, **attributes):
+                return func(self, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def _new_id():
+    return '{0:016x}'.format(random.getrandbits(64))
@@ -1,5 +1,9 @@
 from collections import (namedtuple, Sequence, MutableSequence,
                          MutableMapping)
+from multiprocessing.pool import ThreadPool
+import itertools
+import Queue
+import threading
 
 # If we're using Python < 2.7, there is no OrderedDict in the
 # collections module, so we should fallback on using the one from
@@ -22,6 +26,91 @@ class IDPair(namedtuple('IDPair', ['source_id', 'ckan_id'])):
     __slots__ = ()
 
 
+class BatchResult(namedtuple('BatchResult',
+                             ['index', 'item', 'result', 'error'])):
+    """
+    Outcome of an operation run on an item of a batch,
+    see :py:func:`iter_parallel`.
+
+    Keys: ``index`` (position of the item in the input),
+    ``item``, ``result`` and ``error`` (the exception raised
+    by the operation, or ``None`` if it succeeded).
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def iter_chunks(iterable, size):
+    """Split an iterable in lists of (at most) ``size`` items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_parallel(func, iterable, concurrency=4, max_pending=None):
+    """
+    Call ``func(item)`` on each item from ``iterable``, using a
+    pool of ``concurrency`` threads.
+
+    Items are consumed lazily from the iterable: no more than
+    ``max_pending`` (default: twice the concurrency) items are
+    taken before the corresponding results have been consumed,
+    so that slow consumers apply back-pressure on the input.
+
+    Exceptions raised by ``func`` don't stop the processing,
+    but are reported in the ``error`` field of the results.
+
+    :return:
+        generator yielding a :py:class:`BatchResult` for each
+        item, in order of completion.
+    """
+
+    if max_pending is None:
+        max_pending = concurrency * 2
+    results = Queue.Queue()
+
+    def _run(index, item):
+        try:
+            result = func(item)
+        except Exception, e:
+            return BatchResult(index, item, None, e)
+        return BatchResult(index, item, result, None)
+
+    def _get_result():
+        # Calling Queue.get() with no timeout would make the
+        # process deaf to KeyboardInterrupt..
+        while True:
+            try:
+                return results.get(True, 1)
+            except Queue.Empty:
+                pass
+
+    pool = ThreadPool(concurrency)
+    try:
+        pending = 0
+        for index, item in enumerate(iterable):
+            pool.apply_async(_run, (index, item), callback=results.put)
+            pending += 1
+            while pending >= max_pending:
+                yield _get_result()
+                pending -= 1
+        while pending > 0:
+            yield _get_result()
+            pending -= 1
+
+    finally:
+        # If the generator was closed early, we still wait for
+        # the already started operations to complete.
+        pool.close()
+        pool.join()
+
+
 class SuppressExceptionIf(object):
     """
     Context manager used to suppress exceptions if they match
@@ -54,11 +143,24 @@ class IDMap(object):
     """
     Two-way hashmap to map source ids to ckan ids
     and the other way back.
+
+    Thread-safe: pairs can be added / removed concurrently.
     """
 
     def __init__(self):
         self._source_to_ckan = {}
         self._ckan_to_source = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     def to_ckan(self, source_id):
         """Convert a source id to ckan id"""
@@ -77,17 +179,18 @@ class IDMap(object):
         :raises ValueError:
             if one of the two ids is found in a mismatching pair
         """
-        # Check both directions first..
-        if pair.source_id in self._source_to_ckan:
-            if self._source_to_ckan[pair.source_id] != pair.ckan_id:
-                raise ValueError("Mismatching information")
+        with self._lock:
+            # Check both directions first..
+            if pair.source_id in self._source_to_ckan:
+                if self._source_to_ckan[pair.source_id] != pair.ckan_id:
+                    raise ValueError("Mismatching information")
 
-        if pair.ckan_id in self._ckan_to_source:
-            if self._ckan_to_source[pair.ckan_id] != pair.source_id:
-                raise ValueError("Mismatching information")
+            if pair.ckan_id in self._ckan_to_source:
+                if self._ckan_to_source[pair.ckan_id] != pair.source_id:
+                    raise ValueError("Mismatching information")
 
-        self._source_to_ckan[pair.source_id] = pair.ckan_id
-        self._ckan_to_source[pair.ckan_id] = pair.source_id
+            self._source_to_ckan[pair.source_id] = pair.ckan_id
+            self._ckan_to_source[pair.ckan_id] = pair.source_id
 
     def remove(self, pair):
         """
@@ -98,17 +201,80 @@ class IDMap(object):
         :raises ValueError:
             if one of the two ids is found in a mismatching pair
         """
-        # Check both directions first..
-        if pair.source_id in self._source_to_ckan:
-            if self._source_to_ckan[pair.source_id] != pair.ckan_id:
-                raise ValueError("Mismatching information")
+        with self._lock:
+            # Check both directions first..
+            if pair.source_id in self._source_to_ckan:
+                if self._source_to_ckan[pair.source_id] != pair.ckan_id:
+                    raise ValueError("Mismatching information")
+
+            if pair.ckan_id in self._ckan_to_source:
+                if self._ckan_to_source[pair.ckan_id] != pair.source_id:
+                    raise ValueError("Mismatching information")
+
+            del self._source_to_ckan[pair.source_id]
+            del self._ckan_to_source[pair.ckan_id]
+
+
+class IdentityMap(object):
+    """
+    Thread-safe cache of objects, indexed by both their
+    ``id`` and ``name`` attributes.
+
+    Used by the high-level client to avoid fetching (and building)
+    the same object over and over again.
+    """
 
-        if pair.ckan_id in self._ckan_to_source:
-            if self._ckan_to_source[pair.ckan_id] != pair.source_id:
-                raise ValueError("Mismatching information")
+    def __init__(self):
+        self._by_id = {}
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def get_by_id(self, id):
+        """Return the object with this id, or ``None``"""
+        return self._by_id.get(id)
+
+    def get_by_name(self, name):
+        """Return the object with this name, or ``None``"""
+        return self._by_name.get(name)
 
-        del self._source_to_ckan[pair.source_id]
-        del self._ckan_to_source[pair.ckan_id]
+    def add(self, obj):
+        """
+        Add an object to the map, replacing any previously
+        stored one with the same id or name.
+        """
+        with self._lock:
+            self._discard(id=obj.id, name=obj.name)
+            if obj.id is not None:
+                self._by_id[obj.id] = obj
+            if obj.name is not None:
+                self._by_name[obj.name] = obj
+
+    def discard(self, id=None, name=None):
+        """
+        Remove the objects with the given id and/or name.
+        Missing objects are simply ignored.
+        """
+        with self._lock:
+            self._discard(id=id, name=name)
+
+    def _discard(self, id=None, name=None):
+        if id is not None:
+            obj = self._by_id.pop(id, None)
+            if obj is not None and self._by_name.get(obj.name) is obj:
+                del self._by_name[obj.name]
+        if name is not None:
+            obj = self._by_name.pop(name, None)
+            if obj is not None and self._by_id.get(obj.id) is obj:
+                del self._by_id[obj.id]
+
+    def clear(self):
+        """Remove all the objects from the map"""
+        with self._lock:
+            self._by_id.clear()
+            self._by_name.clear()
+
+    def __len__(self):
+        return len(self._by_id)
 
 
 # ------------------------------------------------------------
@@ -0,0 +1,207 @@
+"""
+Policies for verifying objects written to Ckan.
+
+After each create / update, the high-level client compares the object
+returned by the API with the one that was sent, in order to catch
+inconsistencies early. That check is pretty expensive, so it can be
+tuned (or disabled altogether) using a :py:class:`VerificationPolicy`.
+"""
+
+import logging
+import threading
+import Queue
+
+from .exceptions import OperationFailure
+from .utils import WrappedList
+
+
+logger = logging.getLogger(__name__)
+
+
+VERIFY_FULL = 'full'
+VERIFY_SAMPLED = 'sampled'
+VERIFY_FINGERPRINT = 'fingerprint'
+VERIFY_OFF = 'off'
+
+VERIFY_MODES = (VERIFY_FULL, VERIFY_SAMPLED, VERIFY_FINGERPRINT, VERIFY_OFF)
+
+
+class VerificationPolicy(object):
+    """
+    Decide whether / how to verify written objects.
+
+    :param mode: One of:
+
+        - ``'full'`` (default) run a full :py:meth:`is_equivalent`
+          comparison after each write
+        - ``'sampled'`` run the full comparison on one write
+          every ``sample_rate``
+        - ``'fingerprint'`` only compare a cheap fingerprint
+          of the two objects (see :py:func:`object_fingerprint`)
+        - ``'off'`` don't verify anything
+
+    :param sample_rate:
+        Verify one object every ``sample_rate`` writes, when
+        using the ``'sampled'`` mode.
+
+    :param background:
+        If ``True``, verification will be run in a separate thread,
+        off the write path. Mismatches are reported when calling
+        :py:meth:`CkanHighlevelClient.wait_verification`.
+    """
+
+    def __init__(self, mode=VERIFY_FULL, sample_rate=10, background=False):
+        if mode not in VERIFY_MODES:
+            raise ValueError("Invalid verification mode: {0!r}"
+                             .format(mode))
+        if sample_rate < 1:
+            raise ValueError("sample_rate must be a positive integer")
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.background = background
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, policy):
+        """
+        Return a policy from a ``VerificationPolicy`` instance,
+        a mode name or ``None`` (meaning the default policy).
+        """
+        if policy is None:
+            return cls()
+        if isinstance(policy, VerificationPolicy):
+            return policy
+        return cls(mode=policy)
+
+    def should_verify(self):
+        """Decide whether the next written object should be checked"""
+
+        if self.mode == VERIFY_OFF:
+            return False
+
+        if self.mode == VERIFY_SAMPLED:
+            with self._lock:
+                self._counter += 1
+                return (self._counter - 1) % self.sample_rate == 0
+
+        return True
+
+    def check(self, expected, actual):
+        """
+        Compare two objects, according to the configured mode.
+
+        :return: ``True`` if the objects match
+        """
+        if self.mode == VERIFY_FINGERPRINT:
+            return object_fingerprint(expected) == object_fingerprint(actual)
+        return actual.is_equivalent(expected)
+
+    def __repr__(self):
+        return ("{0}(mode={1!r}, sample_rate={2!r}, background={3!r})"
+                .format(self.__class__.__name__, self.mode,
+                        self.sample_rate, self.background))
+
+
+def object_fingerprint(obj):
+    """
+    Build a cheap "fingerprint" of a Ckan object.
+
+    Scalar fields are taken as they are, while for containers
+    (lists, dicts, ..) only the number of (non-null) items is
+    taken into account. Key fields are ignored.
+
+    :return: a tuple of ``(name, value)`` pairs
+    """
+
+    fingerprint = []
+    for name, field in obj.iter_fields():
+        if field.is_key:
+            continue
+        value = field.get(obj, name)
+        if value is None:
+            value = field.get_default()
+        if isinstance(value, dict):
+            value = len([v for v in value.itervalues() if v is not None])
+        elif isinstance(value, (list, tuple, set, WrappedList)):
+            value = len(value)
+        fingerprint.append((name, value))
+    return tuple(fingerprint)
+
+
+class BackgroundVerifier(object):
+    """
+    Run verification of written objects in a separate thread.
+
+    Objects are passed as ``(class, data)`` pairs and only built
+    in the worker thread, to keep their construction off the
+    write path too.
+    """
+
+    def __init__(self, on_mismatch):
+        """
+        :param on_mismatch:
+            function called as ``on_mismatch(message, expected, actual)``
+            when two objects don't match
+        """
+        self._on_mismatch = on_mismatch
+        self._queue = Queue.Queue()
+        self._failures = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def submit(self, policy, message, expected, actual):
+        """
+        Queue a verification.
+
+        :param policy: the :py:class:`VerificationPolicy` to use
+        :param message: message to be reported on mismatch
+        :param expected: ``(class, data)`` of the object sent to Ckan
+        :param actual: ``(class, data)`` of the object returned
+        """
+        self._ensure_started()
+        self._queue.put((policy, message, expected, actual))
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                self._verify(*task)
+            except Exception:  # we don't want the worker to die
+                logger.exception('Error while verifying object')
+            finally:
+                self._queue.task_done()
+
+    def _verify(self, policy, message, expected, actual):
+        expected_obj = expected[0](expected[1])
+        actual_obj = actual[0](actual[1])
+        if policy.check(expected_obj, actual_obj):
+            return
+        try:
+            self._on_mismatch(message, expected_obj, actual_obj)
+        except OperationFailure, e:
+            with self._lock:
+                self._failures.append(e)
+
+    def wait(self):
+        """
+        Wait for all the queued verifications to complete.
+
+        :raises OperationFailure:
+            if any of the verifications failed (only when the
+            ``on_mismatch`` callback raises that exception)
+        """
+        self._queue.join()
+        with self._lock:
+            failures, self._failures = self._failures, []
+        if failures:
+            raise OperationFailure(
+                "{0} written object(s) didn't match: {1}".format(
+                    len(failures), '; '.join(str(f) for f in failures)))
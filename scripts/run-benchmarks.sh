@@ -0,0 +1,2 @@
+#!/bin/sh
+exec python -m ckan_api_client.tests.benchmarks.bench_objects "$@"
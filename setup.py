@@ -28,6 +28,8 @@ tests_require = [
 # Shorten names
 _cch = 'ckan_api_client.commands.client_hilev'
 _ccs = 'ckan_api_client.commands.syncing'
+_ccm = 'ckan_api_client.commands.mirror'
+_ccsrc = 'ckan_api_client.commands.sources'
 
 entry_points = {
     'console_scripts': [
@@ -38,8 +40,14 @@ entry_points = {
         'iter_datasets = {0}:IterDatasets'.format(_cch),
         'get_dataset = {0}:GetDataset'.format(_cch),
         'import_dataset = {0}:ImportDataset'.format(_cch),
+        'export_datasets = {0}:ExportDatasets'.format(_cch),
         'import_directory = {0}:ImportDirectory'.format(_ccs),
         'import_sqlite = {0}:ImportSQLite'.format(_ccs),
+        'import_archive = {0}:ImportArchive'.format(_ccs),
+        'sync_sources = {0}:SyncSources'.format(_ccs),
+        'archive_create = {0}:ArchiveCreate'.format(_ccsrc),
+        'archive_extract = {0}:ArchiveExtract'.format(_ccsrc),
+        'mirror = {0}:Mirror'.format(_ccm),
     ],
 }
 